@@ -0,0 +1,5 @@
+import sys
+
+from TikTokManager.cli import main
+
+sys.exit(main())
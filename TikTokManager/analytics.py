@@ -0,0 +1,335 @@
+"""
+Monthly analytics of the mined dataset and of its sentiment results.
+- reads the typed columnar output of the sinks (parquet, sqlite, jsonl) instead of the excel export
+- dates are parsed and scores / counts are cast once per column, never row by row
+- monthly score distributions, approval shares, moving averages and engagement totals with group-bys
+- RollupStore keeps the additive monthly aggregates in sqlite and updates them with each new batch,
+  so dashboards read a few rows per month instead of the whole dataset
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from TikTokManager.sinks import SINKS, guess_format
+
+COMMENT_DATE_FORMAT = "%d-%m-%Y %H:%M"
+APPROVAL_LABELS = ['Approved', 'Disapproved', 'Neutral']
+ENGAGEMENT_COLUMNS = ['total_videos', 'total_likes', 'total_comments', 'liked_videos', 'commented_videos']
+
+
+def read_table(path:str, table:str, output_format:str = None) -> pd.DataFrame:
+    """
+    Read a table of a sink output with its column types
+
+    args:
+    - path: sink path (parquet / jsonl folder or sqlite file)
+    - table: table name, "videos_data" or "comments_data"
+    - output_format: "parquet", "sqlite" or "jsonl", guessed from the path if None
+
+    return:
+    - DataFrame with the stored rows
+    """
+    if output_format is None:
+        output_format = guess_format(path)
+    if output_format not in SINKS:
+        raise ValueError(f'Only allowed `output_format` values are {", ".join(SINKS)}.')
+    with SINKS[output_format](path) as sink:
+        return sink.read(table)
+
+
+def parse_dates(values:pd.Series, date_format:str = None) -> pd.Series:
+    """
+    Parse a date column in one vectorized call, invalid dates become NaT
+
+    args:
+    - values: column with dates (strings or datetimes)
+    - date_format: strptime format of the strings, "%d-%m-%Y %H:%M" for comments, None to infer it (ISO video timestamps)
+
+    return:
+    - Datetime series
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, format=date_format, errors='coerce')
+
+
+def to_months(values:pd.Series, date_format:str = None) -> pd.Series:
+    """Monthly period of every date of a column"""
+    return parse_dates(values, date_format).dt.to_period('M')
+
+
+def approval(scores:pd.Series) -> pd.Series:
+    """Approval label of every score: Approved (>= 4), Disapproved (<= 2) or Neutral"""
+    scores = pd.to_numeric(scores, errors='coerce')
+    return pd.Series(np.select([scores >= 4, scores <= 2], ['Approved', 'Disapproved'], 'Neutral'), index=scores.index)
+
+
+def score_counts(df:pd.DataFrame, date_column:str = 'date', score_column:str = 'score', date_format:str = None) -> pd.DataFrame:
+    """
+    Amount of rows per month and score, the additive aggregate of every score rollup
+
+    args:
+    - df: sentiment results with a date and a score column (scores that are not numbers, like "NA", are dropped)
+    - date_column: column with the date
+    - score_column: column with the score
+    - date_format: strptime format of the dates, None to infer it
+
+    return:
+    - DataFrame with the columns month ("YYYY-MM"), score and count
+    """
+    frame = pd.DataFrame({"month": to_months(df[date_column], date_format),
+                          "score": pd.to_numeric(df[score_column], errors='coerce')}).dropna()
+    frame['score'] = frame['score'].astype(int)
+    counts = frame.groupby(['month', 'score'], sort=True).size().rename('count').reset_index()
+    # Months are formatted once per group, not once per row
+    counts['month'] = counts['month'].astype(str)
+    return counts
+
+
+def score_distribution(counts:pd.DataFrame) -> pd.DataFrame:
+    """
+    Monthly score distribution (count_ratings_by_month of the notebooks) from the counts per month and score
+
+    args:
+    - counts: DataFrame with the columns month, score and count
+
+    return:
+    - DataFrame indexed by month with one count column per score, the total, the average rating
+      and a `<score>_percent` column per score
+    """
+    result = counts.pivot_table(index='month', columns='score', values='count', aggfunc='sum', fill_value=0)
+    result.columns = [int(score) for score in result.columns]
+    scores = result.columns.to_numpy()
+    result['total'] = result[scores].sum(axis=1)
+    result['average_rating'] = (result[scores].to_numpy() @ scores / result['total']).round(2)
+    for score in scores:
+        result[f"{score}_percent"] = (result[score] / result['total'] * 100).round(2)
+    result.index = pd.PeriodIndex(result.index, freq='M', name='month')
+    return result
+
+
+def approval_distribution(counts:pd.DataFrame, window:int = 3) -> pd.DataFrame:
+    """
+    Monthly approval shares (approval_by_month of the notebooks) from the counts per month and score
+
+    args:
+    - counts: DataFrame with the columns month, score and count
+    - window: months of the centered moving average of the approved share
+
+    return:
+    - DataFrame indexed by month with the Approved, Disapproved and Neutral counts, the total,
+      a `<label>_percent` column per label and `rolling_avg_aproval`
+    """
+    frame = counts.assign(Approval=approval(counts['score']).to_numpy())
+    result = frame.pivot_table(index='month', columns='Approval', values='count', aggfunc='sum', fill_value=0)
+    result = result.reindex(columns=APPROVAL_LABELS, fill_value=0)
+    result.columns.name = None
+    result['total'] = result[APPROVAL_LABELS].sum(axis=1)
+    for label in APPROVAL_LABELS:
+        result[f"{label}_percent"] = (result[label] / result['total'] * 100).round(2)
+    result['rolling_avg_aproval'] = result['Approved_percent'].rolling(window=window, center=True).mean()
+    result.index = pd.PeriodIndex(result.index, freq='M', name='month')
+    return result
+
+
+def monthly_scores(df:pd.DataFrame, date_column:str = 'date', score_column:str = 'score', date_format:str = None) -> pd.DataFrame:
+    """Monthly score distribution of a whole sentiment results frame (see `score_distribution`)"""
+    return score_distribution(score_counts(df, date_column, score_column, date_format))
+
+
+def approval_by_month(df:pd.DataFrame,
+                      date_column:str = 'date',
+                      score_column:str = 'score',
+                      date_format:str = None,
+                      window:int = 3
+                      ) -> pd.DataFrame:
+    """Monthly approval shares of a whole sentiment results frame (see `approval_distribution`)"""
+    return approval_distribution(score_counts(df, date_column, score_column, date_format), window)
+
+
+def engagement_totals(videos:pd.DataFrame) -> pd.DataFrame:
+    """
+    Additive engagement aggregates per month of the videos_data table, every video counted once
+
+    args:
+    - videos: videos_data rows
+
+    return:
+    - DataFrame with the columns month, total_videos, total_likes, total_comments, liked_videos and commented_videos
+    """
+    videos = videos.drop_duplicates(subset=['video_id'])
+    likes = pd.to_numeric(videos['video_diggcount'], errors='coerce')
+    comments = pd.to_numeric(videos['video_commentcount'], errors='coerce')
+    frame = pd.DataFrame({"month": to_months(videos['video_timestamp']),
+                          "total_videos": 1,
+                          "total_likes": likes.fillna(0),
+                          "total_comments": comments.fillna(0),
+                          "liked_videos": likes.notna().astype(int),
+                          "commented_videos": comments.notna().astype(int)}).dropna(subset=['month'])
+    totals = frame.groupby('month', sort=True)[ENGAGEMENT_COLUMNS].sum().reset_index()
+    totals['month'] = totals['month'].astype(str)
+    totals[ENGAGEMENT_COLUMNS] = totals[ENGAGEMENT_COLUMNS].astype('int64')
+    return totals
+
+
+def engagement_summary(totals:pd.DataFrame) -> pd.DataFrame:
+    """
+    Monthly engagement (calculate_monthly_engagement of the notebooks) from the engagement aggregates
+
+    args:
+    - totals: DataFrame returned by `engagement_totals`
+
+    return:
+    - DataFrame with the columns month, total_likes, total_comments, avg_likes_per_video,
+      avg_comments_per_video and total_videos
+    """
+    result = totals.groupby('month', sort=True)[ENGAGEMENT_COLUMNS].sum()
+    return pd.DataFrame({"month": pd.PeriodIndex(result.index, freq='M'),
+                         "total_likes": result['total_likes'].to_numpy(),
+                         "total_comments": result['total_comments'].to_numpy(),
+                         "avg_likes_per_video": (result['total_likes'] / result['liked_videos']).to_numpy(),
+                         "avg_comments_per_video": (result['total_comments'] / result['commented_videos']).to_numpy(),
+                         "total_videos": result['total_videos'].to_numpy()})
+
+
+def monthly_engagement(videos:pd.DataFrame) -> pd.DataFrame:
+    """Monthly engagement of a whole videos_data frame (see `engagement_summary`)"""
+    return engagement_summary(engagement_totals(videos))
+
+
+class RollupStore():
+    """Materialized monthly rollups updated batch by batch"""
+    def __init__(self, path:str) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the rollups
+        """
+        self.path = path
+        self.batches = 0
+        self.rows = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS score_counts (
+                kind TEXT,
+                month TEXT,
+                score INTEGER,
+                count INTEGER,
+                PRIMARY KEY (kind, month, score)
+            )
+        """)
+        self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS engagement (
+                month TEXT PRIMARY KEY,
+                {', '.join(f'{column} INTEGER' for column in ENGAGEMENT_COLUMNS)}
+            )
+        """)
+        # Ids already added, so a batch stored twice is only counted once
+        self.conn.execute('CREATE TABLE IF NOT EXISTS rolled_ids (kind TEXT, id TEXT, PRIMARY KEY (kind, id))')
+        self.conn.commit()
+
+    def _new_rows(self, kind:str, df:pd.DataFrame, id_column:str) -> pd.DataFrame:
+        """Rows of a batch whose id was not added before, marking their ids as added"""
+        df = df[df[id_column].notna()].drop_duplicates(subset=[id_column])
+        ids = df[id_column].astype(str).tolist()
+        known = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            known.update(row[0] for row in self.conn.execute(
+                f'SELECT id FROM rolled_ids WHERE kind = ? AND id IN ({",".join("?" * len(chunk))})', [kind, *chunk]))
+        self.conn.executemany('INSERT OR IGNORE INTO rolled_ids VALUES (?, ?)', [(kind, id) for id in ids])
+        self.skipped += len(known)
+        return df[~df[id_column].astype(str).isin(known)] if known else df
+
+    def add_scores(self,
+                   df:pd.DataFrame,
+                   kind:str = 'comments',
+                   date_column:str = 'date',
+                   score_column:str = 'score',
+                   id_column:str = None,
+                   date_format:str = None
+                   ) -> int:
+        """
+        Add a batch of sentiment results to the score rollup of a kind
+
+        args:
+        - df: new sentiment results
+        - kind: rollup name, like "comments" or "videos"
+        - date_column: column with the date
+        - score_column: column with the score
+        - id_column: column with the row id, rows already added are skipped. None to add every row
+        - date_format: strptime format of the dates, None to infer it
+
+        return:
+        - Amount of rows added
+        """
+        with self._lock:
+            if id_column is not None:
+                df = self._new_rows(f'scores:{kind}', df, id_column)
+            counts = score_counts(df, date_column, score_column, date_format)
+            self.conn.executemany("""
+                INSERT INTO score_counts VALUES (?, ?, ?, ?)
+                ON CONFLICT (kind, month, score) DO UPDATE SET count = count + excluded.count
+            """, [(kind, month, int(score), int(count)) for month, score, count in counts.itertuples(index=False)])
+            self.conn.commit()
+            self.batches += 1
+            self.rows += len(df)
+        return len(df)
+
+    def add_videos(self, videos:pd.DataFrame) -> int:
+        """
+        Add a batch of videos_data rows to the engagement rollup, videos already added are skipped
+
+        args:
+        - videos: new videos_data rows
+
+        return:
+        - Amount of videos added
+        """
+        with self._lock:
+            videos = self._new_rows('videos', videos, 'video_id')
+            totals = engagement_totals(videos)
+            updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in ENGAGEMENT_COLUMNS)
+            self.conn.executemany(f"""
+                INSERT INTO engagement VALUES (?, {', '.join('?' for _ in ENGAGEMENT_COLUMNS)})
+                ON CONFLICT (month) DO UPDATE SET {updates}
+            """, [(row[0], *map(int, row[1:])) for row in totals.itertuples(index=False)])
+            self.conn.commit()
+            self.batches += 1
+            self.rows += len(videos)
+        return len(videos)
+
+    def counts(self, kind:str = 'comments') -> pd.DataFrame:
+        """Counts per month and score of a kind"""
+        with self._lock:
+            return pd.read_sql_query('SELECT month, score, count FROM score_counts WHERE kind = ? ORDER BY month, score',
+                                     self.conn, params=(kind,))
+
+    def scores(self, kind:str = 'comments') -> pd.DataFrame:
+        """Monthly score distribution of a kind (see `score_distribution`)"""
+        return score_distribution(self.counts(kind))
+
+    def approval(self, kind:str = 'comments', window:int = 3) -> pd.DataFrame:
+        """Monthly approval shares of a kind (see `approval_distribution`)"""
+        return approval_distribution(self.counts(kind), window)
+
+    def engagement(self) -> pd.DataFrame:
+        """Monthly engagement of the videos added (see `engagement_summary`)"""
+        with self._lock:
+            totals = pd.read_sql_query(f'SELECT month, {", ".join(ENGAGEMENT_COLUMNS)} FROM engagement ORDER BY month',
+                                       self.conn)
+        return engagement_summary(totals)
+
+    def stats(self) -> dict:
+        """Amount of batches and rows added by this instance"""
+        return {"batches": self.batches, "rows": self.rows, "skipped": self.skipped}
+
+    def close(self) -> None:
+        """Close the rollups database"""
+        self.conn.close()
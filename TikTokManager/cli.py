@@ -0,0 +1,224 @@
+"""
+Command line entry point: python -m TikTokManager mine|transcribe|comments|crawl|enqueue|worker|export <spec>
+- jobs are described by YAML or JSON specs (see jobs/), `--set key=value` overrides a value
+- only the standard library is imported up front and every subcommand imports what it runs:
+  TikTokApi (playwright) when a feed or comments are paged, pyktok and the browser cookies
+  on the first page request, pandas when a table is read back, so short cron jobs start fast
+- the result of the job is printed as json, with the startup seconds (imports and manager
+  setup, from the import of this module) and the job seconds
+"""
+import argparse
+import json
+import os
+import time
+
+STARTED = time.perf_counter()
+# Spec keys of every subcommand, besides output_path, temp_path and manager (TikTokManager options)
+JOB_KEYS = {'mine': ('hashtag_list', 'video_amount', 'comment_amount', 'concurrency', 'stage_limits', 'output_format',
+                     'batch_size', 'export_excel', 'resume', 'incremental', 'dedup'),
+            'transcribe': ('video_ids', 'json_concurrency'),
+            'comments': ('video_ids', 'comment_amount', 'concurrency', 'output_format', 'batch_size', 'dedup'),
+            'crawl': ('seeds', 'seed_type', 'max_depth', 'max_nodes', 'max_requests', 'order', 'seed_videos',
+                      'seed_hashtags', 'related_pages', 'output_format', 'batch_size', 'export_excel'),
+            'enqueue': ('queue_path', 'hashtag_list', 'video_amount', 'comment_amount', 'incremental'),
+            'worker': ('queue_path', 'worker_id', 'concurrency', 'stage_limits', 'output_format', 'batch_size',
+                       'visibility_timeout', 'exit_when_empty', 'poll_interval', 'dedup'),
+            'export': ('sink_path', 'output_format', 'file_path')}
+REQUIRED_KEYS = {'mine': ('hashtag_list', 'video_amount', 'comment_amount'),
+                 'transcribe': ('video_ids',),
+                 'comments': ('video_ids', 'comment_amount'),
+                 'crawl': ('seeds',),
+                 'enqueue': ('queue_path', 'hashtag_list', 'video_amount', 'comment_amount'),
+                 'worker': ('queue_path',),
+                 'export': ('sink_path',)}
+MANAGER_KEYS = ('output_path', 'temp_path', 'manager')
+COMMAND_HELP = {'mine': 'mine videos, transcriptions and comments of hashtags (extract_videos_data_v2)',
+                'transcribe': 'download the transcriptions of video ids to a txt file',
+                'comments': 'stream the comments of video ids to a sink',
+                'crawl': 'crawl the related-video graph of seed videos, hashtags or users to an edge list',
+                'enqueue': 'add one discovery job per hashtag to a work queue (enqueue_hashtags)',
+                'worker': 'claim and run the jobs of a work queue, any number of workers can share it (run_worker)',
+                'export': 'export a sink (parquet, sqlite or jsonl) to one excel file'}
+
+
+def load_spec(path:str) -> dict:
+    """
+    Read a job spec
+
+    args:
+    - path: YAML (.yaml / .yml) or JSON file
+
+    return:
+    - Dictionary with the spec
+    """
+    with open(path, encoding='utf-8') as file:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            spec = yaml.safe_load(file)
+        else:
+            spec = json.load(file)
+    if not isinstance(spec, dict):
+        raise ValueError(f'Job spec {path} must be a mapping of options.')
+    return spec
+
+
+def apply_overrides(spec:dict, overrides:list[str]) -> dict:
+    """
+    Set `key=value` overrides on a spec, dotted keys reach nested options (manager.pool_size=2)
+    and values are parsed as json when possible
+
+    args:
+    - spec: job spec
+    - overrides: list of "key=value" strings
+
+    return:
+    - Spec with the overrides
+    """
+    for override in overrides or []:
+        key, separator, value = override.partition('=')
+        if not separator or not key:
+            raise ValueError(f'Overrides must look like key=value, got "{override}".')
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            pass
+        *parents, name = key.split('.')
+        target = spec
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return spec
+
+
+def check_spec(command:str, spec:dict) -> dict:
+    """
+    Validate the keys of a spec
+
+    args:
+    - command: subcommand
+    - spec: job spec
+
+    return:
+    - Arguments of the job (spec without the manager keys)
+    """
+    job = {key: value for key, value in spec.items() if key not in MANAGER_KEYS}
+    unknown = sorted(set(job) - set(JOB_KEYS[command]))
+    if unknown:
+        raise ValueError(f'Unknown keys {", ".join(unknown)}. Only allowed `{command}` keys are '
+                         f'{", ".join(MANAGER_KEYS + JOB_KEYS[command])}.')
+    missing = [key for key in REQUIRED_KEYS[command] if key not in job]
+    if missing and not (command == 'mine' and job.get('resume')):
+        raise ValueError(f'Missing `{command}` keys {", ".join(missing)}.')
+    return job
+
+
+def run_mine(manager, job:dict) -> dict:
+    return manager.extract_videos_data_v2(**job)
+
+
+def run_transcribe(manager, job:dict) -> dict:
+    path = manager.get_video_transcription([str(video_id) for video_id in job['video_ids']],
+                                           job.get('json_concurrency', 8))
+    return {"transcriptions_path": path}
+
+
+def run_comments(manager, job:dict) -> dict:
+    from TikTokManager.journal import new_run_id
+    from TikTokManager.sinks import open_sink
+
+    run_id = new_run_id('comments')
+    sink = open_sink(job.get('output_format', 'parquet'), f'{manager.output_path}/{run_id}', job.get('batch_size', 500))
+
+    async def consume():
+        count = 0
+        async for record in manager.stream_comments([str(video_id) for video_id in job['video_ids']],
+                                                    job['comment_amount'],
+                                                    job.get('concurrency', 1),
+                                                    dedup=job.get('dedup', True)):
+            sink.write('comments_data', [record])
+            count += 1
+        return count
+
+    try:
+        count = manager._run(consume())
+    finally:
+        sink.close()
+    return {"run_id": run_id, "sink_path": sink.path, "comments": count, **manager.write_report(run_id)}
+
+
+def run_crawl(manager, job:dict) -> dict:
+    return manager.crawl_related_graph(**job)
+
+
+def run_enqueue(manager, job:dict) -> dict:
+    return {"queue_path": job['queue_path'], "jobs": manager.enqueue_hashtags(**job)}
+
+
+def run_worker(manager, job:dict) -> dict:
+    return manager.run_worker(**job)
+
+
+def run_export(job:dict) -> dict:
+    from TikTokManager.sinks import SINKS, guess_format
+
+    sink_path = job['sink_path'].rstrip('/')
+    if not os.path.exists(sink_path):
+        raise ValueError(f'Sink {sink_path} not found.')
+    output_format = job.get('output_format') or guess_format(sink_path)
+    if output_format not in SINKS:
+        raise ValueError(f'Only allowed `output_format` values are {", ".join(SINKS)}.')
+    file_path = job.get('file_path') or f'{os.path.splitext(sink_path)[0]}.xlsx'
+    with SINKS[output_format](sink_path) as sink:
+        sink.export_excel(file_path)
+    return {"sink_path": sink_path, "excel_path": file_path}
+
+
+RUNNERS = {'mine': run_mine, 'transcribe': run_transcribe, 'comments': run_comments, 'crawl': run_crawl,
+           'enqueue': run_enqueue, 'worker': run_worker}
+
+
+def run(command:str, spec:dict) -> dict:
+    """
+    Run a job
+
+    args:
+    - command: "mine", "transcribe", "comments", "crawl", "enqueue", "worker" or "export"
+    - spec: job spec
+
+    return:
+    - Dictionary returned by the job, with its startup_seconds and job_seconds
+    """
+    if command not in JOB_KEYS:
+        raise ValueError(f'Only allowed `command` values are {", ".join(JOB_KEYS)}.')
+    job = check_spec(command, spec)
+    if command == 'export':
+        ready = time.perf_counter()
+        result = run_export(job)
+    else:
+        from TikTokManager.tiktokmanager import TikTokManager
+        with TikTokManager(spec.get('output_path', './output'), spec.get('temp_path', './temp'), **spec.get('manager', {})) as manager:
+            ready = time.perf_counter()
+            result = RUNNERS[command](manager, job)
+    return {**result,
+            "startup_seconds": round(ready - STARTED, 3),
+            "job_seconds": round(time.perf_counter() - ready, 3)}
+
+
+def main(argv:list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m TikTokManager', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in COMMAND_HELP.items():
+        subparser = commands.add_parser(command, help=help_text, description=help_text)
+        subparser.add_argument('spec', help='YAML or JSON job spec')
+        subparser.add_argument('--set', dest='overrides', action='append', metavar='KEY=VALUE',
+                               help='override a spec value, e.g. --set video_amount=50 --set manager.pool_size=2')
+    args = parser.parse_args(argv)
+
+    try:
+        spec = apply_overrides(load_spec(args.spec), args.overrides)
+        check_spec(args.command, spec)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    print(json.dumps(run(args.command, spec), default=str))
+    return 0
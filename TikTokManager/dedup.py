@@ -0,0 +1,164 @@
+"""
+Persistent dedup index of the video and comment ids already stored by any run.
+- ids are kept as 64 bit integers in a WITHOUT ROWID sqlite table, next to the outputs
+- an optional in-memory Bloom filter answers most lookups of new ids without
+  touching sqlite
+- ids are added only after their rows are safely stored, so an interrupted run
+  never hides videos that were not saved
+"""
+import hashlib
+import math
+import sqlite3
+import threading
+
+KINDS = ('video', 'comment')
+
+
+def id_key(value) -> int:
+    """Integer key of an id: numeric TikTok ids as is, anything else hashed to 63 bits"""
+    try:
+        key = int(value)
+        if 0 <= key < 2 ** 63:
+            return key
+    except (TypeError, ValueError):
+        pass
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big') >> 1
+
+
+class BloomFilter():
+    """Fixed size Bloom filter over integer keys"""
+    def __init__(self, capacity:int, error_rate:float = 0.01) -> None:
+        """
+        args:
+        - capacity: expected amount of keys
+        - error_rate: false positive rate at `capacity` keys
+        """
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key:int):
+        digest = hashlib.blake2b(key.to_bytes(8, 'big'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key:int) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key:int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class DedupIndex():
+    """Set of the video and comment ids already stored, shared by every run"""
+    def __init__(self, path:str, bloom:bool = True, bloom_capacity:int = 1_000_000, bloom_error_rate:float = 0.01) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the index
+        - bloom: keep a Bloom filter in memory in front of sqlite
+        - bloom_capacity: expected amount of ids per kind (the filter is rebuilt bigger when exceeded)
+        - bloom_error_rate: false positive rate of the filter
+        """
+        self.path = path
+        self.bloom_error_rate = bloom_error_rate
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen (
+                kind TEXT,
+                id INTEGER,
+                PRIMARY KEY (kind, id)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+        self.counts = {kind: self.conn.execute('SELECT COUNT(*) FROM seen WHERE kind = ?', (kind,)).fetchone()[0]
+                       for kind in KINDS}
+        self.lookups = 0
+        self.bloom_skips = 0
+        self.filters = {}
+        if bloom:
+            for kind in KINDS:
+                self._build_filter(kind, max(bloom_capacity, self.counts[kind] * 2))
+
+    def _build_filter(self, kind:str, capacity:int) -> None:
+        bloom = BloomFilter(capacity, self.bloom_error_rate)
+        for (key,) in self.conn.execute('SELECT id FROM seen WHERE kind = ?', (kind,)):
+            bloom.add(key)
+        self.filters[kind] = (bloom, capacity)
+
+    def filter_new(self, kind:str, ids:list) -> list:
+        """
+        Keep the ids not stored yet, in order and without repetitions
+
+        args:
+        - kind: "video" or "comment"
+        - ids: ids to check
+
+        return:
+        - List of the new ids
+        """
+        if kind not in KINDS:
+            raise ValueError(f'Only allowed `kind` values are {", ".join(KINDS)}.')
+        new_ids = []
+        batch_keys = set()
+        bloom = self.filters.get(kind, (None,))[0]
+        with self._lock:
+            for value in ids:
+                key = id_key(value)
+                if key in batch_keys:
+                    continue
+                batch_keys.add(key)
+                self.lookups += 1
+                if bloom is not None and key not in bloom:
+                    self.bloom_skips += 1
+                    new_ids.append(value)
+                    continue
+                if self.conn.execute('SELECT 1 FROM seen WHERE kind = ? AND id = ?', (kind, key)).fetchone() is None:
+                    new_ids.append(value)
+        return new_ids
+
+    def contains(self, kind:str, value) -> bool:
+        """True if the id is already stored"""
+        return not self.filter_new(kind, [value])
+
+    def add(self, kind:str, ids:list) -> None:
+        """
+        Record ids as stored
+
+        args:
+        - kind: "video" or "comment"
+        - ids: ids whose rows were written
+
+        return:
+        - None
+        """
+        if kind not in KINDS:
+            raise ValueError(f'Only allowed `kind` values are {", ".join(KINDS)}.')
+        keys = [id_key(value) for value in ids]
+        if not keys:
+            return
+        with self._lock:
+            cursor = self.conn.executemany('INSERT OR IGNORE INTO seen VALUES (?, ?)', [(kind, key) for key in keys])
+            self.conn.commit()
+            self.counts[kind] += cursor.rowcount
+            if kind in self.filters:
+                bloom, capacity = self.filters[kind]
+                if self.counts[kind] > capacity:
+                    # Past its capacity the false positive rate grows quickly
+                    self._build_filter(kind, capacity * 2)
+                else:
+                    for key in keys:
+                        bloom.add(key)
+
+    def stats(self) -> dict:
+        """Amount of ids per kind and lookups answered by the Bloom filter"""
+        return {**{f'{kind}_ids': count for kind, count in self.counts.items()},
+                "lookups": self.lookups,
+                "bloom_skips": self.bloom_skips}
+
+    def close(self) -> None:
+        """Close the index database"""
+        self.conn.close()
@@ -0,0 +1,560 @@
+"""
+LLM enrichment of the mined videos and comments (sentiment score and topics).
+- structured output requests (VideoResponseFormat / CommentResponseFormat) sent concurrently
+  over an async OpenAI compatible client (Grok by default, any compatible server works)
+- requests/min and tokens/min enforced by token buckets instead of fixed sleeps
+- short comments sharing the same system prompt are packed several per request
+- results are appended to a jsonl file as they arrive, a rerun skips the rows already done
+- rows with the same prompts are sent once, results can be memoized in a ResultCache
+- optionally near-duplicate rows (see prefilter) are sent once too and empty or emoji-only
+  comments are skipped
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import time
+
+import pandas as pd
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, RateLimitError
+from pydantic import BaseModel, Field
+
+from TikTokManager.pacing import error_retry_after
+from TikTokManager.result_cache import ResultCache, cache_key
+
+# Errors worth another attempt, anything else (bad request, auth, ...) fails the row at once
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+VIDEO_PROMPT = "user:{author_username},\ndescription:{video_description},\ntranscription:{video_trasncription}"
+COMMENT_PROMPT = "comment:{text}"
+PACK_INSTRUCTION = ("\nThe user message has several comments, each one after its number in brackets. "
+                    "Return one result per comment with its number.")
+VIDEO_COLUMNS = ('video_id', 'video_timestamp', 'hashtag', 'author_username', 'video_description', 'video_trasncription')
+COMMENT_COLUMNS = ('comment_id', 'video_id', 'hashtag', 'topic', 'text', 'date')
+
+
+class VideoResponseFormat(BaseModel):
+    """
+    The response format for the video transcription analisys.
+    """
+    score: str = Field(
+        description="Score from 1 to 5, where 1 is terrible and 5 is excellent."
+    )
+    topic: list[str] = Field(
+        description="List with at least one or max three main topics of the video.",
+        examples=[
+            "Security",          # Public safety, crime, police effectiveness
+            "Mobility",          # Public transport, traffic, infrastructure
+            "Public Services",   # Water, electricity, waste management
+            "Urban Development", # Housing, urban planning, public spaces
+            "Education",         # Schools, literacy programs, educational access
+            "Healthcare",        # Hospitals, clinics, public health initiatives
+            "Corruption",        # Transparency, anti-corruption measures
+            "Social Inequality", # Poverty, social programs, inclusion
+            "Environment",       # Pollution, green spaces, sustainability
+            "Economy",           # Local business, employment, economic growth
+            "Public Image",      # Mayor’s reputation, media presence, scandals
+            "Elections",         # Campaigning, voter engagement, electoral integrity
+            "Infrastructure",    # Roads, bridges, public works
+            "Cultural Heritage", # Arts, festivals, historical preservation
+            "Citizen Participation", # Community engagement, participatory governance
+            "Post-Conflict Integration" # Reintegration of ex-combatants, peacebuilding
+        ]
+    )
+
+
+class CommentResponseFormat(BaseModel):
+    """
+    The response format for the comment analisys.
+    """
+    score: str = Field(
+        description="Score from 1 to 5, where 1 is terrible and 5 is excellent."
+    )
+
+
+class PackedCommentScore(BaseModel):
+    """Score of one comment of a packed request"""
+    number: int = Field(description="Number of the comment in the user message.")
+    score: str = Field(description="Score from 1 to 5, where 1 is terrible and 5 is excellent.")
+
+
+class PackedCommentResponseFormat(BaseModel):
+    """
+    The response format for several comments analysed in one request.
+    """
+    results: list[PackedCommentScore]
+
+
+def estimate_tokens(text:str) -> int:
+    """Rough token count of a text (4 characters per token), used before the real usage is known"""
+    return math.ceil(len(text) / 4) + 4
+
+
+@functools.lru_cache(maxsize=None)
+def response_schema(response_format:type[BaseModel]) -> str:
+    """Json schema of a response format, part of the result cache keys"""
+    return json.dumps(response_format.model_json_schema(), sort_keys=True)
+
+
+def row_key(row:dict, id_column:str) -> str:
+    """Key of a row in the results file: its id, or a hash of the video id and text when it has none"""
+    value = row.get(id_column)
+    if value is not None and not (isinstance(value, float) and math.isnan(value)):
+        return str(value)
+    content = f"{row.get('video_id')}\x00{row.get('text')}"
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=12).hexdigest()
+
+
+class TokenBucket():
+    """Token bucket refilled continuously, shared by the tasks of one event loop"""
+    def __init__(self, per_minute:float, capacity:float = None) -> None:
+        """
+        args:
+        - per_minute: tokens added per minute
+        - capacity: maximum tokens stored (burst size), `per_minute` by default
+        """
+        self.rate = per_minute / 60
+        self.capacity = capacity or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount:float = 1) -> float:
+        """
+        Wait until `amount` tokens are available and take them, callers are served in order
+
+        return:
+        - Seconds waited
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            wait = (amount - self.level) / self.rate if self.level < amount else 0
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._refill()
+            self.level -= amount
+        return wait
+
+    def consume(self, amount:float) -> None:
+        """Take tokens without waiting (e.g. usage above the estimate), the next callers wait for them"""
+        self._refill()
+        self.level -= amount
+
+    def drain(self) -> None:
+        """Empty the bucket (e.g. after a 429), the next callers wait for the refill"""
+        self._refill()
+        self.level = min(self.level, 0)
+
+
+class ResultWriter():
+    """Append-only jsonl file of results, one line per row key"""
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        self.done.add(json.loads(line)['_key'])
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, key:str, result:dict) -> None:
+        self.file.write(json.dumps({'_key': key, **result}, ensure_ascii=False, default=str) + '\n')
+        self.file.flush()
+        self.done.add(key)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class LLMEnricher():
+    """Concurrent, rate limited structured output analysis of videos and comments (one event loop per enricher)"""
+    def __init__(self,
+                 model:str = 'grok-3-mini-beta',
+                 api_key:str = None,
+                 base_url:str = 'https://api.x.ai/v1',
+                 concurrency:int = 16,
+                 requests_per_minute:int = 60,
+                 tokens_per_minute:int = 100_000,
+                 output_tokens:int = 300,
+                 max_retries:int = 5,
+                 temperature:float = 0.5,
+                 reasoning_effort:str = 'low',
+                 timeout:float = 120,
+                 client:AsyncOpenAI = None,
+                 cache:ResultCache = None,
+                 prompt_version:str = '1'
+                 ) -> None:
+        """
+        args:
+        - model: model id
+        - api_key: api key, the GROK_API_KEY environment variable by default
+        - base_url: url of the OpenAI compatible api
+        - concurrency: maximum requests in flight
+        - requests_per_minute: request rate limit of the account
+        - tokens_per_minute: token rate limit of the account
+        - output_tokens: tokens reserved for the answer of every request (corrected with the real usage)
+        - max_retries: attempts after a rate limit, timeout, connection or server error
+        - temperature: sampling temperature
+        - reasoning_effort: reasoning effort of reasoning models, None to leave it out
+        - timeout: request timeout in seconds
+        - client: already configured AsyncOpenAI client (api_key, base_url and timeout are then ignored)
+        - cache: result cache, rows whose prompts, model, schema and parameters were already analysed
+          are not sent again
+        - prompt_version: version stored in the cache keys, change it to analyse everything again
+        """
+        self.model = model
+        self.concurrency = concurrency
+        self.output_tokens = output_tokens
+        self.max_retries = max_retries
+        self.temperature = temperature
+        self.reasoning_effort = reasoning_effort
+        self.cache = cache
+        self.prompt_version = prompt_version
+        # Retries are done here, under the rate limits
+        self.client = client or AsyncOpenAI(api_key=api_key or os.getenv("GROK_API_KEY"),
+                                            base_url=base_url,
+                                            timeout=timeout,
+                                            max_retries=0)
+        # Bursts limited to 10 seconds of budget, per minute windows of the apis are not aligned with ours
+        self.requests = TokenBucket(requests_per_minute, max(1, requests_per_minute / 6))
+        self.tokens = TokenBucket(tokens_per_minute, max(tokens_per_minute / 6, 4 * output_tokens))
+        self._limit = asyncio.Semaphore(concurrency)
+        self.counters = {"requests": 0, "retries": 0, "errors": 0, "rows": 0, "tokens": 0, "limit_wait_seconds": 0.0}
+
+    async def _parse(self, system_prompt:str, user_prompt:str, response_format:type[BaseModel]) -> tuple[BaseModel, str]:
+        """
+        Send one structured output request under the rate limits, retrying retryable errors with backoff
+
+        return:
+        - Tuple with the parsed response and the reasoning of the model (None if not returned)
+        """
+        estimate = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + self.output_tokens
+        options = {"temperature": self.temperature}
+        if self.reasoning_effort is not None:
+            options["reasoning_effort"] = self.reasoning_effort
+        attempt = 0
+        while True:
+            async with self._limit:
+                waiting = time.monotonic()
+                await self.requests.acquire(1)
+                await self.tokens.acquire(estimate)
+                self.counters["limit_wait_seconds"] += time.monotonic() - waiting
+                self.counters["requests"] += 1
+                try:
+                    response = await self.client.beta.chat.completions.parse(
+                        model=self.model,
+                        messages=[{"role": "system", "content": system_prompt},
+                                  {"role": "user", "content": user_prompt}],
+                        response_format=response_format,
+                        **options)
+                    break
+                except RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    attempt += 1
+                    self.counters["retries"] += 1
+                    if isinstance(e, RateLimitError):
+                        self.requests.drain()
+                    # Retry-after may be seconds or an HTTP-date
+                    retry_after = error_retry_after(e)
+                    backoff = retry_after if retry_after is not None else min(60, 2 ** attempt) * random.uniform(0.5, 1)
+            await asyncio.sleep(backoff)
+
+        if response.usage is not None:
+            self.counters["tokens"] += response.usage.total_tokens
+            if response.usage.total_tokens > estimate:
+                self.tokens.consume(response.usage.total_tokens - estimate)
+        message = response.choices[0].message
+        if message.parsed is None:
+            raise ValueError(f'Empty structured response: {message.refusal or message.content}')
+        return message.parsed, getattr(message, 'reasoning_content', None)
+
+    def _content_key(self, system_prompt:str, user_prompt:str, response_format:type[BaseModel]) -> str:
+        """Result cache key of a request: prompts, model, schema and sampling parameters"""
+        return cache_key(f"{system_prompt}\x00{user_prompt}",
+                         self.model,
+                         self.prompt_version,
+                         {"schema": response_schema(response_format),
+                          "temperature": self.temperature,
+                          "reasoning_effort": self.reasoning_effort})
+
+    async def _run_rows(self,
+                        rows:list,
+                        output_path:str,
+                        id_column:str,
+                        keep_columns:tuple,
+                        content_key,
+                        analyze,
+                        chunk=None
+                        ) -> str:
+        """
+        Analyse the rows not in the results file yet, appending every result as it arrives.
+        Rows with the same content (same prompts) are analysed once, cached results are not sent.
+
+        args:
+        - rows: rows to analyse
+        - output_path: jsonl file the results are appended to
+        - id_column: column with the id of a row
+        - keep_columns: row columns copied to the result
+        - content_key: function returning the result cache key of a row
+        - analyze: coroutine function analysing a list of rows, returns a (result, ok) pair per row,
+          results with ok False are written but not cached
+        - chunk: function splitting the rows to send into lists, one row per list by default
+
+        return:
+        - Path of the results file
+        """
+        writer = ResultWriter(output_path)
+        try:
+            pending = [(row_key(row, id_column), row) for row in rows]
+            pending = [(key, row) for key, row in pending if key not in writer.done]
+            if len(pending) < len(rows):
+                print(f"Skipping {len(rows) - len(pending)} row(s) already analysed in {output_path}")
+            groups = {}
+            for key, row in pending:
+                groups.setdefault(content_key(row), []).append((key, row))
+
+            def write(result_key, result):
+                for key, row in groups.pop(result_key):
+                    writer.write(key, {**{column: row.get(column) for column in keep_columns if column in row}, **result})
+
+            cached = self.cache.get_many(list(groups)) if self.cache is not None else {}
+            for result_key, result in cached.items():
+                write(result_key, result)
+            print(f"Analysing {len(groups)} distinct row(s) with {self.model} "
+                  f"({len(pending)} pending, {len(cached)} cached)")
+
+            async def run(leaders):
+                results = await analyze([row for _, row in leaders])
+                done = {}
+                for (result_key, _), (result, ok) in zip(leaders, results):
+                    write(result_key, result)
+                    if ok:
+                        done[result_key] = result
+                if self.cache is not None and done:
+                    self.cache.put_many(done)
+
+            leaders = [(result_key, members[0][1]) for result_key, members in groups.items()]
+            chunks = chunk(leaders) if chunk is not None else [[leader] for leader in leaders]
+            await asyncio.gather(*(run(leaders_chunk) for leaders_chunk in chunks))
+        finally:
+            writer.close()
+        print(f"LLM stats: {self.counters}")
+        return output_path
+
+    async def analyze_videos(self,
+                             rows:list[dict],
+                             system_prompt:str,
+                             output_path:str,
+                             user_prompt:str = VIDEO_PROMPT,
+                             response_format:type[BaseModel] = VideoResponseFormat,
+                             keep_columns:tuple = VIDEO_COLUMNS,
+                             near_duplicates:float = None
+                             ) -> str:
+        """
+        Analyse the transcription and description of every video, one request per video
+
+        args:
+        - rows: video rows (e.g. `df.to_dict('records')` of the videos_data sheet)
+        - system_prompt: system prompt, formatted with the row (e.g. "{hashtag}")
+        - output_path: jsonl file the results are appended to
+        - user_prompt: user prompt template formatted with the row
+        - response_format: pydantic model of the structured output
+        - keep_columns: row columns copied to the result
+        - near_duplicates: estimated Jaccard similarity of the description and transcription above
+          which videos (e.g. reposts) get the result of one of them, None to analyse every video
+
+        return:
+        - Path of the results file
+        """
+        if near_duplicates is not None:
+            texts = [f"{row.get('video_description') or ''} {row.get('video_trasncription') or ''}" for row in rows]
+            rows = near_duplicate_rows(rows, texts, system_prompt, near_duplicates, drop_empty=False)
+
+        def content_key(row):
+            row = row.get('_representative', row)
+            return self._content_key(system_prompt.format_map(row), user_prompt.format_map(row), response_format)
+
+        async def analyze(chunk):
+            return [await self._analyze_one(row, system_prompt, user_prompt, response_format) for row in chunk]
+
+        return await self._run_rows(rows, output_path, 'video_id', keep_columns, content_key, analyze)
+
+    async def analyze_comments(self,
+                               rows:list[dict],
+                               system_prompt:str,
+                               output_path:str,
+                               user_prompt:str = COMMENT_PROMPT,
+                               pack_size:int = 20,
+                               pack_max_chars:int = 4000,
+                               short_chars:int = 280,
+                               keep_columns:tuple = COMMENT_COLUMNS,
+                               near_duplicates:float = None
+                               ) -> str:
+        """
+        Score every comment. Comments up to `short_chars` characters that share the same system prompt
+        are sent together, up to `pack_size` comments or `pack_max_chars` characters per request;
+        comments missing from a packed answer are sent again alone.
+
+        args:
+        - rows: comment rows (e.g. comments_data merged with the topic of their video)
+        - system_prompt: system prompt, formatted with the row (e.g. "the video is about {topic}")
+        - output_path: jsonl file the results are appended to
+        - user_prompt: user prompt template of a comment sent alone, formatted with the row
+        - pack_size: maximum comments per request, 1 to disable packing
+        - pack_max_chars: maximum characters of comment text per packed request
+        - short_chars: longer comments are always sent alone
+        - keep_columns: row columns copied to the result
+        - near_duplicates: estimated Jaccard similarity above which comments (e.g. copy-pasted
+          campaign comments) get the result of one of them, None to analyse every comment.
+          Empty and emoji-only comments are then skipped
+
+        return:
+        - Path of the results file
+        """
+        if near_duplicates is not None:
+            rows = near_duplicate_rows(rows, [row.get('text') for row in rows], system_prompt, near_duplicates)
+
+        # Packed and single requests have different prompts, their results are cached apart
+        def content_key(row):
+            row = row.get('_representative', row)
+            if packable(row, pack_size, short_chars):
+                return self._content_key(system_prompt.format_map(row) + PACK_INSTRUCTION,
+                                         str(row.get('text') or ''),
+                                         PackedCommentResponseFormat)
+            return self._content_key(system_prompt.format_map(row), user_prompt.format_map(row), CommentResponseFormat)
+
+        async def analyze(chunk):
+            # A short comment left alone in its pack is still sent in packed mode, as its key says
+            if not packable(chunk[0], pack_size, short_chars):
+                return [await self._analyze_one(chunk[0], system_prompt, user_prompt, CommentResponseFormat)]
+            return await self._analyze_pack(chunk, system_prompt, user_prompt)
+
+        def chunk(leaders):
+            return pack_comments(leaders, system_prompt, pack_size, pack_max_chars, short_chars)
+
+        return await self._run_rows(rows, output_path, 'comment_id', keep_columns, content_key, analyze, chunk)
+
+    async def _analyze_one(self, row:dict, system_prompt:str, user_prompt:str,
+                           response_format:type[BaseModel]) -> tuple[dict, bool]:
+        """
+        Analyse one row
+
+        return:
+        - Tuple with the result and False if the request failed ("NA" values and the error as reasoning)
+        """
+        try:
+            parsed, reasoning = await self._parse(system_prompt.format_map(row), user_prompt.format_map(row), response_format)
+        except Exception as e:
+            print(f"Error trying to call the LLM api: {e}")
+            self.counters["errors"] += 1
+            na = {name: ["NA"] if field.annotation == list[str] else "NA"
+                  for name, field in response_format.model_fields.items()}
+            return {**na, "llm_reasoning": str(e)}, False
+        self.counters["rows"] += 1
+        return {**parsed.model_dump(), "llm_reasoning": reasoning}, True
+
+    async def _analyze_pack(self, chunk:list[dict], system_prompt:str, user_prompt:str) -> list[tuple[dict, bool]]:
+        """
+        Score several comments with one request, returns a (result, ok) pair per comment.
+        Comments left out of the answer are sent alone, their results are not cached under the packed key
+        """
+        pack_prompt = '\n'.join(f"[{number}] {row.get('text')}" for number, row in enumerate(chunk, 1))
+        try:
+            parsed, reasoning = await self._parse(system_prompt.format_map(chunk[0]) + PACK_INSTRUCTION,
+                                                  pack_prompt,
+                                                  PackedCommentResponseFormat)
+        except Exception as e:
+            print(f"Error trying to call the LLM api for {len(chunk)} packed comments: {e}")
+            self.counters["errors"] += len(chunk)
+            return [({"score": "NA", "llm_reasoning": str(e)}, False) for _ in chunk]
+        scores = {result.number: result.score for result in parsed.results}
+        results = []
+        for number, row in enumerate(chunk, 1):
+            # Comments the model left out of the packed answer are sent alone
+            if number not in scores:
+                result, _ = await self._analyze_one(row, system_prompt, user_prompt, CommentResponseFormat)
+                results.append((result, False))
+            else:
+                self.counters["rows"] += 1
+                results.append(({"score": scores[number], "llm_reasoning": reasoning}, True))
+        return results
+
+
+def near_duplicate_rows(rows:list[dict],
+                        texts:list[str],
+                        system_prompt:str,
+                        threshold:float,
+                        drop_empty:bool = True
+                        ) -> list[dict]:
+    """
+    Cluster near-duplicate rows sharing the same formatted system prompt
+
+    args:
+    - rows: rows to analyse
+    - texts: text of every row compared by the prefilter
+    - system_prompt: system prompt, formatted with the row
+    - threshold: estimated Jaccard similarity above which two texts are near-duplicates
+    - drop_empty: drop the rows without text (empty, emoji-only)
+
+    return:
+    - Rows kept, the members of a cluster get its representative row in "_representative"
+    """
+    from TikTokManager.prefilter import prefilter
+
+    df = pd.DataFrame({'text': texts, 'prompt': [system_prompt.format_map(row) for row in rows]})
+    clusters = prefilter(df, 'text', threshold, drop_empty, 'prompt')['cluster'].tolist()
+    kept = [row if cluster == position else {**row, '_representative': rows[cluster]}
+            for position, (row, cluster) in enumerate(zip(rows, clusters)) if cluster >= 0]
+    members = sum(1 for row in kept if '_representative' in row)
+    print(f"Prefilter: {len(rows) - len(kept)} empty row(s) skipped, "
+          f"{members} near-duplicate row(s) get the result of one of the {len(kept) - members} row(s) analysed")
+    return kept
+
+
+def packable(row:dict, pack_size:int, short_chars:int) -> bool:
+    """True if a comment (or the near-duplicate it gets the result of) is sent in a packed request"""
+    row = row.get('_representative', row)
+    return pack_size > 1 and len(str(row.get('text') or '')) <= short_chars
+
+
+def pack_comments(pending:list, system_prompt:str, pack_size:int, pack_max_chars:int, short_chars:int) -> list[list]:
+    """
+    Group (key, row) comment pairs into requests: short comments sharing the same formatted
+    system prompt are packed together, the others go alone
+
+    return:
+    - List of chunks of (key, row) pairs
+    """
+    chunks = []
+    open_packs = {}
+    for key, row in pending:
+        text = str(row.get('text') or '')
+        if not packable(row, pack_size, short_chars):
+            chunks.append([(key, row)])
+            continue
+        prompt = system_prompt.format_map(row)
+        pack, size = open_packs.get(prompt, ([], 0))
+        if pack and (len(pack) >= pack_size or size + len(text) > pack_max_chars):
+            chunks.append(pack)
+            pack, size = [], 0
+        pack.append((key, row))
+        open_packs[prompt] = (pack, size + len(text))
+    chunks += [pack for pack, _ in open_packs.values() if pack]
+    return chunks
+
+
+def load_results(path:str) -> pd.DataFrame:
+    """Read a results file written by LLMEnricher into a DataFrame"""
+    return pd.read_json(path, lines=True, dtype=False).drop(columns=['_key'])
@@ -0,0 +1,139 @@
+"""
+Related-video graph crawl: frontier, visited index and output records.
+- the frontier is a heap expanded best-first (play count and affinity with the seed
+  hashtags, minus a penalty per hop) or breadth-first (by depth, best first inside a level)
+- every video id seen is kept once in the visited index as a 64 bit integer key, so a video
+  reached from several branches is queued and requested only once
+- depth, expanded node and request budgets bound the crawl, the lowest priority branches
+  are the ones left unexpanded when the budget runs out
+- every related video returned is one edge of the edge list (GraphEdge), every video seen
+  is one node (GraphNode) with its depth, priority and stats
+"""
+import heapq
+import itertools
+import math
+from dataclasses import dataclass
+
+from TikTokManager.dedup import id_key
+
+ORDERS = ('best', 'breadth')
+
+
+@dataclass(slots=True)
+class GraphNode():
+    """One row of the graph_nodes table"""
+    video_id: str
+    author_username: str = None
+    depth: int = None
+    parent_id: str = None
+    priority: float = None
+    video_playcount: int = None
+    hashtags: str = None
+
+
+@dataclass(slots=True)
+class GraphEdge():
+    """One row of the graph_edges table, a related video (target) listed by the source video"""
+    source_id: str
+    target_id: str
+    depth: int = None
+    rank: int = None
+
+
+def item_hashtags(item:dict) -> set[str]:
+    """Lower case hashtags of a video item (challenges and hashtag mentions of the description)"""
+    hashtags = {challenge.get('title') for challenge in item.get('challenges') or []}
+    hashtags.update(extra.get('hashtagName') for extra in item.get('textExtra') or [])
+    return {hashtag.lower() for hashtag in hashtags if hashtag}
+
+
+class GraphFrontier():
+    """Prioritized frontier and visited index of a related-video crawl"""
+    def __init__(self,
+                 order:str = 'best',
+                 max_depth:int = 2,
+                 seed_hashtags:list[str] = None,
+                 affinity_weight:float = 2.0,
+                 depth_penalty:float = 1.0
+                 ) -> None:
+        """
+        args:
+        - order: "best" (highest priority first) or "breadth" (lowest depth first)
+        - max_depth: hops from the seeds past which videos are recorded but not expanded
+        - seed_hashtags: hashtags of the topic, videos sharing them are expanded first
+        - affinity_weight: priority added for a video whose hashtags are all seed hashtags
+        - depth_penalty: priority removed per hop from the seeds
+        """
+        if order not in ORDERS:
+            raise ValueError(f'Only allowed `order` values are {", ".join(ORDERS)}.')
+        self.order = order
+        self.max_depth = max_depth
+        self.seed_hashtags = {hashtag.lower().lstrip('#') for hashtag in seed_hashtags or []}
+        self.affinity_weight = affinity_weight
+        self.depth_penalty = depth_penalty
+        self.visited = set()
+        self._heap = []
+        self._counter = itertools.count()
+        self.pushed = 0
+        self.revisits = 0
+
+    def priority(self, item:dict, depth:int) -> float:
+        """
+        Priority of a video: log10 of its play count, plus the share of its hashtags that are
+        seed hashtags times `affinity_weight`, minus `depth_penalty` per hop
+
+        args:
+        - item: video item (itemList entry of the related videos), may be empty for seeds
+        - depth: hops from the seeds
+
+        return:
+        - Priority, higher is expanded first
+        """
+        plays = int(((item.get('stats') or {}).get('playCount')) or 0)
+        score = math.log10(1 + plays) - self.depth_penalty * depth
+        hashtags = item_hashtags(item)
+        if hashtags and self.seed_hashtags:
+            score += self.affinity_weight * len(hashtags & self.seed_hashtags) / len(hashtags)
+        return score
+
+    def add(self, video_id:str, author:str, depth:int, priority:float) -> bool:
+        """
+        Record a video in the visited index and queue it if it is within `max_depth`
+
+        args:
+        - video_id: id of the video
+        - author: username of the author (part of the video url)
+        - depth: hops from the seeds
+        - priority: priority of the video
+
+        return:
+        - False if the video was already seen
+        """
+        key = id_key(video_id)
+        if key in self.visited:
+            self.revisits += 1
+            return False
+        self.visited.add(key)
+        if depth <= self.max_depth:
+            rank = (depth, -priority) if self.order == 'breadth' else (-priority,)
+            heapq.heappush(self._heap, (rank, next(self._counter), video_id, author, depth))
+            self.pushed += 1
+        return True
+
+    def pop(self) -> tuple[str, str, int]:
+        """
+        Next video to expand
+
+        return:
+        - Tuple (video id, author, depth), None when the frontier is empty
+        """
+        if not self._heap:
+            return None
+        _, _, video_id, author, depth = heapq.heappop(self._heap)
+        return video_id, author, depth
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> dict:
+        return {"visited": len(self.visited), "queued": len(self._heap), "pushed": self.pushed, "revisits": self.revisits}
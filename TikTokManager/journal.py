@@ -0,0 +1,268 @@
+"""
+Durable crawl journal used to resume interrupted runs.
+- keyed by run id (date and time to the second plus a random suffix), stored in a sqlite file
+- records url discovery per hashtag, the stages completed per video and
+  the sink offsets at every commit, so a resumed run skips finished work
+"""
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+
+STAGES = ('json', 'transcription', 'comments')
+
+
+def new_run_id(prefix:str = None) -> str:
+    """
+    Id of a new run, unique even for runs started in the same second
+
+    args:
+    - prefix: kind of run (e.g. "stream", "graph"), none for extract_videos_data_v2 runs
+
+    return:
+    - "[prefix_]%m-%d-%Y_%H%M%S_" followed by 6 random hex characters
+    """
+    run_id = f'{datetime.now().strftime("%m-%d-%Y_%H%M%S")}_{uuid.uuid4().hex[:6]}'
+    return f'{prefix}_{run_id}' if prefix else run_id
+
+
+class CrawlJournal():
+    """Journal of the runs of extract_videos_data_v2"""
+    def __init__(self, path:str) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the journal
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                params TEXT,
+                status TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS discovery (
+                run_id TEXT,
+                hashtag TEXT,
+                urls TEXT,
+                PRIMARY KEY (run_id, hashtag)
+            );
+            CREATE TABLE IF NOT EXISTS videos (
+                run_id TEXT,
+                url TEXT,
+                hashtag TEXT,
+                row TEXT,
+                json_done INTEGER DEFAULT 0,
+                transcription_done INTEGER DEFAULT 0,
+                comments_done INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'pending',
+                updated_at TEXT,
+                PRIMARY KEY (run_id, url)
+            );
+            CREATE TABLE IF NOT EXISTS offsets (
+                run_id TEXT,
+                table_name TEXT,
+                row_offset INTEGER,
+                PRIMARY KEY (run_id, table_name)
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                run_id TEXT,
+                ent_type TEXT,
+                ent_name TEXT,
+                create_time INTEGER,
+                video_id TEXT,
+                PRIMARY KEY (run_id, ent_type, ent_name)
+            );
+        """)
+        self.conn.commit()
+
+    def start_run(self, run_id:str, params:dict) -> None:
+        """
+        Register a new run, a ValueError is raised if the id is already journaled
+
+        args:
+        - run_id: id of the run
+        - params: parameters needed to resume the run
+
+        return:
+        - None
+        """
+        now = datetime.now().isoformat()
+        try:
+            with self.conn:
+                self.conn.execute('INSERT INTO runs VALUES (?, ?, ?, ?, ?)',
+                                  (run_id, json.dumps(params), 'running', now, now))
+        except sqlite3.IntegrityError:
+            raise ValueError(f'Run {run_id} already exists in the crawl journal, resume it or start a run with a new id.') from None
+
+    def get_run(self, run_id:str) -> dict:
+        """
+        Get the stored parameters and status of a run
+
+        args:
+        - run_id: id of the run
+
+        return:
+        - Dictionary with "params" and "status", None if the run does not exist
+        """
+        row = self.conn.execute('SELECT params, status FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        if row is None:
+            return None
+        return {"params": json.loads(row[0]), "status": row[1]}
+
+    def set_status(self, run_id:str, status:str) -> None:
+        """Update the status of a run ("running", "finished")"""
+        self.conn.execute('UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?',
+                          (status, datetime.now().isoformat(), run_id))
+        self.conn.commit()
+
+    def save_discovery(self, run_id:str, hashtag:str, urls:list[str]) -> None:
+        """Store the urls discovered for a hashtag"""
+        self.conn.execute('INSERT OR REPLACE INTO discovery VALUES (?, ?, ?)',
+                          (run_id, hashtag, json.dumps(urls)))
+        self.conn.commit()
+
+    def save_watermarks(self, run_id:str, watermarks:dict) -> None:
+        """
+        Store the newest videos discovered in a run, the feed watermarks are only moved to
+        them once the run has persisted its videos
+
+        args:
+        - run_id: id of the run
+        - watermarks: dictionary (ent_type, ent_name) -> (create_time, video_id), see iter_video_urls
+
+        return:
+        - None
+        """
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)',
+                                  [(run_id, ent_type, ent_name, create_time, video_id)
+                                   for (ent_type, ent_name), (create_time, video_id) in watermarks.items()])
+
+    def get_watermarks(self, run_id:str) -> dict:
+        """Get the newest videos discovered in a run, as (ent_type, ent_name) -> (create_time, video_id)"""
+        rows = self.conn.execute('SELECT ent_type, ent_name, create_time, video_id FROM watermarks WHERE run_id = ?',
+                                 (run_id,)).fetchall()
+        return {(ent_type, ent_name): (create_time, video_id) for ent_type, ent_name, create_time, video_id in rows}
+
+    def get_discovery(self, run_id:str) -> dict:
+        """
+        Get the urls already discovered in a run
+
+        args:
+        - run_id: id of the run
+
+        return:
+        - Dictionary hashtag -> list of urls
+        """
+        rows = self.conn.execute('SELECT hashtag, urls FROM discovery WHERE run_id = ?', (run_id,)).fetchall()
+        return {hashtag: json.loads(urls) for hashtag, urls in rows}
+
+    def video_state(self, run_id:str, url:str) -> dict:
+        """
+        Get the journaled state of a video
+
+        args:
+        - run_id: id of the run
+        - url: video url
+
+        return:
+        - Dictionary with the partial row, the stages done and the status, None if never started
+        """
+        row = self.conn.execute('SELECT row, json_done, transcription_done, comments_done, status '
+                                'FROM videos WHERE run_id = ? AND url = ?', (run_id, url)).fetchone()
+        if row is None:
+            return None
+        return {"row": json.loads(row[0]) if row[0] else None,
+                "json": bool(row[1]),
+                "transcription": bool(row[2]),
+                "comments": bool(row[3]),
+                "status": row[4]}
+
+    def mark_stage(self, run_id:str, url:str, hashtag:str, stage:str, row:dict) -> None:
+        """
+        Record that a stage of a video finished, together with the partial row built so far
+
+        args:
+        - run_id: id of the run
+        - url: video url
+        - hashtag: hashtag the url was discovered from
+        - stage: "json" or "transcription"
+        - row: partial video row
+
+        return:
+        - None
+        """
+        if stage not in STAGES:
+            raise ValueError(f'Only allowed `stage` values are {", ".join(STAGES)}.')
+        self.conn.execute('INSERT OR IGNORE INTO videos (run_id, url, hashtag) VALUES (?, ?, ?)',
+                          (run_id, url, hashtag))
+        self.conn.execute(f'UPDATE videos SET row = ?, {stage}_done = 1, updated_at = ? '
+                          'WHERE run_id = ? AND url = ?',
+                          (json.dumps(row), datetime.now().isoformat(), run_id, url))
+        self.conn.commit()
+
+    def commit_videos(self, run_id:str, done:list[str], failed:list[str], offsets:dict) -> None:
+        """
+        Mark videos as finished once their rows are flushed to the sink, in one transaction
+        with the sink offsets, so the journal never points past durable output
+
+        args:
+        - run_id: id of the run
+        - done: urls written to the sink
+        - failed: urls that could not be mined
+        - offsets: rows stored per sink table after the flush
+
+        return:
+        - None
+        """
+        now = datetime.now().isoformat()
+        with self.conn:
+            for status, urls in (('done', done), ('failed', failed)):
+                self.conn.executemany('INSERT OR IGNORE INTO videos (run_id, url) VALUES (?, ?)',
+                                      [(run_id, url) for url in urls])
+                self.conn.executemany('UPDATE videos SET status = ?, comments_done = ?, row = NULL, updated_at = ? '
+                                      'WHERE run_id = ? AND url = ?',
+                                      [(status, int(status == 'done'), now, run_id, url) for url in urls])
+            self.conn.executemany('INSERT OR REPLACE INTO offsets VALUES (?, ?, ?)',
+                                  [(run_id, table, offset) for table, offset in offsets.items()])
+
+    def forget_videos(self, run_id:str, urls:list[str]) -> None:
+        """
+        Delete the stage rows of videos whose outcome is stored elsewhere (e.g. jobs completed
+        in a work queue), so long running workers keep the journal small
+
+        args:
+        - run_id: id of the run
+        - urls: urls of the videos
+
+        return:
+        - None
+        """
+        with self.conn:
+            self.conn.executemany('DELETE FROM videos WHERE run_id = ? AND url = ?', [(run_id, url) for url in urls])
+
+    def done_urls(self, run_id:str) -> set[str]:
+        """Urls of a run already written to the sink (failed urls are retried on resume)"""
+        rows = self.conn.execute("SELECT url FROM videos WHERE run_id = ? AND status = 'done'",
+                                 (run_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def failed_urls(self, run_id:str) -> set[str]:
+        """Urls of a run that could not be mined (until a resume mines them)"""
+        rows = self.conn.execute("SELECT url FROM videos WHERE run_id = ? AND status = 'failed'",
+                                 (run_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def offsets(self, run_id:str) -> dict:
+        """Rows per sink table at the last commit of a run"""
+        rows = self.conn.execute('SELECT table_name, row_offset FROM offsets WHERE run_id = ?',
+                                 (run_id,)).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        """Close the journal database"""
+        self.conn.close()
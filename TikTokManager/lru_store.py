@@ -0,0 +1,134 @@
+"""
+Size-bounded sqlite key / value store shared by the on-disk caches (PageCache, ResultCache).
+- values are encoded to bytes by the subclass (json by default), entries can expire after a ttl
+- total size is bounded with least-recently-used eviction down to 90% of `max_bytes`
+- thread safe, the connection is shared by the worker threads of the mining loop
+- hit / miss / eviction counters are kept for the run report
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class LRUStore():
+    """Size-bounded LRU key / value store in sqlite"""
+    def __init__(self, path:str, ttl:int = None, max_bytes:int = 256 * 1024 * 1024) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the store
+        - ttl: seconds an entry stays valid, 0 or None to never expire
+        - max_bytes: maximum size of the encoded values, 0 or None for no bound
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                created_at REAL,
+                last_access REAL,
+                size INTEGER,
+                data BLOB
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def encode(self, value) -> bytes:
+        """Bytes stored for a value"""
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    def decode(self, data:bytes):
+        """Value of stored bytes"""
+        return json.loads(data)
+
+    def get_many(self, keys:list[str]) -> dict:
+        """
+        Get the stored values of several keys
+
+        args:
+        - keys: keys to look up
+
+        return:
+        - Dictionary key -> value of the keys found and not expired
+        """
+        found = {}
+        now = time.time()
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Chunks under the sqlite limit of bound parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.conn.execute(f'SELECT key, created_at, data FROM entries WHERE key IN ({",".join("?" * len(chunk))})',
+                                         chunk).fetchall()
+                found.update((key, data) for key, created_at, data in rows
+                             if not (self.ttl and now - created_at > self.ttl))
+            self.conn.executemany('UPDATE entries SET last_access = ? WHERE key = ?', [(now, key) for key in found])
+            self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {key: self.decode(data) for key, data in found.items()}
+
+    def get(self, key:str):
+        """Stored value of a key, None if it is not stored or expired"""
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items:dict) -> None:
+        """
+        Store values, evicting the least recently used entries when the store is full
+
+        args:
+        - items: dictionary key -> value
+
+        return:
+        - None
+        """
+        now = time.time()
+        rows = [(key, now, now, len(data), data) for key, data in ((key, self.encode(value)) for key, value in items.items())]
+        if not rows:
+            return
+        with self._lock:
+            for key, _, _, size, _ in rows:
+                old = self.conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+                self.total_bytes += size - (old[0] if old else 0)
+            self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+            self.conn.commit()
+
+    def put(self, key:str, value) -> None:
+        """Store one value"""
+        self.put_many({key: value})
+
+    def _evict(self, target:int) -> None:
+        """Delete least recently used entries until the store size is under `target` bytes"""
+        rows = self.conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+
+    def stats(self) -> dict:
+        """Hit / miss counters and size of the store"""
+        lookups = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes}
+
+    def close(self) -> None:
+        """Close the store database"""
+        self.conn.close()
@@ -0,0 +1,318 @@
+"""
+Run metrics of the mining pipeline.
+- counters, gauges, histograms and timers per stage (session creation, page json, transcription,
+  comments, discovery, excel export, deliberate sleeps, ...)
+- retries and errors counted by stage and exception type
+- exported as a JSON run report and in the Prometheus text format (file or http endpoint)
+- optional cProfile of a single stage
+"""
+import asyncio
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds, from a cached page json to a 14 hours run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class Histogram():
+    """Cumulative bucket histogram with count, sum, min and max"""
+    def __init__(self, buckets:tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value:float) -> None:
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q:float) -> float:
+        """
+        Estimate a quantile by linear interpolation inside the bucket that contains it
+
+        args:
+        - q: quantile between 0 and 1
+
+        return:
+        - Estimated value, None if nothing was observed
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+
+    def summary(self) -> dict:
+        return {"count": self.count,
+                "sum": round(self.sum, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else None,
+                "min": self.min,
+                "p50": self.quantile(0.5),
+                "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99),
+                "max": self.max}
+
+
+class Metrics():
+    """Thread safe registry of the counters and histograms of a TikTokManager"""
+    def __init__(self, profile_stage:str = None, prefix:str = 'tiktokmanager') -> None:
+        """
+        args:
+        - profile_stage: stage run under cProfile, None to disable profiling (one call at a time,
+          under asyncio the tasks interleaved with that call are profiled too)
+        - prefix: prefix of the metric names in the Prometheus export
+        """
+        self.profile_stage = profile_stage
+        self.prefix = prefix
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._profile_stats = None
+        self._profiling = False
+        self._lock = threading.Lock()
+        self._server = None
+
+    @staticmethod
+    def _key(name:str, labels:dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name:str, value:float = 1, **labels) -> None:
+        """Increase a counter (e.g. `inc('videos_total', stage='discovery')`)"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name:str, value:float, **labels) -> None:
+        """Set a gauge (e.g. `set('page_cache_bytes', 1024)`)"""
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name:str, value:float, **labels) -> None:
+        """Add an observation to a histogram"""
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def retry(self, stage:str) -> None:
+        """Count a retry of a stage"""
+        self.inc('retries_total', stage=stage)
+
+    def error(self, stage:str, error:BaseException) -> None:
+        """Count an error of a stage by exception type"""
+        self.inc('errors_total', stage=stage, type=type(error).__name__)
+
+    @contextmanager
+    def timer(self, stage:str):
+        """
+        Time a block as one call of a stage, errors raised by the block are counted and re-raised.
+        Under asyncio the time spent awaiting inside the block is included.
+
+        args:
+        - stage: name of the stage
+        """
+        profiler = None
+        if stage == self.profile_stage:
+            # cProfile hooks one thread and can not nest, concurrent calls of the stage are not profiled
+            with self._lock:
+                if not self._profiling:
+                    self._profiling = True
+                    profiler = cProfile.Profile()
+            if profiler is not None:
+                profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.error(stage, e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self._profiling = False
+                    if self._profile_stats is None:
+                        self._profile_stats = pstats.Stats(profiler)
+                    else:
+                        self._profile_stats.add(profiler)
+            self.observe('stage_seconds', elapsed, stage=stage)
+
+    def sleep_seconds(self, stage:str, seconds:float) -> None:
+        """Record a deliberate (pacing or backoff) sleep of a stage"""
+        self.inc('sleep_seconds_total', seconds, stage=stage)
+
+    def report(self) -> dict:
+        """
+        Build the run report
+
+        return:
+        - Dictionary with the elapsed time, counters, gauges and histogram summaries
+        """
+        def label_str(labels):
+            return ','.join(f'{key}={value}' for key, value in labels)
+
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, {})[label_str(labels) or 'total'] = value
+            gauges = {}
+            for (name, labels), value in sorted(self.gauges.items()):
+                gauges.setdefault(name, {})[label_str(labels) or 'value'] = value
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                histograms.setdefault(name, {})[label_str(labels) or 'total'] = histogram.summary()
+        return {"started_at": self.started,
+                "elapsed_seconds": round(time.time() - self.started, 3),
+                "counters": counters,
+                "gauges": gauges,
+                "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        """Export the metrics in the Prometheus text format"""
+        def label_str(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{str(value)}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            declared = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f'{self.prefix}_{name}'
+                if metric not in declared:
+                    lines.append(f'# TYPE {metric} counter')
+                    declared.add(metric)
+                lines.append(f'{metric}{label_str(labels)} {value}')
+            for (name, labels), value in sorted(self.gauges.items()):
+                metric = f'{self.prefix}_{name}'
+                if metric not in declared:
+                    lines.append(f'# TYPE {metric} gauge')
+                    declared.add(metric)
+                lines.append(f'{metric}{label_str(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                metric = f'{self.prefix}_{name}'
+                if metric not in declared:
+                    lines.append(f'# TYPE {metric} histogram')
+                    declared.add(metric)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{label_str(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{metric}_bucket{label_str(labels, [("le", "+Inf")])} {histogram.count}')
+                lines.append(f'{metric}_sum{label_str(labels)} {histogram.sum}')
+                lines.append(f'{metric}_count{label_str(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path:str) -> str:
+        """Write the run report to a json file"""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
+        return path
+
+    def write_prometheus(self, path:str) -> str:
+        """Write the Prometheus text export atomically (node exporter textfile collector)"""
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+        return path
+
+    def write_profile(self, path:str) -> str:
+        """
+        Dump the cProfile stats of the profiled stage (readable with `pstats` or snakeviz)
+
+        return:
+        - Path of the file, None if nothing was profiled
+        """
+        with self._lock:
+            if self._profile_stats is None:
+                return None
+            self._profile_stats.dump_stats(path)
+        return path
+
+    def serve(self, port:int = 9464, host:str = '127.0.0.1') -> str:
+        """
+        Serve the Prometheus text export at /metrics from a background thread
+
+        return:
+        - Url of the endpoint
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200 if self.path.startswith('/metrics') else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        if self._server is None:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self._server.server_address[1]}/metrics'
+
+    def close(self) -> None:
+        """Stop the http endpoint"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def timed(stage:str):
+    """
+    Decorator timing every call of a TikTokManager method (sync or async) as one call of a stage
+
+    args:
+    - stage: name of the stage
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, *args, **kwargs):
+                with self.metrics.timer(stage):
+                    return await func(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,406 @@
+"""
+Adaptive pacing of the requests sent to TikTok, shared by every TikTokManager path.
+- one limiter per endpoint class: "feed", "page_json", "comments" and "vtt"
+- token bucket whose rate grows while requests succeed and is cut on 429s, empty
+  pages and captchas: it grows fast until the first throttle (slow start), then
+  additively below the rate that was throttled (additive increase, multiplicative decrease)
+- exponential backoff with full jitter between retries, retry-after is honored
+- circuit breaker per endpoint class: consecutive throttles or errors open it for a
+  cooldown, then a single probe request decides whether it closes again (a probe that
+  never gets an outcome is released, so the endpoint is not blocked for good)
+- errors are classified: throttles and transient errors are retried, permanent ones
+  (deleted video, page without itemStruct, 404) fail fast and programming errors
+  (KeyError, TypeError, ...) are raised to the caller, they are not answers of TikTok
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from TikTokManager.metrics import Metrics
+
+ENDPOINTS = ('feed', 'page_json', 'comments', 'vtt')
+# Starting rate and bounds (requests/s) of every endpoint class
+DEFAULT_LIMITS = {'feed': {"rate": 1.0, "max_rate": 5.0},
+                  'page_json': {"rate": 2.0, "max_rate": 20.0},
+                  'comments': {"rate": 1.0, "max_rate": 10.0},
+                  'vtt': {"rate": 8.0, "max_rate": 50.0}}
+# TikTok answers throttled or flagged clients with captchas and empty bodies
+THROTTLE_ERRORS = ('CaptchaException', 'EmptyResponseException')
+THROTTLE_MESSAGES = ('429', 'too many requests', 'rate limit', 'captcha')
+THROTTLE_STATUS = (403, 429)
+PERMANENT_ERRORS = ('NotFoundException', 'SoundRemovedException')
+PERMANENT_STATUS = (400, 404, 410)
+# Bugs in the code, retrying or skipping the request would hide them
+PROGRAMMING_ERRORS = (AttributeError, KeyError, NameError, TypeError)
+
+
+class ThrottledError(Exception):
+    """TikTok is throttling the requests (429, page without data, captcha)"""
+    def __init__(self, message:str, retry_after:float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PermanentError(Exception):
+    """Error that retrying can not fix (deleted or private video, page without itemStruct)"""
+
+
+def retry_after_seconds(value) -> float:
+    """Seconds of a retry-after header (a number of seconds or an HTTP-date), None if it is missing or malformed"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def tiktok_errors(names:tuple) -> tuple:
+    """TikTokApi exception classes, only imported once an error has to be classified (TikTokApi loads playwright)"""
+    try:
+        from TikTokApi import exceptions
+    except ImportError:
+        return ()
+    return tuple(getattr(exceptions, name) for name in names if hasattr(exceptions, name))
+
+
+def is_throttle(error:BaseException) -> bool:
+    """True when an error means TikTok is throttling the client"""
+    if isinstance(error, (ThrottledError, *tiktok_errors(THROTTLE_ERRORS))):
+        return True
+    response = getattr(error, 'response', None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return response.status_code in THROTTLE_STATUS
+    message = str(error).lower()
+    return any(text in message for text in THROTTLE_MESSAGES)
+
+
+def classify_error(error:BaseException) -> str:
+    """
+    Kind of an error raised by a request
+
+    args:
+    - error: raised exception
+
+    return:
+    - "throttle" (slow down and retry), "fatal" (do not retry), "retry" (transient error)
+      or "bug" (programming error, to raise)
+    """
+    if isinstance(error, (PermanentError, *tiktok_errors(PERMANENT_ERRORS))):
+        return 'fatal'
+    if isinstance(error, PROGRAMMING_ERRORS):
+        return 'bug'
+    response = getattr(error, 'response', None)
+    if isinstance(error, requests.HTTPError) and response is not None and response.status_code in PERMANENT_STATUS:
+        return 'fatal'
+    if is_throttle(error):
+        return 'throttle'
+    return 'retry'
+
+
+def error_retry_after(error:BaseException) -> float:
+    """Retry-after of an error (ThrottledError or http error with the header), None if it has none"""
+    if isinstance(error, ThrottledError):
+        return error.retry_after
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'headers', None) is not None:
+        return retry_after_seconds(response.headers.get('retry-after'))
+    return None
+
+
+class AdaptiveLimiter():
+    """Token bucket with an adaptive rate and a circuit breaker, for one endpoint class (thread safe)"""
+    def __init__(self,
+                 name:str,
+                 rate:float = 1.0,
+                 min_rate:float = 0.05,
+                 max_rate:float = 10.0,
+                 burst:int = 2,
+                 slow_start:float = 0.1,
+                 increase:float = 0.05,
+                 decrease:float = 0.5,
+                 breaker_threshold:int = 5,
+                 breaker_cooldown:float = 30.0,
+                 max_breaker_cooldown:float = 600.0,
+                 probe_timeout:float = 60.0
+                 ) -> None:
+        """
+        args:
+        - name: endpoint class
+        - rate: starting rate in requests per second
+        - min_rate: lowest rate reached while throttled
+        - max_rate: highest rate reached while TikTok answers
+        - burst: requests that can be sent at once after an idle period
+        - slow_start: share of the rate added after every success until the first throttle
+        - increase: requests/s added to the rate after every success once throttled
+        - decrease: factor applied to the rate after every throttle
+        - breaker_threshold: consecutive throttles / errors that open the circuit
+        - breaker_cooldown: seconds the circuit stays open, doubled every time it opens again in a row
+        - max_breaker_cooldown: maximum seconds the circuit stays open
+        - probe_timeout: seconds after which a probe whose outcome was never recorded (caller
+          cancelled or crashed) is given up and another probe is allowed
+        """
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.slow_start = slow_start
+        self.increase = increase
+        self.threshold = max_rate
+        self.decrease = decrease
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.max_breaker_cooldown = max_breaker_cooldown
+        self.probe_timeout = probe_timeout
+        self.state = 'closed'
+        self.open_until = 0.0
+        self.probing = False
+        self.probe_started = 0.0
+        self.consecutive = 0
+        self.open_streak = 0
+        self.opened = 0
+        self.successes = 0
+        self.throttles = 0
+        self.failures = 0
+        self._next = 0.0
+        self._cut_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> tuple[float, bool]:
+        """
+        Reserve the slot of the next request
+
+        return:
+        - Tuple (seconds to wait, whether the slot was granted). A slot that is not granted
+          (rate, open circuit, probe in flight) must be asked again after the wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                if now < self.open_until:
+                    return self.open_until - now, False
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'half_open':
+                if self.probing and now - self.probe_started < self.probe_timeout:
+                    return min(1.0, self.probe_started + self.probe_timeout - now), False
+                self.probing = True
+                self.probe_started = now
+                self._next = now + 1 / self.rate
+                return 0.0, True
+            # Slots are not booked ahead, so a rate change applies to the callers already waiting
+            interval = 1 / self.rate
+            start = max(self._next, now - (self.burst - 1) * interval)
+            if start > now:
+                return start - now, False
+            self._next = start + interval
+            return 0.0, True
+
+    async def acquire(self) -> float:
+        """
+        Wait for the next request slot
+
+        return:
+        - Seconds waited
+        """
+        waited = 0.0
+        while True:
+            wait, granted = self._reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                waited += wait
+            if granted:
+                return waited
+
+    def acquire_sync(self) -> float:
+        """Blocking `acquire` for worker threads, returns the seconds waited"""
+        waited = 0.0
+        while True:
+            wait, granted = self._reserve()
+            if wait > 0:
+                time.sleep(wait)
+                waited += wait
+            if granted:
+                return waited
+
+    def _open(self, now:float) -> None:
+        cooldown = min(self.max_breaker_cooldown, self.breaker_cooldown * 2 ** self.open_streak)
+        print(f"Pausing {self.name} requests for {cooldown:.0f}s after {self.consecutive} consecutive throttles / errors")
+        self.state = 'open'
+        self.open_until = now + cooldown
+        self.probing = False
+        self.open_streak += 1
+        self.opened += 1
+
+    def success(self) -> None:
+        """A request was answered, the rate grows and a probing circuit closes"""
+        with self._lock:
+            self.successes += 1
+            self.consecutive = 0
+            if self.state == 'half_open':
+                self.state = 'closed'
+                self.probing = False
+                self.open_streak = 0
+            if self.rate < self.threshold:
+                self.rate = min(self.threshold, self.rate * (1 + self.slow_start))
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def throttled(self, retry_after:float = None) -> None:
+        """A request was throttled, the rate is cut and nothing is sent before retry-after"""
+        with self._lock:
+            now = time.monotonic()
+            self.throttles += 1
+            self.consecutive += 1
+            # Requests already in flight are throttled together, the rate is cut once for them
+            if now - self._cut_at >= max(1.0, 1 / self.rate):
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.threshold = self.rate
+                self._cut_at = now
+            self._next = max(self._next, now + (retry_after or 0.0))
+            if self.state == 'half_open' or self.consecutive >= self.breaker_threshold:
+                self._open(now)
+
+    def abandoned(self) -> None:
+        """A granted request ended without an answer of TikTok (programming error, cancelled caller), a probe in flight is released"""
+        with self._lock:
+            self.probing = False
+
+    def failed(self) -> None:
+        """A request failed with a transient error, it only counts towards the circuit breaker"""
+        with self._lock:
+            self.failures += 1
+            self.consecutive += 1
+            if self.state == 'half_open' or self.consecutive >= self.breaker_threshold:
+                self._open(time.monotonic())
+
+    def stats(self) -> dict:
+        return {"rate": round(self.rate, 3),
+                "state": self.state,
+                "successes": self.successes,
+                "throttles": self.throttles,
+                "failures": self.failures,
+                "opened": self.opened}
+
+
+class Pacer():
+    """Adaptive limiters of the endpoint classes and the retry loop built on them"""
+    def __init__(self,
+                 metrics:Metrics = None,
+                 limits:dict = None,
+                 base_backoff:float = 1.0,
+                 max_backoff:float = 60.0
+                 ) -> None:
+        """
+        args:
+        - metrics: metrics registry, waits are recorded as sleep seconds of the endpoint class
+        - limits: AdaptiveLimiter options per endpoint class, merged with DEFAULT_LIMITS
+        - base_backoff: seconds of the first backoff (full jitter, doubled on every attempt)
+        - max_backoff: maximum seconds of a backoff
+        """
+        self.metrics = metrics or Metrics()
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        limits = limits or {}
+        self.limiters = {endpoint: AdaptiveLimiter(endpoint, **{**DEFAULT_LIMITS[endpoint], **limits.get(endpoint, {})})
+                         for endpoint in ENDPOINTS}
+
+    def limiter(self, endpoint:str) -> AdaptiveLimiter:
+        if endpoint not in self.limiters:
+            raise ValueError(f'Only allowed `endpoint` values are {", ".join(ENDPOINTS)}.')
+        return self.limiters[endpoint]
+
+    async def acquire(self, endpoint:str) -> None:
+        """Wait for the next request slot of an endpoint class"""
+        waited = await self.limiter(endpoint).acquire()
+        if waited:
+            self.metrics.sleep_seconds(endpoint, waited)
+
+    def acquire_sync(self, endpoint:str) -> None:
+        """Blocking `acquire` for worker threads"""
+        waited = self.limiter(endpoint).acquire_sync()
+        if waited:
+            self.metrics.sleep_seconds(endpoint, waited)
+
+    def record(self, endpoint:str, error:BaseException = None) -> str:
+        """
+        Feed the outcome of a request back to the limiter of its endpoint class
+
+        args:
+        - endpoint: endpoint class of the request
+        - error: raised exception, None if the request succeeded
+
+        return:
+        - "ok", "throttle", "retry", "fatal" or "bug" (the caller raises the error)
+        """
+        limiter = self.limiter(endpoint)
+        kind = 'ok' if error is None else classify_error(error)
+        if kind == 'throttle':
+            limiter.throttled(error_retry_after(error))
+        elif kind == 'retry':
+            limiter.failed()
+        elif kind == 'bug':
+            # Not an answer of TikTok, the rate is left as is but a probe must not stay in flight
+            limiter.abandoned()
+        else:
+            # A permanent error is still an answer of TikTok
+            limiter.success()
+        self.metrics.inc('pacing_requests_total', endpoint=endpoint, outcome=kind)
+        return kind
+
+    def backoff_seconds(self, attempt:int, error:BaseException = None) -> float:
+        """Full jitter exponential backoff of a retry, or the retry-after of the error"""
+        retry_after = error_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    async def backoff(self, endpoint:str, attempt:int, error:BaseException = None) -> None:
+        """Sleep before the retry `attempt` (0 based) of a request"""
+        seconds = self.backoff_seconds(attempt, error)
+        self.metrics.sleep_seconds(endpoint, seconds)
+        await asyncio.sleep(seconds)
+
+    async def call(self, endpoint:str, func, *args, retries:int = 4, **kwargs):
+        """
+        Await `func(*args, **kwargs)` paced by the limiter of an endpoint class, retrying
+        throttles and transient errors with backoff. Permanent and programming errors are raised at once.
+
+        args:
+        - endpoint: endpoint class of the request
+        - func: coroutine function sending the request
+        - retries: maximum attempts
+
+        return:
+        - Result of `func`
+        """
+        for attempt in range(retries):
+            await self.acquire(endpoint)
+            try:
+                result = await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.limiter(endpoint).abandoned()
+                raise
+            except Exception as e:
+                if self.record(endpoint, e) in ('fatal', 'bug') or attempt == retries - 1:
+                    raise
+                self.metrics.retry(endpoint)
+                await self.backoff(endpoint, attempt, e)
+                continue
+            self.record(endpoint)
+            return result
+
+    def stats(self) -> dict:
+        """Rate, circuit state and counters per endpoint class"""
+        return {endpoint: limiter.stats() for endpoint, limiter in self.limiters.items()}
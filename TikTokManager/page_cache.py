@@ -0,0 +1,28 @@
+"""
+On-disk cache of the video page jsons.
+- keyed by video id, entries expire after a ttl
+- payloads are stored zlib-compressed in a size-bounded LRUStore (sqlite, least-recently-used
+  eviction, hit / miss / eviction counters for the run report)
+"""
+import json
+import zlib
+
+from TikTokManager.lru_store import LRUStore
+
+
+class PageCache(LRUStore):
+    """Size-bounded LRU cache of page jsons with ttl"""
+    def __init__(self, path:str, ttl:int = 86400, max_bytes:int = 512 * 1024 * 1024) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the cache
+        - ttl: seconds an entry stays valid, 0 or None to never expire
+        - max_bytes: maximum compressed size of the cache
+        """
+        super().__init__(path, ttl, max_bytes)
+
+    def encode(self, value:dict) -> bytes:
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    def decode(self, data:bytes) -> dict:
+        return json.loads(zlib.decompress(data))
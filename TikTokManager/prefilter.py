@@ -0,0 +1,236 @@
+"""
+Prefilter of the texts sent to analysis (comments, transcriptions).
+- texts are normalized in vectorized form (pyarrow compute): compatibility forms, accents,
+  case, urls, mentions, punctuation and emojis, so empty and emoji-only items are the ones
+  with nothing left
+- near-duplicates (copy-pasted campaign comments with small edits, reposted videos) are
+  clustered with MinHash signatures of character shingles and LSH banding, candidate
+  pairs are confirmed with the estimated Jaccard similarity
+- only one representative per cluster is analysed, its result is propagated to the rest
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+LINKS_RE = r'https?://\S+|www\.\S+|@[\w.]+'
+# Everything but letters and numbers: punctuation, symbols, emojis and whitespace
+NON_WORD_RE = r'[^\p{L}\p{N}]+'
+ACCENTS_RE = r'\p{Mn}'
+SHINGLE_PRIME = np.uint64(1099511628211)
+MIX_MULTIPLIER = np.uint64(0xff51afd7ed558ccd)
+MAX_BLOCK_SHINGLES = 1 << 22
+
+
+def normalize_texts(texts) -> pd.Series:
+    """
+    Normalize texts for near-duplicate detection in one vectorized pass
+
+    args:
+    - texts: sequence or Series of texts, missing values are allowed
+
+    return:
+    - Series of lower case texts without accents, links, mentions, punctuation nor emojis
+      ("" for empty and emoji-only texts)
+    """
+    texts = pd.Series(texts)
+    values = pa.array(texts.astype('string'), type=pa.string())
+    values = pc.utf8_normalize(values, 'NFKD')
+    values = pc.replace_substring_regex(values, ACCENTS_RE, '')
+    values = pc.utf8_lower(values)
+    values = pc.replace_substring_regex(values, LINKS_RE, ' ')
+    values = pc.replace_substring_regex(values, NON_WORD_RE, ' ')
+    values = pc.fill_null(pc.utf8_trim_whitespace(values), '')
+    return pd.Series(values.to_numpy(zero_copy_only=False), index=texts.index, dtype=object)
+
+
+def _mix(values:np.ndarray) -> np.ndarray:
+    """64 bit finalizer, spreads the bits of the shingle hashes"""
+    values = values ^ (values >> np.uint64(33))
+    values = values * MIX_MULTIPLIER
+    return values ^ (values >> np.uint64(33))
+
+
+def _connected_components(size:int, left:np.ndarray, right:np.ndarray) -> np.ndarray:
+    """Smallest member of the component of every node of an undirected graph (label propagation)"""
+    labels = np.arange(size)
+    while True:
+        low = np.minimum(labels[left], labels[right])
+        updated = labels.copy()
+        np.minimum.at(updated, left, low)
+        np.minimum.at(updated, right, low)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+class MinHashLSH():
+    """MinHash signatures of character shingles and LSH banding over numpy arrays"""
+    def __init__(self,
+                 threshold:float = 0.7,
+                 shingle_size:int = 4,
+                 num_perm:int = 64,
+                 bands:int = 16,
+                 seed:int = 0
+                 ) -> None:
+        """
+        args:
+        - threshold: estimated Jaccard similarity of the shingles above which two texts are duplicates
+        - shingle_size: characters per shingle, shorter texts are one shingle
+        - num_perm: hash functions of a signature
+        - bands: LSH bands, texts sharing all the rows of one band are candidates. More bands
+          find more pairs (lower similarities) at the cost of more candidates to confirm
+        - seed: seed of the hash functions
+        """
+        if num_perm % bands:
+            raise ValueError('`num_perm` must be a multiple of `bands`.')
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        generator = np.random.default_rng(seed)
+        self.multipliers = generator.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.offsets = generator.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.band_multipliers = generator.integers(1, 2 ** 63, self.rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    def _shingles(self, texts:list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Hashes of the character shingles of several texts
+
+        return:
+        - Tuple (shingle hashes, index of the first shingle of every text)
+        """
+        size = self.shingle_size
+        texts = [text.ljust(size) for text in texts]
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        counts = lengths - size + 1
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        # Position of every shingle in the joined codes, shingles never cross two texts
+        positions = np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        hashes = np.zeros(len(positions), dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * SHINGLE_PRIME + codes[positions + offset]
+        return _mix(hashes), np.cumsum(counts) - counts
+
+    def signatures(self, texts:list[str]) -> np.ndarray:
+        """
+        MinHash signatures of texts
+
+        args:
+        - texts: normalized texts
+
+        return:
+        - Array (texts, num_perm) of uint32
+        """
+        signatures = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        # Blocks of texts keep the shingle arrays small whatever the amount of texts
+        shingles = np.cumsum(np.maximum(lengths, self.shingle_size) - self.shingle_size + 1)
+        bounds = np.searchsorted(shingles, np.arange(MAX_BLOCK_SHINGLES, shingles[-1], MAX_BLOCK_SHINGLES), side='right')
+        edges = np.unique(np.concatenate(([0], bounds, [len(texts)])))
+        for block_start, block_end in zip(edges[:-1], edges[1:]):
+            hashes, starts = self._shingles(texts[block_start:block_end])
+            for permutation in range(self.num_perm):
+                values = (hashes * self.multipliers[permutation] + self.offsets[permutation]) >> np.uint64(32)
+                signatures[block_start:block_end, permutation] = np.minimum.reduceat(values, starts)
+        return signatures
+
+    def clusters(self, texts:list[str]) -> np.ndarray:
+        """
+        Cluster near-duplicate texts
+
+        args:
+        - texts: normalized texts, without repeated values
+
+        return:
+        - Array with the index of the representative (first member) of the cluster of every text
+        """
+        if not texts:
+            return np.zeros(0, dtype=np.int64)
+        signatures = self.signatures(texts)
+        left, right = [], []
+        for band in range(self.bands):
+            rows = signatures[:, band * self.rows:(band + 1) * self.rows].astype(np.uint64)
+            keys = _mix((rows * self.band_multipliers).sum(axis=1) + np.uint64(band))
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            first = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+            # Every member of a bucket is compared with the first text of the bucket and with the
+            # previous member, so variants far from the first text still join through a chain
+            leaders = order[np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))][~first]
+            previous = order[:-1][~first[1:]]
+            members = order[~first]
+            for others in (leaders, previous):
+                similar = (signatures[members] == signatures[others]).mean(axis=1) >= self.threshold
+                left.append(members[similar])
+                right.append(others[similar])
+        return _connected_components(len(texts), np.concatenate(left), np.concatenate(right))
+
+
+def prefilter(df:pd.DataFrame,
+              text_column:str = 'text',
+              threshold:float = 0.7,
+              drop_empty:bool = True,
+              group_column:str = None,
+              lsh:MinHashLSH = None
+              ) -> pd.DataFrame:
+    """
+    Mark the rows to analyse: one representative per cluster of near-duplicate texts
+
+    args:
+    - df: rows to analyse
+    - text_column: column with the text
+    - threshold: estimated Jaccard similarity above which two texts are duplicates
+    - drop_empty: drop the rows without text left after normalization (empty, emoji-only,
+      only mentions or links). When False every one of them is its own cluster
+    - group_column: texts are only clustered with texts of the same group (e.g. the system
+      prompt the rows are analysed with)
+    - lsh: MinHashLSH instance, one with `threshold` by default
+
+    return:
+    - Copy of df with a "cluster" column (position of the representative row, -1 for dropped
+      rows) and a "representative" column (True for the rows to analyse)
+    """
+    lsh = lsh or MinHashLSH(threshold)
+    normalized = normalize_texts(df[text_column]).to_numpy(dtype=object)
+    empty = normalized == ''
+    groups = df[group_column].astype(str).to_numpy(dtype=object) if group_column is not None else np.zeros(len(df), dtype=object)
+    cluster = np.full(len(df), -1, dtype=np.int64)
+    for group in pd.unique(groups):
+        rows = np.flatnonzero((groups == group) & ~empty)
+        # Exact copies are folded before hashing, LSH only sees distinct texts
+        codes, uniques = pd.factorize(normalized[rows])
+        first_rows = rows[np.unique(codes, return_index=True)[1]]
+        labels = lsh.clusters(list(uniques))
+        cluster[rows] = first_rows[labels[codes]]
+    if not drop_empty:
+        cluster[empty] = np.flatnonzero(empty)
+    result = df.copy()
+    result['cluster'] = cluster
+    result['representative'] = cluster == np.arange(len(df))
+    return result
+
+
+def propagate(df:pd.DataFrame, results:pd.DataFrame, id_column:str, columns:list[str] = None) -> pd.DataFrame:
+    """
+    Copy the results of the representatives to every member of their cluster
+
+    args:
+    - df: rows returned by `prefilter`
+    - results: results of the representative rows, with their id
+    - id_column: id column shared by df and results
+    - columns: result columns to copy, every column of results but the id by default
+
+    return:
+    - Rows of df that were not dropped with the result of their representative
+    """
+    columns = columns or [column for column in results.columns if column != id_column]
+    kept = df[df['cluster'] >= 0]
+    representative_ids = df[id_column].to_numpy()[kept['cluster'].to_numpy()]
+    lookup = results.drop_duplicates(subset=[id_column]).set_index(id_column)[columns]
+    values = lookup.reindex(representative_ids)
+    values.index = kept.index
+    return kept.drop(columns=[column for column in columns if column in kept.columns]).join(values)
@@ -0,0 +1,224 @@
+"""
+Record types of the tables written by TikTokManager.
+- VideoRecord / CommentRecord are slotted dataclasses, their fields are the only
+  definition of the output schema (TABLE_SCHEMAS is derived from them)
+- the `webapp.video-detail` scope is cut out of the video page without decoding
+  the rest of the rehydration blob
+- records are turned into columns (Arrow / pandas / sql) only in batches
+"""
+import json
+import re
+from dataclasses import dataclass, fields
+from datetime import datetime
+
+from TikTokManager.transcription import select_transcription
+
+REHYDRATION_RE = re.compile(r'<script[^>]*id="__UNIVERSAL_DATA_FOR_REHYDRATION__"[^>]*>')
+VIDEO_DETAIL_RE = re.compile(r'"webapp\.video-detail"\s*:\s*')
+COLUMN_TYPES = {str: 'str', int: 'int', float: 'float', bool: 'bool'}
+_decoder = json.JSONDecoder()
+
+
+def coerce_value(value, kind:str):
+    """
+    Cast a value to the column type of a schema, None stays None. A value that does not
+    fit the column (e.g. a stat TikTok sends as "1.2K") becomes None instead of failing the batch
+
+    args:
+    - value: value to cast
+    - kind: column type: "str", "int", "float" or "bool"
+
+    return:
+    - Casted value
+    """
+    if value is None:
+        return None
+    try:
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            return float(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if kind == 'bool':
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', '1')
+        return bool(value)
+    return str(value)
+
+
+@dataclass(slots=True)
+class VideoRecord():
+    """One row of the videos_data table"""
+    video_id: str
+    hashtag: str = None
+    video_timestamp: str = None
+    video_locationcreated: str = None
+    video_diggcount: int = None
+    video_sharecount: int = None
+    video_commentcount: int = None
+    video_playcount: int = None
+    video_description: str = None
+    video_is_ad: bool = None
+    author_username: str = None
+    author_name: str = None
+    author_followercount: int = None
+    author_heartcount: int = None
+    author_videocount: int = None
+    author_diggcount: int = None
+    author_verified: bool = None
+    trasncription_lang: str = None
+    video_trasncription: str = None
+    mining_date: str = None
+
+    @classmethod
+    def from_item(cls, item:dict, hashtag:str, mining_date:str) -> tuple['VideoRecord', str]:
+        """
+        Build the record of a video from its itemStruct
+
+        args:
+        - item: itemStruct of the video
+        - hashtag: hashtag the video was discovered from
+        - mining_date: formatted date of the run
+
+        return:
+        - Tuple with the record and the url of the transcription to download (None without subtitles)
+        """
+        stats = item.get('stats') or {}
+        author = item.get('author') or {}
+        author_stats = item.get('authorStats') or {}
+        created_time = coerce_value(item.get('createTime'), 'int')
+        language, trasncription_url = select_transcription((item.get('video') or {}).get('subtitleInfos'))
+        record = cls(video_id=item['id'],
+                     hashtag=hashtag,
+                     video_timestamp=datetime.fromtimestamp(created_time).isoformat() if created_time is not None else None,
+                     video_locationcreated=item.get('locationCreated'),
+                     video_diggcount=stats.get('diggCount'),
+                     video_sharecount=stats.get('shareCount'),
+                     video_commentcount=stats.get('commentCount'),
+                     video_playcount=stats.get('playCount'),
+                     video_description=item.get('desc'),
+                     video_is_ad=item.get('isAd'),
+                     author_username=author.get('uniqueId'),
+                     author_name=author.get('nickname'),
+                     author_followercount=author_stats.get('followerCount'),
+                     author_heartcount=author_stats.get('heartCount'),
+                     author_videocount=author_stats.get('videoCount'),
+                     author_diggcount=author_stats.get('diggCount'),
+                     author_verified=author.get('verified'),
+                     trasncription_lang=language if trasncription_url is not None else None,
+                     mining_date=mining_date)
+        return record, trasncription_url
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in VIDEO_COLUMNS}
+
+
+@dataclass(slots=True)
+class CommentRecord():
+    """One row of the comments_data table"""
+    video_id: str
+    language: str = None
+    text: str = None
+    likes: int = None
+    date: str = None
+    comment_id: str = None
+
+    @classmethod
+    def from_comment(cls, video_id:str, comment:dict) -> 'CommentRecord':
+        """
+        Build the record of a comment from the `as_dict` of a TikTokApi comment
+
+        args:
+        - video_id: id of the commented video
+        - comment: comment dictionary
+
+        return:
+        - CommentRecord
+        """
+        create_time = comment.get("create_time")
+        return cls(video_id=video_id,
+                   language=comment.get("comment_language"),
+                   text=comment.get("text"),
+                   likes=comment.get("digg_count"),
+                   date=datetime.fromtimestamp(create_time).strftime('%d-%m-%Y %H:%M') if create_time is not None else None,
+                   comment_id=comment.get("cid"))
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in COMMENT_COLUMNS}
+
+
+def schema_of(record_type:type) -> dict:
+    """Column name -> column type of a record type, in field order"""
+    return {field.name: COLUMN_TYPES.get(field.type, 'str') for field in fields(record_type)}
+
+
+VIDEO_COLUMNS = tuple(field.name for field in fields(VideoRecord))
+COMMENT_COLUMNS = tuple(field.name for field in fields(CommentRecord))
+
+# Column name -> type of the tables written by TikTokManager, in sheet order
+TABLE_SCHEMAS = {
+    'videos_data': schema_of(VideoRecord),
+    'comments_data': schema_of(CommentRecord),
+}
+
+
+def to_columns(rows:list, schema:dict) -> dict[str, list]:
+    """
+    Turn a batch of records (or row dictionaries) into typed columns
+
+    args:
+    - rows: list of records or dictionaries
+    - schema: column name -> column type
+
+    return:
+    - Dictionary column name -> list of values, missing values are None
+    """
+    columns = {}
+    for column, kind in schema.items():
+        values = [row.get(column) if type(row) is dict else getattr(row, column, None) for row in rows]
+        columns[column] = [coerce_value(value, kind) for value in values]
+    return columns
+
+
+def extract_video_detail(html:str) -> dict:
+    """
+    Cut the `webapp.video-detail` scope out of a video page, only that scope is decoded
+
+    args:
+    - html: video page
+
+    return:
+    - Page json reduced to {"__DEFAULT_SCOPE__": {"webapp.video-detail": ...}}, the whole rehydration
+      json if the page has no video detail, None if the page has no rehydration script or
+      its json is cut or malformed
+    """
+    script = REHYDRATION_RE.search(html)
+    if script is None:
+        return None
+    detail = VIDEO_DETAIL_RE.search(html, script.end())
+    end = html.find('</script>', script.end())
+    if detail is None or (end != -1 and detail.start() > end):
+        try:
+            return json.loads(html[script.end():end if end != -1 else None])
+        except json.JSONDecodeError:
+            return None
+    try:
+        video_detail, _ = _decoder.raw_decode(html, detail.end())
+    except json.JSONDecodeError:
+        return None
+    return {"__DEFAULT_SCOPE__": {"webapp.video-detail": video_detail}}
+
+
+def video_detail(tiktok_json:dict) -> dict:
+    """`webapp.video-detail` scope of a page json, {} if the page json or any level is missing"""
+    scope = tiktok_json.get("__DEFAULT_SCOPE__") if isinstance(tiktok_json, dict) else None
+    detail = scope.get("webapp.video-detail") if isinstance(scope, dict) else None
+    return detail if isinstance(detail, dict) else {}
+
+
+def video_item(tiktok_json:dict) -> dict:
+    """itemStruct of a page json, None if the page json or any level is missing (deleted, private or throttled video)"""
+    item_info = video_detail(tiktok_json).get("itemInfo")
+    item = item_info.get("itemStruct") if isinstance(item_info, dict) else None
+    return item if isinstance(item, dict) else None
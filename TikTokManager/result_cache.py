@@ -0,0 +1,93 @@
+"""
+Persistent cache of analysis results (LLM answers, sentiment labels, ...).
+- keyed by a hash of the normalized text, model id, prompt / schema version and parameters,
+  so only new or changed items are analysed again after a crawl refresh
+- identical texts share one entry, a comment repeated under many videos is analysed once
+- results are stored as json in a size-bounded LRUStore (sqlite, least-recently-used eviction,
+  hit / miss / eviction counters for the run report)
+"""
+import hashlib
+import json
+import re
+import unicodedata
+
+from TikTokManager.lru_store import LRUStore
+
+SPACES_RE = re.compile(r'\s+')
+
+
+def normalize_text(text:str) -> str:
+    """Unicode NFKC form with collapsed whitespace, so trivially different copies share a key"""
+    return SPACES_RE.sub(' ', unicodedata.normalize('NFKC', str(text or ''))).strip()
+
+
+def cache_key(text:str, model:str, version:str = '1', params:dict = None) -> str:
+    """
+    Key of an analysis result
+
+    args:
+    - text: analysed text (prompts included for LLM requests)
+    - model: model id
+    - version: prompt / schema version, change it to invalidate the previous results
+    - params: any other parameter that changes the result (temperature, schema, ...)
+
+    return:
+    - Hex digest of the key
+    """
+    payload = json.dumps([normalize_text(text), model, version, params or {}], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResultCache(LRUStore):
+    """Size-bounded LRU cache of analysis results"""
+    def __init__(self, path:str, max_bytes:int = 256 * 1024 * 1024) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the cache
+        - max_bytes: maximum size of the stored results
+        """
+        super().__init__(path, None, max_bytes)
+
+
+def cached_map(cache:ResultCache,
+               texts:list[str],
+               compute,
+               model:str,
+               version:str = '1',
+               params:dict = None,
+               counters:dict = None
+               ) -> list:
+    """
+    Analyse a list of texts through the cache: every distinct text missing from the cache is
+    computed once, in one call, and stored. None results (failures) are not stored, so they
+    are computed again on the next call
+
+    args:
+    - cache: result cache, None to compute every distinct text
+    - texts: texts to analyse
+    - compute: function taking a list of distinct texts and returning their results in order
+    - model: model id
+    - version: prompt / schema version
+    - params: other parameters that change the result
+    - counters: optional dictionary whose "texts", "distinct" and "cached" counts are increased
+
+    return:
+    - List with the result of every text, in order
+    """
+    keys = [cache_key(text, model, version, params) for text in texts]
+    found = cache.get_many(keys) if cache is not None else {}
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        computed = dict(zip(missing, compute(list(missing.values()))))
+        if cache is not None:
+            cache.put_many({key: result for key, result in computed.items() if result is not None})
+        found.update(computed)
+    if counters is not None:
+        distinct = len(found)
+        counters['texts'] = counters.get('texts', 0) + len(texts)
+        counters['distinct'] = counters.get('distinct', 0) + distinct
+        counters['cached'] = counters.get('cached', 0) + distinct - len(missing)
+    return [found[key] for key in keys]
@@ -0,0 +1,148 @@
+"""
+Batched sentiment inference for the comments sheet (star rating models like nlptown/bert-base-multilingual-uncased-sentiment).
+- distinct texts are classified once, and only new texts when a ResultCache is given
+- texts are sorted by token length and padded per batch, so short comments don't pay for long ones
+- true batched forward passes with a tunable batch size, token budget per batch and thread count
+- star labels are mapped to `score` / `clasification` with a lookup table
+"""
+import pandas as pd
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from TikTokManager.result_cache import ResultCache, cached_map
+
+DEFAULT_MODEL = 'nlptown/bert-base-multilingual-uncased-sentiment'
+DATE_FORMAT = "%d-%m-%Y %H:%M"
+# Star label of the model -> (score, clasification)
+LABELS = {'5 stars': (5, 'Excellent'),
+          '4 stars': (4, 'Good'),
+          '3 stars': (3, 'Neutral'),
+          '2 stars': (2, 'Bad'),
+          '1 star': (1, 'Terrible'),
+          '0 stars': (0, 'Terrible')}
+ERROR_LABEL = (None, '#ERROR')
+
+
+def label_to_score(label:str) -> tuple:
+    """(score, clasification) of a star label, (None, '#ERROR') for an unknown label"""
+    return LABELS.get(label, ERROR_LABEL)
+
+
+class SentimentEngine():
+    """Batched, length bucketed sentiment classifier"""
+    def __init__(self,
+                 model:str = DEFAULT_MODEL,
+                 batch_size:int = 32,
+                 max_batch_tokens:int = 8192,
+                 threads:int = None,
+                 max_length:int = 512,
+                 cache:ResultCache = None,
+                 version:str = '1'
+                 ) -> None:
+        """
+        args:
+        - model: model id in the Hugging Face hub or path to a local model
+        - batch_size: maximum texts per forward pass
+        - max_batch_tokens: maximum padded tokens per forward pass, batches of long texts are smaller
+        - threads: torch intra-op threads (process wide), None to keep the torch default
+        - max_length: texts are truncated to this amount of tokens
+        - cache: result cache, None to classify every distinct text
+        - version: cache version, change it to invalidate the cached labels of the model
+        """
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_id = model
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_length = max_length
+        self.cache = cache
+        self.version = version
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model)
+        self.model.eval()
+        self.labels = self.model.config.id2label
+        self.counters = {"texts": 0, "distinct": 0, "cached": 0, "batches": 0, "errors": 0}
+
+    def _batches(self, lengths:list[int]) -> list[list[int]]:
+        """Indexes of the texts sorted by token length, split in batches under the size and token limits"""
+        batches = []
+        batch = []
+        for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+            # Sorted ascending, so the padded length of the batch is the length of the last text
+            if batch and (len(batch) >= self.batch_size or (len(batch) + 1) * lengths[index] > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def predict(self, texts:list[str]) -> list[dict]:
+        """
+        Classify texts with batched forward passes
+
+        args:
+        - texts: texts to classify
+
+        return:
+        - List with a dictionary {label, percentage} per text, in order, None for the texts of a failed batch
+        """
+        texts = [str(text) for text in texts]
+        lengths = [len(ids) for ids in self.tokenizer(texts, truncation=True, max_length=self.max_length)['input_ids']]
+        results = [None] * len(texts)
+        for batch in self._batches(lengths):
+            try:
+                # Padded to the longest text of the batch only
+                features = self.tokenizer([texts[index] for index in batch], padding=True, truncation=True,
+                                          max_length=self.max_length, return_tensors='pt')
+                with torch.inference_mode():
+                    probabilities = self.model(**features).logits.softmax(dim=-1)
+            except Exception as e:
+                print(f"Error processing {len(batch)} text(s) starting with: {texts[batch[0]]} - {e}")
+                self.counters['errors'] += len(batch)
+                continue
+            percentages, label_ids = probabilities.max(dim=-1)
+            for index, percentage, label_id in zip(batch, percentages.tolist(), label_ids.tolist()):
+                results[index] = {"label": self.labels[label_id], "percentage": percentage}
+            self.counters['batches'] += 1
+        return results
+
+    def classify(self, texts:list[str]) -> list[dict]:
+        """
+        Classify texts, every distinct text once and through the cache
+
+        args:
+        - texts: texts to classify
+
+        return:
+        - List with a dictionary {label, percentage} per text, in order, None when the text failed
+        """
+        # Failed batches are not cached, they are retried on the next run
+        return cached_map(self.cache, texts, self.predict, self.model_id, self.version,
+                          {"max_length": self.max_length}, self.counters)
+
+    def classify_comments(self,
+                          df:pd.DataFrame,
+                          text_column:str = 'text',
+                          date_column:str = 'date',
+                          id_column:str = 'video_id'
+                          ) -> pd.DataFrame:
+        """
+        Sentiment of the comments sheet
+
+        args:
+        - df: comments dataframe
+        - text_column: column with the comment text
+        - date_column: column with the comment date as "%d-%m-%Y %H:%M"
+        - id_column: column with the video id
+
+        return:
+        - Dataframe with the columns score, clasification, percentage, date and video_id
+        """
+        results = self.classify(df[text_column].fillna('').tolist())
+        scores = [label_to_score(result['label']) if result is not None else ERROR_LABEL for result in results]
+        return pd.DataFrame({"score": [score for score, _ in scores],
+                             "clasification": [clasification for _, clasification in scores],
+                             "percentage": [result['percentage'] if result is not None else None for result in results],
+                             "date": pd.to_datetime(df[date_column], format=DATE_FORMAT, errors='coerce').tolist(),
+                             "video_id": df[id_column].tolist()})
@@ -0,0 +1,345 @@
+"""
+Append-only output sinks for mined records.
+- rows (records or dictionaries) are buffered per table and flushed in batches,
+  so the write cost per record stays constant however large the dataset grows
+- backends: parquet (one row group file per flush), sqlite and jsonl
+- excel is produced once, at the end of a run, with `export_excel`
+- pandas is only imported to read tables back, writing rows does not need it
+"""
+import os
+import json
+import sqlite3
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from TikTokManager.records import TABLE_SCHEMAS, schema_of, to_columns
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class OutputSink(ABC):
+    """Base class of the append-only sinks, backends implement the abstract methods"""
+    def __init__(self, path:str, batch_size:int = 500, schemas:dict = None) -> None:
+        """
+        args:
+        - path: location of the sink (file or folder depending on the backend)
+        - batch_size: amount of buffered rows per table that triggers a flush
+        - schemas: column types per table, defaults to TABLE_SCHEMAS. Tables without
+          schema take the columns of their first batch as strings
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.schemas = dict(TABLE_SCHEMAS if schemas is None else schemas)
+        self.buffers = {}
+        self.offsets = {table: self._count(table) for table in self.tables()}
+
+    def _schema(self, table:str, rows:list[dict]) -> dict:
+        """Schema of a table, registering one from the first batch if the table is unknown"""
+        if table not in self.schemas:
+            if type(rows[0]) is not dict:
+                self.schemas[table] = schema_of(type(rows[0]))
+                return self.schemas[table]
+            columns = {}
+            for row in rows:
+                for key in row:
+                    columns.setdefault(key, 'str')
+            self.schemas[table] = columns
+        return self.schemas[table]
+
+    def write(self, table:str, rows:list[dict]) -> None:
+        """
+        Buffer rows of a table, flushing the buffer when it reaches `batch_size`
+
+        args:
+        - table: table (excel sheet) name
+        - rows: list of records (VideoRecord, CommentRecord) or dictionaries to append
+
+        return:
+        - None
+        """
+        buffer = self.buffers.setdefault(table, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table:str = None) -> None:
+        """
+        Append the buffered rows of a table (or every table) to the backend
+
+        args:
+        - table: table to flush, all tables if None
+
+        return:
+        - None
+        """
+        tables = [table] if table is not None else list(self.buffers)
+        for name in tables:
+            rows = self.buffers.get(name)
+            if not rows:
+                continue
+            schema = self._schema(name, rows)
+            self._append(name, schema, to_columns(rows, schema))
+            self.offsets[name] = self.offsets.get(name, 0) + len(rows)
+            self.buffers[name] = []
+
+    def truncate(self, offsets:dict) -> None:
+        """
+        Drop the rows stored after the given offsets (rows written after the last
+        journal commit of an interrupted run), tables missing in `offsets` are emptied
+
+        args:
+        - offsets: rows to keep per table
+
+        return:
+        - None
+        """
+        self.buffers = {}
+        for table in self.tables():
+            offset = offsets.get(table, 0)
+            if self.offsets.get(table, 0) > offset:
+                print(f"Truncating {table} from {self.offsets[table]} to {offset} rows")
+                self._truncate(table, offset)
+                self.offsets[table] = offset
+
+    @abstractmethod
+    def _append(self, table:str, schema:dict, columns:dict[str, list]) -> None:
+        """Append a batch of typed columns to a table"""
+
+    @abstractmethod
+    def _truncate(self, table:str, offset:int) -> None:
+        """Keep the first `offset` rows of a table"""
+
+    @abstractmethod
+    def _count(self, table:str) -> int:
+        """Rows stored in a table"""
+
+    @abstractmethod
+    def tables(self) -> list[str]:
+        """Tables already stored in the backend"""
+
+    @abstractmethod
+    def read(self, table:str) -> 'pd.DataFrame':
+        """
+        Read a whole table back
+
+        args:
+        - table: table name
+
+        return:
+        - DataFrame with the stored rows
+        """
+
+    def close(self) -> None:
+        """Flush every pending row"""
+        self.flush()
+
+    def export_excel(self, file_path:str) -> str:
+        """
+        Export every table to one sheet of a new excel file (one-shot, at the end of a run)
+
+        args:
+        - file_path: path to the excel file
+
+        return:
+        - file_path
+        """
+        import pandas as pd
+        self.flush()
+        with pd.ExcelWriter(file_path, engine="openpyxl") as writer:
+            for table in self.tables():
+                self.read(table).to_excel(writer, sheet_name=table, index=False)
+        return file_path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ParquetSink(OutputSink):
+    """Parquet sink: every flush writes a new row group file under <path>/<table>/"""
+    arrow_types = {'str': 'string', 'int': 'int64', 'float': 'float64', 'bool': 'bool_'}
+
+    def __init__(self, path:str, batch_size:int = 500, schemas:dict = None) -> None:
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        os.makedirs(path, exist_ok=True)
+        super().__init__(path, batch_size, schemas)
+
+    def _table_dir(self, table:str) -> str:
+        return os.path.join(self.path, table)
+
+    def _parts(self, table:str) -> list[str]:
+        folder = self._table_dir(table)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.parquet'))
+
+    def _arrow_schema(self, schema:dict):
+        return self.pa.schema([(column, getattr(self.pa, self.arrow_types[kind])())
+                               for column, kind in schema.items()])
+
+    def _append(self, table:str, schema:dict, columns:dict[str, list]) -> None:
+        folder = self._table_dir(table)
+        os.makedirs(folder, exist_ok=True)
+        arrow_table = self.pa.Table.from_pydict(columns, schema=self._arrow_schema(schema))
+        part_path = os.path.join(folder, f'part-{self.offsets.get(table, 0):012d}.parquet')
+        # Write to a temporary name first so a crash never leaves a truncated part
+        self.pq.write_table(arrow_table, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+
+    def _truncate(self, table:str, offset:int) -> None:
+        start = 0
+        for part in self._parts(table):
+            num_rows = self.pq.ParquetFile(part).metadata.num_rows
+            if start >= offset:
+                os.unlink(part)
+            elif start + num_rows > offset:
+                arrow_table = self.pq.read_table(part).slice(0, offset - start)
+                self.pq.write_table(arrow_table, part + '.tmp')
+                os.replace(part + '.tmp', part)
+            start += num_rows
+
+    def _count(self, table:str) -> int:
+        return sum(self.pq.ParquetFile(part).metadata.num_rows for part in self._parts(table))
+
+    def tables(self) -> list[str]:
+        return sorted(t for t in os.listdir(self.path) if self._parts(t))
+
+    def read(self, table:str) -> 'pd.DataFrame':
+        import pandas as pd
+        self.flush(table)
+        parts = self._parts(table)
+        if not parts:
+            return pd.DataFrame(columns=list(self.schemas.get(table, {})))
+        return self.pa.concat_tables([self.pq.read_table(part) for part in parts]).to_pandas()
+
+
+class SqliteSink(OutputSink):
+    """SQLite sink: one table per sheet in <path>.sqlite"""
+    sql_types = {'str': 'TEXT', 'int': 'INTEGER', 'float': 'REAL', 'bool': 'INTEGER'}
+
+    def __init__(self, path:str, batch_size:int = 500, schemas:dict = None) -> None:
+        if not path.endswith('.sqlite'):
+            path = path + '.sqlite'
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        super().__init__(path, batch_size, schemas)
+
+    def _append(self, table:str, schema:dict, columns:dict[str, list]) -> None:
+        definition = ', '.join(f'"{column}" {self.sql_types[kind]}' for column, kind in schema.items())
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({definition})')
+        placeholders = ', '.join('?' for _ in schema)
+        names = ', '.join(f'"{column}"' for column in schema)
+        self.conn.executemany(f'INSERT INTO "{table}" ({names}) VALUES ({placeholders})',
+                              zip(*(columns[column] for column in schema)))
+        self.conn.commit()
+
+    def _truncate(self, table:str, offset:int) -> None:
+        # Rows are only appended, so rowid follows insertion order
+        self.conn.execute(f'DELETE FROM "{table}" WHERE rowid NOT IN '
+                          f'(SELECT rowid FROM "{table}" ORDER BY rowid LIMIT ?)', (offset,))
+        self.conn.commit()
+
+    def _count(self, table:str) -> int:
+        return self.conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    def tables(self) -> list[str]:
+        rows = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name").fetchall()
+        return [row[0] for row in rows]
+
+    def read(self, table:str) -> 'pd.DataFrame':
+        import pandas as pd
+        self.flush(table)
+        df = pd.read_sql_query(f'SELECT * FROM "{table}"', self.conn)
+        for column, kind in self.schemas.get(table, {}).items():
+            if kind == 'bool' and column in df.columns:
+                df[column] = df[column].astype('boolean')
+        return df
+
+    def close(self) -> None:
+        super().close()
+        self.conn.close()
+
+
+class JsonlSink(OutputSink):
+    """JSON lines sink: one <path>/<table>.jsonl file per sheet"""
+    def __init__(self, path:str, batch_size:int = 500, schemas:dict = None) -> None:
+        os.makedirs(path, exist_ok=True)
+        super().__init__(path, batch_size, schemas)
+
+    def _file(self, table:str) -> str:
+        return os.path.join(self.path, f'{table}.jsonl')
+
+    def _append(self, table:str, schema:dict, columns:dict[str, list]) -> None:
+        names = list(columns)
+        with open(self._file(table), 'a', encoding='utf-8') as file:
+            file.write(''.join(json.dumps(dict(zip(names, values)), ensure_ascii=False) + '\n'
+                               for values in zip(*columns.values())))
+
+    def _truncate(self, table:str, offset:int) -> None:
+        with open(self._file(table), 'r+b') as file:
+            for _ in range(offset):
+                file.readline()
+            file.truncate(file.tell())
+
+    def _count(self, table:str) -> int:
+        with open(self._file(table), 'r', encoding='utf-8') as file:
+            return sum(1 for line in file if line.strip())
+
+    def tables(self) -> list[str]:
+        return sorted(f[:-len('.jsonl')] for f in os.listdir(self.path) if f.endswith('.jsonl'))
+
+    def read(self, table:str) -> 'pd.DataFrame':
+        import pandas as pd
+        self.flush(table)
+        if not os.path.exists(self._file(table)):
+            return pd.DataFrame(columns=list(self.schemas.get(table, {})))
+        return pd.read_json(self._file(table), lines=True, dtype=False)
+
+
+SINKS = {
+    'parquet': ParquetSink,
+    'sqlite': SqliteSink,
+    'jsonl': JsonlSink,
+}
+
+
+def guess_format(path:str) -> str:
+    """
+    Output format of an existing sink
+
+    args:
+    - path: sink path (parquet / jsonl folder or sqlite file)
+
+    return:
+    - "parquet", "sqlite" or "jsonl"
+    """
+    if path.endswith('.sqlite'):
+        return 'sqlite'
+    if os.path.isdir(path) and any(name.endswith('.jsonl') for name in os.listdir(path)):
+        return 'jsonl'
+    return 'parquet'
+
+
+def open_sink(output_format:str, path:str, batch_size:int = 500, schemas:dict = None) -> OutputSink:
+    """
+    Create the sink of an output format
+
+    args:
+    - output_format: "parquet", "sqlite" or "jsonl"
+    - path: base path of the sink, without extension
+    - batch_size: amount of buffered rows per table that triggers a flush
+    - schemas: column types per table, defaults to TABLE_SCHEMAS
+
+    return:
+    - OutputSink instance
+    """
+    if output_format not in SINKS:
+        raise ValueError(f'Only allowed `output_format` values are {", ".join(SINKS)}.')
+    return SINKS[output_format](path, batch_size=batch_size, schemas=schemas)
@@ -1,36 +1,435 @@
 """
 Class to manage data extraction from tiktok api. 
 - code based on pyktok library
+- pyktok, pandas, openpyxl and TikTokApi (playwright) are imported by the methods that use
+  them, so short jobs only pay for what they run
 """
 import os
 import asyncio
 import shutil
 from datetime import datetime
 import time
-import random
 import json
-import traceback
+import re
+import threading
+from collections.abc import AsyncIterator
+from typing import TYPE_CHECKING
 
-import pyktok as pyk
 import requests
-import pandas as pd
+from requests.adapters import HTTPAdapter
 
-from TikTokApi import TikTokApi
-# from TikTokApi.tiktok import EmptyResponseException
-from openpyxl import load_workbook
+from TikTokManager.dedup import DedupIndex
+from TikTokManager.graph_crawl import GraphEdge, GraphFrontier, GraphNode, item_hashtags
+from TikTokManager.journal import CrawlJournal, new_run_id
+from TikTokManager.metrics import Metrics, timed
+from TikTokManager.pacing import Pacer, PermanentError, ThrottledError, retry_after_seconds
+from TikTokManager.page_cache import PageCache
+from TikTokManager.records import CommentRecord, VideoRecord, extract_video_detail, video_detail, video_item
+from TikTokManager.session_pool import SessionPool
+from TikTokManager.sinks import OutputSink, open_sink
+from TikTokManager.transcription import TranscriptionFetcher, select_transcription
+from TikTokManager.watermarks import WatermarkStore
+from TikTokManager.work_queue import WorkQueue
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from TikTokApi import TikTokApi
 
 ms_token = os.environ.get("ms_token", None)  # set your own ms_token
+# Several comma separated tokens / proxies run several sessions at once
+default_ms_tokens = [token for token in os.environ.get("ms_tokens", "").split(",") if token] or [ms_token]
+default_proxies = [proxy for proxy in os.environ.get("tiktok_proxies", "").split(",") if proxy] or None
 context_dict = {'viewport': {'width': 0,
                              'height': 0},
                 'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36'}
+video_id_regex = re.compile(r'/video/(\d+)')
+video_url_regex = re.compile(r'/@([^/?#]+)/video/(\d+)')
+# Comments returned by every comment list request
+COMMENT_PAGE_SIZE = 20
+# Item list endpoint, id parameter and page size of every feed type
+FEED_ENDPOINTS = {'user': ('/api/post/item_list/', 'secUid', 35),
+                  'hashtag': ('/api/challenge/item_list/', 'challengeID', 35),
+                  'video_related': ('/api/related/item_list/', 'itemID', 16)}
+
+
+def url_video_id(url:str) -> str:
+    """Video id of a video url, the url itself if it has no id"""
+    match = video_id_regex.search(url)
+    return match.group(1) if match else url
+
 
 class TikTokManager():
     """Class to mining data from tiktok api"""
-    def __init__(self, output_path:str, temp_path:str) -> None:
+    def __init__(self,
+                 output_path:str,
+                 temp_path:str,
+                 pool_size:int=None,
+                 headless:bool=True,
+                 cache_ttl:int=86400,
+                 cache_max_mb:int=512,
+                 base_url:str='https://www.tiktok.com',
+                 pool_options:dict=None,
+                 profile_stage:str=None,
+                 ms_tokens:list[str]=None,
+                 proxies:list=None,
+                 pacing:dict=None
+                 ) -> None:
+        """
+        args:
+        - output_path: folder of the outputs and run reports
+        - temp_path: folder of the checkpoints and caches
+        - pool_size: amount of TikTokApi sessions kept alive, one per ms_token by default
+        - headless: boolean to set headless mode on browser
+        - cache_ttl: seconds a cached video page json stays valid
+        - cache_max_mb: maximum size of the page cache
+        - base_url: TikTok base url
+        - pool_options: other SessionPool options (strategy, throttle_cooldown, ...)
+        - profile_stage: stage profiled with cProfile
+        - ms_tokens: ms_tokens of the sessions, defaults to the comma separated "ms_tokens"
+          environment variable or the "ms_token" one
+        - proxies: proxy urls (or playwright proxy settings) of the sessions, defaults to the comma
+          separated "tiktok_proxies" environment variable
+        - pacing: AdaptiveLimiter options (rate, max_rate, breaker_threshold, ...) per endpoint
+          class ("feed", "page_json", "comments", "vtt")
+        """
         self.output_path = output_path
         self.temp_path = temp_path
-        pyk.specify_browser('firefox')
-        print(f'using ms_token: {ms_token}')
+        self.ms_tokens = ms_tokens or default_ms_tokens
+        self.proxies = proxies or default_proxies
+        self.pool_size = pool_size or len(self.ms_tokens)
+        self.headless = headless
+        self.cache_ttl = cache_ttl
+        self.cache_max_mb = cache_max_mb
+        self.base_url = base_url
+        self.pool_options = pool_options or {}
+        self.metrics = Metrics(profile_stage=profile_stage)
+        self.pacer = Pacer(self.metrics, pacing)
+        self._loop = None
+        self._session_pool = None
+        self._page_cache = None
+        self._page_cache_lock = threading.Lock()
+        self._watermarks = None
+        self._dedup = None
+        self.transcription_fetcher = TranscriptionFetcher()
+        self._page_session = requests.Session()
+        self._page_session.mount('https://', HTTPAdapter(pool_maxsize=16))
+        self._page_session.mount('http://', HTTPAdapter(pool_maxsize=16))
+        self._pyk = None
+        self._pyk_lock = threading.Lock()
+        print(f'using {len(self.ms_tokens)} ms_token(s): {", ".join(str(token)[:8] for token in self.ms_tokens)}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self, coro):
+        """
+        Run a coroutine on the long-lived event loop of the manager, so the
+        session pool survives between calls.
+
+        args:
+        - coro: coroutine to run
+
+        return:
+        - Result of the coroutine
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def _get_session_pool(self, headless:bool=None) -> SessionPool:
+        """
+        Get the TikTokApi session pool of the running event loop, creating it on first use.
+        A pool created on another event loop can not be reused: its browsers are closed on
+        that loop before it is replaced, and a RuntimeError is raised when that is not possible
+        (the loop is running in another thread, or was closed with the browsers still open).
+        A pool created on a loop other than the one of the manager is closed when the tasks of
+        that loop are cancelled, as `asyncio.run` does on exit.
+
+        args:
+        - headless: headless mode used when the pool is created, defaults to the manager setting
+
+        return:
+        - SessionPool instance
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._session_pool
+        if pool is not None and pool.loop not in (None, loop):
+            if pool.is_open:
+                if pool.loop.is_running():
+                    raise RuntimeError('The session pool is in use on an event loop of another thread, '
+                                       'use one TikTokManager per event loop.')
+                if pool.loop.is_closed():
+                    raise RuntimeError('The session pool was left open on a closed event loop and its browsers '
+                                       'can not be closed any more. Run the async methods of a TikTokManager '
+                                       'on one event loop (e.g. inside `asyncio.run`) or call `close()` first.')
+                # A thread can only run one event loop at a time
+                closer = threading.Thread(target=pool.loop.run_until_complete, args=(pool.close(),))
+                closer.start()
+                closer.join()
+            pool = None
+        if pool is None:
+            self._session_pool = SessionPool(ms_tokens=self.ms_tokens,
+                                             size=self.pool_size,
+                                             proxies=self.proxies,
+                                             headless=self.headless if headless is None else headless,
+                                             context_options=context_dict,
+                                             metrics=self.metrics,
+                                             **self.pool_options)
+            if loop is not self._loop:
+                loop.create_task(self._close_pool_on_exit(self._session_pool))
+        return self._session_pool
+
+    async def _close_pool_on_exit(self, pool:SessionPool) -> None:
+        """Wait until cancelled (end of `asyncio.run`) and close the sessions of the pool on its loop"""
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await pool.close()
+
+    def close(self) -> None:
+        """
+        Close the TikTokApi sessions and the event loop owned by the manager
+
+        return:
+        - None
+        """
+        pool = self._session_pool
+        if pool is not None and pool.is_open and pool.loop not in (None, self._loop) \
+                and not pool.loop.is_running() and not pool.loop.is_closed():
+            pool.loop.run_until_complete(pool.close())
+        if self._loop is not None and not self._loop.is_closed():
+            if pool is not None and pool.loop in (None, self._loop):
+                self._loop.run_until_complete(pool.close())
+            self._loop.close()
+        self._session_pool = None
+        self._loop = None
+        self._close_page_cache()
+        if self._watermarks is not None:
+            self._watermarks.close()
+            self._watermarks = None
+        if self._dedup is not None:
+            self._dedup.close()
+            self._dedup = None
+        self.transcription_fetcher.close()
+        self._page_session.close()
+        self.metrics.close()
+
+    @property
+    def page_cache(self) -> PageCache:
+        """Page json cache stored in the temp folder, opened on first use"""
+        with self._page_cache_lock:
+            if self._page_cache is None:
+                os.makedirs(self.temp_path, exist_ok=True)
+                self._page_cache = PageCache(f'{self.temp_path}/page_cache.sqlite',
+                                             ttl=self.cache_ttl,
+                                             max_bytes=self.cache_max_mb * 1024 * 1024)
+            return self._page_cache
+
+    @property
+    def watermarks(self) -> WatermarkStore:
+        """Feed watermarks stored in the output folder, opened on first use"""
+        if self._watermarks is None:
+            os.makedirs(self.output_path, exist_ok=True)
+            self._watermarks = WatermarkStore(f'{self.output_path}/watermarks.sqlite')
+        return self._watermarks
+
+    def commit_watermarks(self, watermarks:dict) -> None:
+        """
+        Move the feed watermarks to the newest videos discovered, call it once those videos are persisted
+
+        args:
+        - watermarks: dictionary (ent_type, ent_name) -> (create_time, video_id) filled by iter_video_urls
+
+        return:
+        - None
+        """
+        for (ent_type, ent_name), (create_time, video_id) in watermarks.items():
+            self.watermarks.update(ent_type, ent_name, create_time, video_id)
+
+    @property
+    def dedup(self) -> DedupIndex:
+        """Index of the video and comment ids stored by any run, in the output folder, opened on first use"""
+        if self._dedup is None:
+            os.makedirs(self.output_path, exist_ok=True)
+            self._dedup = DedupIndex(f'{self.output_path}/dedup_index.sqlite')
+        return self._dedup
+
+    def _unseen_comments(self, comment_list:list[dict], pending_ids:set=()) -> list[dict]:
+        """
+        Drop the comments already stored by a previous run (comments without id are kept)
+
+        args:
+        - comment_list: comment rows
+        - pending_ids: ids of the comments written but not added to the index yet
+
+        return:
+        - List of the comment rows not stored yet
+        """
+        new_ids = set(self.dedup.filter_new('comment', [comment['comment_id'] for comment in comment_list
+                                                        if comment.get('comment_id') is not None]))
+        new_ids.difference_update(pending_ids)
+        unseen = [comment for comment in comment_list
+                  if comment.get('comment_id') is None or comment['comment_id'] in new_ids]
+        if len(unseen) < len(comment_list):
+            self.metrics.inc('duplicates_skipped_total', len(comment_list) - len(unseen), kind='comment')
+        return unseen
+
+    def _new_video_urls(self, url_list:list[str], run_ids:set, dedup:bool=True) -> list[str]:
+        """
+        Keep one url per video, skipping the videos already kept by the run (the same video can be
+        found under several hashtags and author paths) and, with `dedup`, the ones stored by any run
+
+        args:
+        - url_list: video urls
+        - run_ids: ids of the videos already kept by the run, updated in place
+        - dedup: also skip the videos of the dedup index
+
+        return:
+        - List of the new video urls
+        """
+        urls_by_id = {}
+        for url in url_list:
+            video_id = url_video_id(url)
+            if video_id not in run_ids and video_id not in urls_by_id:
+                urls_by_id[video_id] = url
+        new_ids = self.dedup.filter_new('video', list(urls_by_id)) if dedup else list(urls_by_id)
+        if len(new_ids) < len(urls_by_id):
+            print(f"Skipping {len(urls_by_id) - len(new_ids)} video(s) stored by previous runs")
+            self.metrics.inc('duplicates_skipped_total', len(urls_by_id) - len(new_ids), kind='video')
+        run_ids.update(new_ids)
+        return [urls_by_id[video_id] for video_id in new_ids]
+
+    @property
+    def pyk(self):
+        """
+        pyktok module, set up with the firefox cookies on first use (thread safe).
+        Its headers and cookies are copied to the page session, whose cookie jar then
+        replaces the pyktok one: cookies TikTok sets on a page response are kept for the
+        next requests, as pyktok.alt_get_tiktok_json does
+        """
+        with self._pyk_lock:
+            if self._pyk is None:
+                import pyktok
+                pyktok.specify_browser('firefox')
+                self._page_session.headers.update(getattr(pyktok, 'headers', None) or {})
+                self._page_session.cookies.update(getattr(pyktok, 'cookies', None) or {})
+                pyktok.cookies = self._page_session.cookies
+                self._pyk = pyktok
+        return self._pyk
+
+    def _close_page_cache(self) -> None:
+        if self._page_cache is not None:
+            print(f"Page cache stats: {self._page_cache.stats()}")
+            self._page_cache.close()
+            self._page_cache = None
+
+    def get_tiktok_json(self, url:str) -> dict:
+        """
+        Get the page json of a video, served from the page cache when possible (thread safe).
+        The page is requested with the pyktok headers and browser cookies (refreshed with the
+        cookies of every response), paced by the "page_json" limiter, and only the
+        `webapp.video-detail` scope is decoded.
+
+        args:
+        - url: video url
+
+        return:
+        - Page json, None if TikTok did not deliver it
+        """
+        match = video_id_regex.search(url)
+        video_id = match.group(1) if match else None
+        if video_id is not None:
+            cached = self.page_cache.get(video_id)
+            if cached is not None:
+                self.metrics.inc('pages_total', source='cache')
+                return cached
+        # Headers and cookies of the page session are set up with pyktok
+        self.pyk
+        self.pacer.acquire_sync('page_json')
+        try:
+            with self.metrics.timer('page_json'):
+                response = self._page_session.get(url, timeout=20)
+                tiktok_json = extract_video_detail(response.text) if response.status_code != 429 else None
+        except Exception as e:
+            self.pacer.record('page_json', e)
+            raise
+        if tiktok_json is None:
+            # TikTok serves pages without data (or a 429) to throttled clients
+            self.pacer.record('page_json', ThrottledError(f'page without data (HTTP {response.status_code})',
+                                                          retry_after_seconds(response.headers.get('retry-after'))))
+            self.metrics.inc('pages_total', source='empty')
+            return None
+        self.pacer.record('page_json')
+        self.metrics.inc('pages_total', source='tiktok')
+        if video_id is not None and video_item(tiktok_json) is not None:
+            self.page_cache.put(video_id, tiktok_json)
+        return tiktok_json
+
+    @timed('transcription')
+    def _fetch_transcription(self, url:str) -> str:
+        return self.transcription_fetcher.fetch(url)
+
+    async def _page_json(self, url:str, retries:int=4) -> dict:
+        """
+        Page json of a video, retried with backoff while TikTok serves pages without data
+
+        args:
+        - url: video url
+        - retries: maximum attempts
+
+        return:
+        - Page json, None if TikTok never delivered it. PermanentError is raised for
+          videos without itemStruct (deleted or private), they are not retried
+        """
+        for attempt in range(retries):
+            tiktok_json = await asyncio.to_thread(self.get_tiktok_json, url)
+            if tiktok_json is not None:
+                break
+            if attempt < retries - 1:
+                self.metrics.retry('page_json')
+                await self.pacer.backoff('page_json', attempt)
+        else:
+            return None
+        if video_item(tiktok_json) is None:
+            raise PermanentError(f"video without itemStruct (status {video_detail(tiktok_json).get('statusCode')})")
+        return tiktok_json
+
+    def write_report(self, run_id:str) -> dict:
+        """
+        Write the metrics of the manager as a json run report and a Prometheus text file
+        (and the cProfile stats when a stage is profiled) in the output folder
+
+        args:
+        - run_id: id of the run, used in the file names
+
+        return:
+        - Dictionary with the paths of the written files
+        """
+        os.makedirs(self.output_path, exist_ok=True)
+        if self._page_cache is not None:
+            for key, value in self._page_cache.stats().items():
+                self.metrics.set(f'page_cache_{key}', value)
+        if self._dedup is not None:
+            for key, value in self._dedup.stats().items():
+                self.metrics.set(f'dedup_{key}', value)
+        if self._session_pool is not None:
+            for token in self._session_pool.token_stats():
+                for key in ('success_rate', 'latency_s', 'cooldown_s'):
+                    if token[key] is not None:
+                        self.metrics.set(f'session_token_{key}', token[key], token=str(token['token']))
+        for endpoint, limiter in self.pacer.stats().items():
+            self.metrics.set('pacing_rate', limiter['rate'], endpoint=endpoint)
+            self.metrics.set('pacing_circuit_open', int(limiter['state'] != 'closed'), endpoint=endpoint)
+        paths ={"report_path": self.metrics.write_json(f'{self.output_path}/run_report_{run_id}.json'),
+                 "prometheus_path": self.metrics.write_prometheus(f'{self.output_path}/metrics.prom')}
+        if self.metrics.profile_stage is not None:
+            paths["profile_path"] = self.metrics.write_profile(
+                f'{self.output_path}/profile_{self.metrics.profile_stage}_{run_id}.prof')
+        print(f"Run report saved in {paths['report_path']}")
+        return paths
 
     def clear_folder(self, folder_path:str) -> None:
         """
@@ -44,6 +443,9 @@ class TikTokManager():
         """
         # Create the folder if it doesn't exist
         print(f"Cleaning foder {folder_path}")
+        if os.path.abspath(folder_path) == os.path.abspath(self.temp_path):
+            # The page cache lives in the temp folder
+            self._close_page_cache()
         os.makedirs(folder_path, exist_ok=True)
 
         for filename in os.listdir(folder_path):
@@ -55,7 +457,8 @@ class TikTokManager():
             elif os.path.isdir(file_path):
                 shutil.rmtree(file_path)
 
-    def save_to_excel(self, df: pd.DataFrame, file_path: str, sheet_name: str = "Outputs") -> None:
+    @timed('excel_export')
+    def save_to_excel(self, df: 'pd.DataFrame', file_path: str, sheet_name: str = "Outputs") -> None:
         """
         Append a DataFrame to an existing Excel file or create a new file if it doesn't exist.
 
@@ -67,6 +470,9 @@ class TikTokManager():
         return:
         - None
         """
+        import pandas as pd
+        from openpyxl import load_workbook
+
         if os.path.exists(file_path):
             # Load the existing workbook
             book = load_workbook(file_path)
@@ -93,13 +499,13 @@ class TikTokManager():
                             headless=True
                             ) -> list[str]:
         """
-        Extract video urls based on tt_ent argument.
+        Extract video urls based on tt_ent argument, with a TikTokApi session leased from the session pool.
 
         args:
         - tt_ent: tiktok entity to extract videos
         - video_ct: amount of videos to extract
         - ent_type: type of entity to extract videos: "user", "hashtag", or "video_related"
-        - headless: boolean to set headless mode on browser
+        - headless: boolean to set headless mode on browser (used when the session pool is created)
 
         return:
         - List of video urls
@@ -107,32 +513,31 @@ class TikTokManager():
         if ent_type not in ['user','hashtag','video_related']:
             raise ValueError('Only allowed `ent_type` values are "user", "hashtag", or "video_related".')
 
-        url_p1 = "https://www.tiktok.com/@"
+        url_p1 = f"{self.base_url}/@"
         url_p2 = "/video/"
         tt_list = []
 
-        async with TikTokApi() as api:
-            await api.create_sessions(headless=headless,
-                                    ms_tokens=[ms_token],
-                                    num_sessions=1,
-                                    sleep_after=40,
-                                    context_options=context_dict)
-            if ent_type == 'user':
-                ent = api.user(tt_ent)
-            elif ent_type == 'hashtag':
-                ent = api.hashtag(name=tt_ent)
-            elif ent_type == 'key_words':
-                ent = api.search()
-                ent.search_type(tt_ent, 'video', count=video_ct)
-            else:
-                ent = api.video(url=tt_ent)
+        pool = self._get_session_pool(headless)
+        await self.pacer.acquire('feed')
+        try:
+            async with pool.lease() as api:
+                if ent_type == 'user':
+                    ent = api.user(tt_ent)
+                elif ent_type == 'hashtag':
+                    ent = api.hashtag(name=tt_ent)
+                else:
+                    ent = api.video(url=tt_ent)
 
-            if ent_type in ['user','hashtag']:
-                async for video in ent.videos(count=video_ct):
-                    tt_list.append(video.as_dict)
-            else:
-                async for related_video in ent.related_videos(count=video_ct):
-                    tt_list.append(related_video.as_dict)
+                if ent_type in ['user','hashtag']:
+                    async for video in ent.videos(count=video_ct):
+                        tt_list.append(video.as_dict)
+                else:
+                    async for related_video in ent.related_videos(count=video_ct):
+                        tt_list.append(related_video.as_dict)
+        except Exception as e:
+            self.pacer.record('feed', e)
+            raise
+        self.pacer.record('feed')
 
         id_list = [i['id'] for i in tt_list]
         if ent_type == 'user':
@@ -145,132 +550,427 @@ class TikTokManager():
                 video_list.append(video_url)
         return video_list
 
-    async def get_video_urls_v2(self,
-                            tt_ent,
-                            video_ct:int,
-                            ent_type:str,
-                            headless=True
-                            ) -> list[str]:
+    async def _feed_id(self, api:'TikTokApi', tt_ent, ent_type:str) -> str:
         """
-        Extract video urls based on tt_ent argument.
+        Id the item list of a feed is requested with, resolved once per discovery
+
+        args:
+        - api: leased TikTokApi instance
+        - tt_ent: tiktok entity of the feed
+        - ent_type: "user", "hashtag", or "video_related"
+
+        return:
+        - secUid of the user, challenge id of the hashtag or id of the video
+        """
+        if ent_type == 'user':
+            ent = api.user(tt_ent)
+            await ent.info()
+            return ent.sec_uid
+        if ent_type == 'hashtag':
+            ent = api.hashtag(name=tt_ent)
+            await ent.info()
+            return ent.id
+        return api.video(url=tt_ent).id
+
+    async def _api_request(self, api:'TikTokApi', path:str, params:dict) -> dict:
+        """
+        Signed request to a TikTok web api endpoint on `base_url`, the only direct use of the
+        TikTokApi request internals. `make_request(url=..., params=...)` adds the session params
+        and ms_token, signs the url and decodes the json: that is the TikTokApi 6.5.x api
+        (6.5.2 is pinned in requirements.txt), check this method when upgrading TikTokApi.
+
+        args:
+        - api: leased TikTokApi instance
+        - path: path of the endpoint (e.g. "/api/challenge/item_list/")
+        - params: query parameters of the endpoint
+
+        return:
+        - Json response
+        """
+        response = await api.make_request(url=f"{self.base_url}{path}", params=params)
+        if response is None:
+            from TikTokApi.exceptions import InvalidResponseException
+            raise InvalidResponseException(response, "TikTok returned an invalid response.")
+        return response
+
+    async def _feed_page(self, api:'TikTokApi', ent_id:str, ent_type:str, cursor) -> tuple[list[dict], object, bool]:
+        """
+        Request one page of a feed
+
+        args:
+        - api: leased TikTokApi instance
+        - ent_id: id of the feed entity
+        - ent_type: "user", "hashtag", or "video_related"
+        - cursor: cursor of the page, 0 for the first one
+
+        return:
+        - Tuple (items, cursor of the next page, whether the feed has more pages)
+        """
+        path, id_param, page_size = FEED_ENDPOINTS[ent_type]
+        params = {id_param: ent_id, "count": page_size}
+        if ent_type != 'video_related':
+            params["cursor"] = cursor
+        response = await self._api_request(api, path, params)
+        self.metrics.inc('discovery_pages_total', ent_type=ent_type)
+        # Related videos have no cursor, every request returns another sample
+        has_more = ent_type == 'video_related' or bool(response.get("hasMore", False))
+        return response.get("itemList") or [], response.get("cursor", cursor), has_more
+
+    async def iter_video_urls(self,
+                              tt_ent,
+                              video_ct:int,
+                              ent_type:str,
+                              headless=True,
+                              incremental:bool=False,
+                              stop_after:int=35,
+                              watermarks:dict=None
+                              ) -> AsyncIterator[str]:
+        """
+        Yield video urls based on tt_ent argument as TikTok pages them. The next page is only
+        requested when the consumer asks for more urls. The cursor of the last fully read page
+        is remembered, so after an error discovery resumes from it instead of the first page.
+        The watermark is never moved here: the newest video yielded is left in `watermarks`, for the
+        caller to commit with commit_watermarks once the videos are persisted.
 
         args:
         - tt_ent: tiktok entity to extract videos
         - video_ct: amount of videos to extract
         - ent_type: type of entity to extract videos: "user", "hashtag", or "video_related"
-        - headless: boolean to set headless mode on browser
+        - headless: boolean to set headless mode on browser (used when the session pool is created)
+        - incremental: only yield videos newer than the watermark of the hashtag / user
+        - stop_after: in incremental mode, stop paging after this many consecutive already seen videos
+          (feeds are not strictly sorted by date and users can pin old videos)
+        - watermarks: optional dictionary (ent_type, tt_ent) -> (create_time, video_id) updated with
+          the newest video yielded of a hashtag / user
 
         return:
-        - List of video urls
+        - Async iterator of video urls
         """
         if ent_type not in ['user','hashtag','video_related']:
             raise ValueError('Only allowed `ent_type` values are "user", "hashtag", or "video_related".')
 
-        url_p1 = "https://www.tiktok.com/@"
+        url_p1 = f"{self.base_url}/@"
         url_p2 = "/video/"
-        tt_list = []
+        found_ids = set()
+        newest = None
         end_flag = False
         retries = 0
+        watermark = None
+        seen_streak = 0
+        ent_id = None
+        cursor = 0
+        if incremental and ent_type in ['user','hashtag']:
+            watermark = self.watermarks.get(ent_type, tt_ent)
+            if watermark is not None:
+                print(f"Watermark for {ent_type} {tt_ent}: {datetime.fromtimestamp(watermark[0]).isoformat()}")
 
+        pool = self._get_session_pool(headless)
         while retries < 5 and not end_flag:
             try:
-                async with TikTokApi() as api:
-                    await api.create_sessions(headless=headless,
-                                            ms_tokens=[ms_token],
-                                            num_sessions=1,
-                                            sleep_after=10,
-                                            context_options=context_dict,
-                                            browser='chromium'
-                                        )
-                    if ent_type == 'user':
-                        ent = api.user(tt_ent)
-                    elif ent_type == 'hashtag':
-                        ent = api.hashtag(name=tt_ent)
-                    elif ent_type == 'key_words':
-                        ent = api.search()
-                        ent.search_type(tt_ent, 'video', count=video_ct)
-                    else:
-                        ent = api.video(url=tt_ent)
-
-                    if ent_type in ['user','hashtag']:
-                        async for video in ent.videos(count=video_ct):
-                            time.sleep(random.randint(1, 2))
-                            tt_list.append(video.as_dict)
-                            if len(tt_list) >= video_ct:
-                                end_flag = True
-                                break
-                    else:
-                        async for related_video in ent.related_videos(count=video_ct):
-                            tt_list.append(related_video.as_dict)
+                # The lease is only held for the request: the consumer of a yielded url may need
+                # the session pool itself (comments of the video) and a one-slot pool would deadlock
+                async with pool.lease() as api:
+                    if ent_id is None:
+                        await self.pacer.acquire('feed')
+                        ent_id = await self._feed_id(api, tt_ent, ent_type)
+                        self.pacer.record('feed')
+                    await self.pacer.acquire('feed')
+                    items, next_cursor, has_more = await self._feed_page(api, ent_id, ent_type, cursor)
+                    self.pacer.record('feed')
+                new_items = 0
+                for item in items:
+                    if ent_type in ['user','hashtag'] and watermark is not None \
+                            and int(item.get('createTime') or 0) <= watermark[0]:
+                        seen_streak += 1
+                        if seen_streak >= stop_after:
+                            print(f"Reached already mined videos for {ent_type} {tt_ent}")
+                            end_flag = True
+                            break
+                        continue
+                    seen_streak = 0
+                    # Feeds can repeat an item on the next page
+                    if item['id'] in found_ids:
+                        continue
+                    found_ids.add(item['id'])
+                    new_items += 1
+                    if newest is None or int(item.get('createTime') or 0) > int(newest.get('createTime') or 0):
+                        newest = item
+                        if watermarks is not None and ent_type in ['user','hashtag']:
+                            watermarks[(ent_type, tt_ent)] = (int(newest.get('createTime') or 0), newest['id'])
+                    self.metrics.inc('videos_discovered_total', ent_type=ent_type)
+                    author = tt_ent if ent_type == 'user' else item['author']['uniqueId']
+                    yield url_p1 + author + url_p2 + item['id']
+                    if len(found_ids) >= video_ct:
+                        end_flag = True
+                        break
+                # The page was fully read, a failure from now on resumes after it
+                cursor = next_cursor
+                retries = 0
+                if not has_more or not items or (ent_type == 'video_related' and new_items == 0):
+                    end_flag = True
             except Exception as e:
-                print(f"\n Error trying to mining videos for hashtag {tt_ent}: {str(e)} \n")
+                print(f"\n Error trying to mining videos for {ent_type} {tt_ent} at cursor {cursor}: {str(e)} \n")
+                self.metrics.error('discovery', e)
+                kind = self.pacer.record('feed', e)
+                if kind == 'bug':
+                    raise
+                if kind == 'fatal':
+                    break
                 print("Retrying...")
-                del api
                 retries += 1
-                time.sleep(random.randint(1, 8))
+                self.metrics.retry('discovery')
+                await self.pacer.backoff('feed', retries - 1, e)
 
-        id_list = [i['id'] for i in tt_list]
-        if ent_type == 'user':
-            video_list = [url_p1 + tt_ent + url_p2 + i for i in id_list]
-        else:
-            author_list = [i['author']['uniqueId'] for i in tt_list]
-            video_list = []
-            for n, i in enumerate(author_list):
-                video_url = url_p1 + author_list[n] + url_p2 + id_list[n]
-                video_list.append(video_url)
-        return video_list
-    
-    async def get_comments(self, video_id:str, comment_amount:int) -> list[dict]:
+    @timed('discovery')
+    async def get_video_urls_v2(self,
+                            tt_ent,
+                            video_ct:int,
+                            ent_type:str,
+                            headless=True,
+                            incremental:bool=False,
+                            stop_after:int=35,
+                            watermarks:dict=None
+                            ) -> list[str]:
         """
-        Extract comments from video using video id
+        Extract video urls based on tt_ent argument.
+
+        args:
+        - tt_ent: tiktok entity to extract videos
+        - video_ct: amount of videos to extract
+        - ent_type: type of entity to extract videos: "user", "hashtag", or "video_related"
+        - headless: boolean to set headless mode on browser (used when the session pool is created)
+        - incremental: only return videos newer than the watermark of the hashtag / user
+        - stop_after: in incremental mode, stop paging after this many consecutive already seen videos
+          (feeds are not strictly sorted by date and users can pin old videos)
+        - watermarks: optional dictionary updated with the newest video returned of the hashtag / user,
+          commit it with commit_watermarks once the videos are persisted
+
+        return:
+        - List of video urls
+        """
+        return [url async for url in self.iter_video_urls(tt_ent, video_ct, ent_type, headless, incremental,
+                                                          stop_after, watermarks)]
+
+    def crawl_related_graph(self,
+                            seeds:list[str],
+                            seed_type:str='video',
+                            max_depth:int=2,
+                            max_nodes:int=200,
+                            max_requests:int=None,
+                            order:str='best',
+                            seed_videos:int=10,
+                            seed_hashtags:list[str]=None,
+                            related_pages:int=1,
+                            output_format:str='parquet',
+                            batch_size:int=500,
+                            export_excel:bool=False,
+                            headless=True
+                            ) -> dict:
+        """
+        Crawl the related-video graph around seed videos, hashtags or users. Videos are expanded
+        one at a time (the feed limiter paces them anyway) best-first or breadth-first, every video
+        is requested once, and the edge list (graph_edges) and the nodes (graph_nodes) are written
+        to a sink for network analysis.
+
+        args:
+        - seeds: video urls / ids, hashtags or usernames
+        - seed_type: "video", "hashtag" or "user". The first `seed_videos` videos of a hashtag or
+          user are the seeds of the crawl
+        - max_depth: hops from the seeds past which videos are recorded but not expanded
+        - max_nodes: maximum videos expanded
+        - max_requests: maximum related-video requests (retries included), unlimited by default
+        - order: "best" (play count and seed hashtag affinity first) or "breadth"
+        - seed_videos: videos taken from every hashtag or user seed
+        - seed_hashtags: hashtags of the topic, the hashtag seeds by default
+        - related_pages: related-video requests per expanded video (every request returns another sample)
+        - output_format: sink the graph is written to: "parquet", "sqlite" or "jsonl"
+        - batch_size: amount of buffered rows per table written to the sink at once
+        - export_excel: export the sink to one excel file at the end of the crawl
+        - headless: boolean to set headless mode on browser (used when the session pool is created)
+
+        return:
+        - Dictionary with the run id, the sink path, the amount of nodes, edges, expanded videos
+          and requests, and the frontier stats
+        """
+        if seed_type not in ['video','hashtag','user']:
+            raise ValueError('Only allowed `seed_type` values are "video", "hashtag", or "user".')
+        if seed_hashtags is None and seed_type == 'hashtag':
+            seed_hashtags = seeds
+        frontier = GraphFrontier(order, max_depth, seed_hashtags)
+        run_id = new_run_id('graph')
+        print(f"Run id: {run_id}")
+
+        seed_urls = []
+        for seed in seeds:
+            if seed_type == 'video':
+                seed_urls.append(str(seed))
+            else:
+                seed_urls += self._run(self.get_video_urls_v2(tt_ent=seed, video_ct=seed_videos, ent_type=seed_type, headless=headless))
+
+        sink = open_sink(output_format, f'{self.output_path}/{run_id}', batch_size)
+        try:
+            for url in seed_urls:
+                match = video_url_regex.search(url)
+                author, video_id = match.groups() if match else (None, url_video_id(url))
+                if frontier.add(video_id, author, 0, 0.0):
+                    sink.write('graph_nodes', [GraphNode(video_id, author, 0)])
+            result = self._run(self._crawl_related(frontier, sink, max_nodes, max_requests, related_pages, headless))
+            sink.flush()
+            if export_excel:
+                print(f"Exporting {sink.path} to {self.output_path}/{run_id}.xlsx")
+                with self.metrics.timer('excel_export'):
+                    sink.export_excel(f'{self.output_path}/{run_id}.xlsx')
+        finally:
+            sink.close()
+        return {"run_id": run_id, "sink_path": sink.path, **result, **frontier.stats(), **self.write_report(run_id)}
+
+    async def _crawl_related(self,
+                             frontier:GraphFrontier,
+                             sink:OutputSink,
+                             max_nodes:int,
+                             max_requests:int,
+                             related_pages:int,
+                             headless=True
+                             ) -> dict:
+        """
+        Expand the frontier until it is empty or a budget runs out
+
+        args:
+        - frontier: frontier with the seeds
+        - sink: sink the nodes and edges are written to
+        - max_nodes: maximum videos expanded
+        - max_requests: maximum related-video requests (retries included), None for no limit
+        - related_pages: related-video requests per expanded video
+        - headless: boolean to set headless mode on browser (used when the session pool is created)
+
+        return:
+        - Dictionary with the amount of nodes, edges, expanded videos and requests
+        """
+        pool = self._get_session_pool(headless)
+        counts = {"nodes": len(frontier.visited), "edges": 0, "expanded": 0, "requests": 0}
+
+        def budget_left():
+            return max_requests is None or counts["requests"] < max_requests
+
+        while len(frontier) and counts["expanded"] < max_nodes and budget_left():
+            video_id, author, depth = frontier.pop()
+            counts["expanded"] += 1
+            self.metrics.inc('graph_expanded_total')
+            for _ in range(related_pages):
+                items = None
+                retries = 0
+                while items is None and retries < 5 and budget_left():
+                    counts["requests"] += 1
+                    try:
+                        async with pool.lease() as api:
+                            await self.pacer.acquire('feed')
+                            items, _, _ = await self._feed_page(api, video_id, 'video_related', 0)
+                        self.pacer.record('feed')
+                    except Exception as e:
+                        print(f"\n Error trying to get the related videos of {video_id}: {str(e)} \n")
+                        self.metrics.error('graph', e)
+                        kind = self.pacer.record('feed', e)
+                        if kind == 'bug':
+                            raise
+                        if kind == 'fatal':
+                            break
+                        retries += 1
+                        self.metrics.retry('graph')
+                        await self.pacer.backoff('feed', retries - 1, e)
+                if not items:
+                    break
+                nodes, edges = [], []
+                for rank, item in enumerate(items):
+                    edges.append(GraphEdge(video_id, item['id'], depth, rank))
+                    item_author = (item.get('author') or {}).get('uniqueId')
+                    priority = frontier.priority(item, depth + 1)
+                    if frontier.add(item['id'], item_author, depth + 1, priority):
+                        nodes.append(GraphNode(video_id=item['id'],
+                                               author_username=item_author,
+                                               depth=depth + 1,
+                                               parent_id=video_id,
+                                               priority=round(priority, 3),
+                                               video_playcount=(item.get('stats') or {}).get('playCount'),
+                                               hashtags=','.join(sorted(item_hashtags(item)))))
+                sink.write('graph_edges', edges)
+                sink.write('graph_nodes', nodes)
+                counts["edges"] += len(edges)
+                counts["nodes"] += len(nodes)
+                self.metrics.inc('graph_edges_total', len(edges))
+                self.metrics.inc('graph_nodes_total', len(nodes))
+        print(f"Graph crawl: {counts}, frontier: {frontier.stats()}")
+        return counts
+
+    async def iter_comments(self, video_id:str, comment_amount:int) -> AsyncIterator[CommentRecord]:
+        """
+        Yield the comments of a video as TikTok pages them. The next page is only requested
+        when the consumer asks for more comments.
 
         args:
         - video_id: video id
         - comment_amount: amount of comments to extract
 
         return:
-        - List of dictionaries with comments info
+        - Async iterator of comment records
         """
         count = 0
         retries = 0
-        comment_list = []
+        comment_ids = set()
+        pool = self._get_session_pool()
         while retries < 5:
-            await asyncio.sleep(1)
-            async with TikTokApi() as api:
-                video = api.video(id=video_id)
-                await api.create_sessions(ms_tokens=[ms_token],
-                                        num_sessions=1,
-                                        sleep_after=5,
-                                        context_options=context_dict
-                                    )
-                try:
+            await self.pacer.acquire('comments')
+            try:
+                async with pool.lease() as api:
+                    video = api.video(id=video_id)
+                    received = 0
                     async for comment in video.comments(count=comment_amount):
                         if count >= comment_amount:
                             break
-                        aux_dict = comment.as_dict
-                        dt_object = datetime.fromtimestamp(aux_dict.get("create_time"))
-                        formated_comment = {
-                            "video_id": video_id,
-                            "language": aux_dict.get("comment_language"),
-                            "text": aux_dict.get("text"),
-                            "likes": aux_dict.get("digg_count"),
-                            "date": dt_object.strftime('%d-%m-%Y %H:%M')
-                        }
-                        comment_list.append(formated_comment)
+                        received += 1
+                        if received % COMMENT_PAGE_SIZE == 0:
+                            # The next comment comes from a new page request
+                            self.pacer.record('comments')
+                            await self.pacer.acquire('comments')
+                        record = CommentRecord.from_comment(video_id, comment.as_dict)
+                        # A retry pages the comments again from the start
+                        if record.comment_id is not None and record.comment_id in comment_ids:
+                            continue
+                        comment_ids.add(record.comment_id)
                         count += 1
-                    return comment_list
-                except Exception as e:
-                    retries += 1
-                    print(f"\n Error trying to get comments for video id {video_id}: {str(e)} \n")
-                    print("Retrying...")
-                    del video
-                    time.sleep(random.randint(1, 8))
+                        self.metrics.inc('comments_total')
+                        yield record
+                    self.pacer.record('comments')
+                    return
+            except Exception as e:
+                retries += 1
+                print(f"\n Error trying to get comments for video id {video_id}: {str(e)} \n")
+                self.metrics.error('comments', e)
+                kind = self.pacer.record('comments', e)
+                if kind == 'bug':
+                    raise
+                if kind == 'fatal':
+                    return
+                print("Retrying...")
+                self.metrics.retry('comments')
+                await self.pacer.backoff('comments', retries - 1, e)
 
-        return comment_list
+    @timed('comments')
+    async def get_comments(self, video_id:str, comment_amount:int) -> list[dict]:
+        """
+        Extract comments from video using video id
+
+        args:
+        - video_id: video id
+        - comment_amount: amount of comments to extract
+
+        return:
+        - List of dictionaries with comments info
+        """
+        return [record.as_dict() async for record in self.iter_comments(video_id, comment_amount)]
     
     async def get_comments_v2(self, video_id:str, comment_amount:int) -> list[dict]:
         """
-        Extract comments from video using video id
+        Same as `get_comments`, kept for the callers of the former v2 implementation
 
         args:
         - video_id: video id
@@ -279,48 +979,9 @@ class TikTokManager():
         return:
         - List of dictionaries with comments info
         """
-        retries = 1
-        comment_list = []
-        end_flag = False
-        while retries < 3 and not end_flag:
-            try:
-                async with TikTokApi() as api:
-                    await api.create_sessions(ms_tokens=[ms_token],
-                                            num_sessions=1,
-                                            sleep_after=20,
-                                            context_options=context_dict,
-                                            browser='chromium',
-                                            headless=False
-                                        )
-                    video = api.video(id=video_id)
-                    
-                    async for comment in video.comments(count=comment_amount):
-                        time.sleep(random.randint(1, 5))
-                        aux_dict = comment.as_dict
-                        dt_object = datetime.fromtimestamp(aux_dict.get("create_time"))
-                        formated_comment = {
-                            "video_id": video_id,
-                            "language": aux_dict.get("comment_language"),
-                            "text": aux_dict.get("text"),
-                            "likes": aux_dict.get("digg_count"),
-                            "date": dt_object.strftime('%d-%m-%Y %H:%M')
-                        }
-                        comment_list.append(formated_comment)
-                        if len(comment_list) >= comment_amount:
-                            end_flag = True
-                            break
-                    return comment_list
-            except Exception as e:
-                retries += 1
-                print(f"\n Error trying to get comments for video id {video_id}: {str(e)} \n")
-                traceback.print_exc()
-                print("Retrying...")
-                del video
-                time.sleep(random.randint(1, 8))
+        return await self.get_comments(video_id, comment_amount)
 
-        return comment_list
-        
-    def extract_videos_data(self, hashtag_list:list[str], video_amount:int, comment_amount:int) -> dict:
+    def extract_videos_data(self, hashtag_list:list[str], video_amount:int, comment_amount:int, dedup:bool=True) -> dict:
         """
         Extract relevant info from videos related with hashtag parameter
         
@@ -328,44 +989,47 @@ class TikTokManager():
         - hashtag_list: list of hashtags to extract videos
         - video_amount: amount of videos to extract per hashtag
         - comment_amount: amount of comments to extract per video
+        - dedup: skip the videos and comments stored by previous runs (see `dedup`)
         
         return:
         - Dictionary with the path to the excel file with the extracted data
         """
-        tiktok_url = 'https://www.tiktok.com/@tiktok/video/'
+        import pandas as pd
+
+        tiktok_url = f'{self.base_url}/@tiktok/video/'
         temp_data_path = f'{self.temp_path}/temp_data.csv'
 
         now = datetime.now()
         formatted_datetime = now.strftime("%m-%d-%Y_%H%M")
-        output_path = f'{self.output_path}/video_info_{formatted_datetime}.xlsx'
+        run_id = new_run_id()
+        output_path = f'{self.output_path}/video_info_{run_id}.xlsx'
 
         self.clear_folder(self.temp_path)
 
-        url_list = []
         url_per_hashtag = {}
+        run_ids = set()
 
 
         for hashtag in hashtag_list:
             print(f"\n\n\nMining {video_amount} video data for keyword: {hashtag}")
-            url_list_extracted = asyncio.run(self.get_video_urls(
+            url_list_extracted = self._run(self.get_video_urls(
                                                 tt_ent=hashtag,
                                                 ent_type="hashtag",
                                                 video_ct=video_amount,
                                             ))
-            
-            set1 = set(url_list)
-            set1.update([url for url in url_list_extracted if url not in set1])
-            url_list = list(set1)
+            url_list = self._new_video_urls(url_list_extracted, run_ids, dedup)
 
             
             for url in url_list:
-                time.sleep(random.randint(1, 5))
+                self.pacer.acquire_sync('page_json')
                 try:
-                    pyk.save_tiktok(url,False,temp_data_path)
+                    with self.metrics.timer('page_json'):
+                        self.pyk.save_tiktok(url,False,temp_data_path)
                 except Exception as e:
                     print(f"Error saving video data from url {url}: {str(e)} \n\n")
-                    time.sleep(random.randint(1, 3))
+                    self.pacer.record('page_json', e)
                     continue
+                self.pacer.record('page_json')
             
             url_per_hashtag[hashtag] = url_list
         
@@ -380,23 +1044,15 @@ class TikTokManager():
             # Get transcription of video
             print("\nMining transcription from video: ",row['video_id'])
             aux_url = tiktok_url+row['video_id']
-            tiktok_json = pyk.alt_get_tiktok_json(aux_url)
-            if tiktok_json is not None:
+            item = video_item(self.get_tiktok_json(aux_url))
+            if item is not None:
 
-                trasncription_list = tiktok_json.get("__DEFAULT_SCOPE__").get("webapp.video-detail").get("itemInfo").get("itemStruct").get("video").get("subtitleInfos")
-                if len(trasncription_list) > 0:
-                    # Filter transcription by english language
-                    eng_transcription = [d for d in trasncription_list if "eng-" in d.get("LanguageCodeName", "")]
-                    if len(eng_transcription) > 0:
-                        language = eng_transcription[0].get("LanguageCodeName")
-                        trasncription_url = eng_transcription[0].get("Url")
-                    else:
-                        language = trasncription_list[0].get("LanguageCodeName")
-                        trasncription_url = trasncription_list[0].get("Url")
-                    response = requests.get(trasncription_url, timeout=15)
-                    result_array = response.text.split('\n')
-                    result_array = [item for item in result_array if item and "-->" not in item and "WEBVTT" not in item]
-                    final_trasncription =' '.join(result_array)
+                trasncription_list = (item.get("video") or {}).get("subtitleInfos")
+                if trasncription_list:
+                    language, trasncription_url = select_transcription(trasncription_list)
+                    self.pacer.acquire_sync('vtt')
+                    final_trasncription = self._fetch_transcription(trasncription_url)
+                    self.pacer.record('vtt')
 
                     data_df.at[index, 'trasncription_lang'] = language
                     data_df.at[index, 'video_trasncription'] = final_trasncription
@@ -407,193 +1063,833 @@ class TikTokManager():
                         
             # Get comments for each video
             print("Mining comments from video: ",row['video_id'])
-            comment_list += asyncio.run(self.get_comments(row['video_id'], comment_amount))
+            comment_list += self._run(self.get_comments(row['video_id'], comment_amount))
         
+        if dedup:
+            comment_list = self._unseen_comments(comment_list)
         comment_df = pd.DataFrame(comment_list)
         
         self.save_to_excel(data_df, output_path, 'videos_data')
         self.save_to_excel(comment_df, output_path, 'comments_data')
+        if dedup:
+            self.dedup.add('video', data_df['video_id'].tolist())
+            self.dedup.add('comment', [comment['comment_id'] for comment in comment_list if comment.get('comment_id') is not None])
+        self.write_report(run_id)
 
         return {"video_data_path": output_path}
     
-    def extract_videos_data_v2(self, hashtag_list:list[str], video_amount:int, comment_amount:int) -> dict:
+    def extract_videos_data_v2(self,
+                               hashtag_list:list[str]=None,
+                               video_amount:int=None,
+                               comment_amount:int=None,
+                               concurrency:int=1,
+                               stage_limits:dict=None,
+                               output_format:str='parquet',
+                               batch_size:int=500,
+                               export_excel:bool=True,
+                               resume:str=None,
+                               incremental:bool=False,
+                               dedup:bool=True
+                               ) -> dict:
         """
-        Extract relevant info from videos related with hashtag parameter
+        Extract relevant info from videos related with hashtag parameter.
+        Videos are mined on a single event loop, up to `concurrency` at the same time.
+        Every run is recorded in a crawl journal (temp folder) so it can be resumed with `resume`.
         
         args:
         - hashtag_list: list of hashtags to extract videos
         - video_amount: amount of videos to extract per hashtag
         - comment_amount: amount of comments to extract per video
+        - concurrency: amount of videos mined at the same time
+        - stage_limits: optional concurrency limit per stage ("json", "transcription", "comments"),
+          stages without limit use `concurrency`. Comments are also bounded by the session pool size
+        - output_format: append-only sink the rows are written to: "parquet", "sqlite" or "jsonl"
+        - batch_size: amount of buffered rows per table written to the sink at once
+        - export_excel: export the sink to one excel file at the end of the run
+        - resume: id of an interrupted run to continue, hashtag_list, video_amount, comment_amount,
+          output_format and incremental are then taken from the journal
+        - incremental: only mine videos newer than the watermark of each hashtag (see get_video_urls_v2)
+        - dedup: skip the videos and comments stored by previous runs, the ids of the stored rows
+          are added to the dedup index of the output folder
         
         return:
-        - Dictionary with the path to the excel file with the extracted data
+        - Dictionary with the run id, the path to the excel file (or to the sink when
+          `export_excel` is False) and the path to the sink with the extracted data
         """
+        os.makedirs(self.temp_path, exist_ok=True)
+        journal = CrawlJournal(f'{self.temp_path}/crawl_journal.sqlite')
 
-        now = datetime.now()
-        formatted_datetime = now.strftime("%m-%d-%Y_%H%M")
-        output_path = f'{self.output_path}/video_info_{formatted_datetime}.xlsx'
+        if resume is None:
+            now = datetime.now()
+            formatted_datetime = now.strftime("%m-%d-%Y_%H%M")
+            run_id = new_run_id()
+            journal.start_run(run_id, {"hashtag_list": hashtag_list,
+                                       "video_amount": video_amount,
+                                       "comment_amount": comment_amount,
+                                       "output_format": output_format,
+                                       "incremental": incremental,
+                                       "mining_date": formatted_datetime})
+        else:
+            run = journal.get_run(resume)
+            if run is None:
+                journal.close()
+                raise ValueError(f'Run {resume} not found in the crawl journal.')
+            run_id = resume
+            hashtag_list = run["params"]["hashtag_list"]
+            video_amount = run["params"]["video_amount"]
+            comment_amount = run["params"]["comment_amount"]
+            output_format = run["params"]["output_format"]
+            incremental = run["params"].get("incremental", False)
+            formatted_datetime = run["params"]["mining_date"]
+            print(f"Resuming run {run_id}")
+        print(f"Run id: {run_id}")
+        output_path = f'{self.output_path}/video_info_{run_id}.xlsx'
 
         # self.clear_folder(self.temp_path)
 
-        url_list = []
-        url_per_hashtag = {}
-
+        url_per_hashtag_validated = {}
+        run_ids = set()
+        discovered = journal.get_discovery(run_id)
 
         for hashtag in hashtag_list:
-            print(f"\n\n\nMining {video_amount} video(s) for keyword: {hashtag}")
-            url_list_extracted = asyncio.run(self.get_video_urls_v2(
-                                                tt_ent=hashtag,
-                                                ent_type="hashtag",
-                                                video_ct=video_amount,
-                                            ))
-            
-            set1 = set(url_list)
-            set1.update([url for url in url_list_extracted if url not in set1])
-            url_list = list(set1)
-            url_per_hashtag[hashtag] = url_list
+            if hashtag in discovered:
+                print(f"\n\n\nUsing {len(discovered[hashtag])} journaled video(s) for keyword: {hashtag}")
+                url_list_extracted = discovered[hashtag]
+            else:
+                print(f"\n\n\nMining {video_amount} video(s) for keyword: {hashtag}")
+                watermarks = {}
+                url_list_extracted = self._run(self.get_video_urls_v2(
+                                                    tt_ent=hashtag,
+                                                    ent_type="hashtag",
+                                                    video_ct=video_amount,
+                                                    incremental=incremental,
+                                                    watermarks=watermarks
+                                                ))
+                journal.save_discovery(run_id, hashtag, url_list_extracted)
+                journal.save_watermarks(run_id, watermarks)
 
-            print(f'Got {len(url_list)} urls for hashtag: {hashtag}')
+            # Videos committed before an interruption are in the index too, done_urls skips them anyway
+            url_per_hashtag_validated[hashtag] = self._new_video_urls(url_list_extracted, run_ids, dedup)
 
-        seen = set()
-        url_per_hashtag_validated = {}
-        # Remove duplicates from url_per_hashtag
-        for key, value_list in url_per_hashtag.items():
-            unique_items = []
-            for item in value_list:
-                if item not in seen:
-                    seen.add(item)
-                    unique_items.append(item)     
-            url_per_hashtag_validated[key] = unique_items
+            print(f'Got {len(url_per_hashtag_validated[hashtag])} urls for hashtag: {hashtag}')
         
-        with open(f'{self.temp_path}/video_urls_checkpoint_{formatted_datetime}.json', 'w', encoding='utf-8') as file:
+        with open(f'{self.temp_path}/video_urls_checkpoint_{run_id}.json', 'w', encoding='utf-8') as file:
             print(f"Saving video urls checkpoint in {self.temp_path}")
             file.write(json.dumps(url_per_hashtag_validated, indent=4))
         
-        for hashtag, url_arr in url_per_hashtag_validated.items():
-            data_df = None
-            comment_df = None
-            comment_list = []
-            data_list = []
-            for url in url_arr:
-                print(f"\nMining data from video: {url}")
-                row_dict = {}
-                tiktok_json = pyk.alt_get_tiktok_json(url)
+        sink = open_sink(output_format, f'{self.output_path}/video_info_{run_id}', batch_size)
+        try:
+            # Drop rows written after the last journal commit, their videos are mined again
+            sink.truncate(journal.offsets(run_id))
+            for hashtag, url_arr in url_per_hashtag_validated.items():
+                self._run(self._mine_videos(url_arr,
+                                            hashtag,
+                                            comment_amount,
+                                            formatted_datetime,
+                                            sink,
+                                            concurrency,
+                                            stage_limits or {},
+                                            journal,
+                                            run_id,
+                                            dedup))
+            # Every video is flushed and journaled, the next incremental run can skip them. The feed of a
+            # hashtag with failed videos keeps its watermark, they are discovered again by the next run
+            failed_urls = journal.failed_urls(run_id)
+            discovered = journal.get_discovery(run_id)
+            self.commit_watermarks({(ent_type, hashtag): watermark
+                                    for (ent_type, hashtag), watermark in journal.get_watermarks(run_id).items()
+                                    if failed_urls.isdisjoint(discovered.get(hashtag, []))})
+            journal.set_status(run_id, 'finished')
+            if export_excel:
+                print(f"Exporting {sink.path} to {output_path}")
+                with self.metrics.timer('excel_export'):
+                    sink.export_excel(output_path)
+        finally:
+            sink.close()
+            journal.close()
+        report_paths = self.write_report(run_id)
 
-                # with open(f'{self.temp_path}/test_json.json', 'w', encoding='utf-8') as file:
-                #     file.write(json.dumps(tiktok_json))
+        if not export_excel:
+            return {"run_id": run_id, "video_data_path": sink.path, "sink_path": sink.path, **report_paths}
+        return {"run_id": run_id, "video_data_path": output_path, "sink_path": sink.path, **report_paths}
 
-                if tiktok_json is not None:
-                    try:
-                        data_slot = tiktok_json["__DEFAULT_SCOPE__"]['webapp.video-detail']['itemInfo']['itemStruct']
-                        video_id = data_slot['id']
-                        row_dict['video_id'] = video_id
-                        row_dict['hashtag'] = hashtag
-                        created_time = data_slot.get('createTime')
-                        if created_time is not None:
-                            row_dict['video_timestamp'] = datetime.fromtimestamp(int(created_time)).isoformat()
-                        else:
-                            row_dict['video_timestamp'] = None
-                        row_dict['video_locationcreated'] = data_slot.get('locationCreated')
-                        row_dict['video_diggcount'] = data_slot.get('stats').get('diggCount')
-                        row_dict['video_sharecount'] = data_slot.get('stats').get('shareCount')
-                        row_dict['video_commentcount'] = data_slot.get('stats').get('commentCount')
-                        row_dict['video_playcount'] = data_slot.get('stats').get('playCount')
-                        row_dict['video_description'] = data_slot.get('desc')
-                        row_dict['video_is_ad'] = data_slot.get('isAd')               
-                        row_dict['author_username'] = data_slot.get('author').get('uniqueId')
-                        row_dict['author_name'] = data_slot.get('author').get('nickname')
-                        row_dict['author_followercount'] = data_slot.get('authorStats').get('followerCount')
-                        
-                        
-                        row_dict['author_heartcount'] = data_slot.get('authorStats').get('heartCount')
-                        row_dict['author_videocount'] = data_slot.get('authorStats').get('videoCount')
-                        row_dict['author_diggcount'] = data_slot.get('authorStats').get('diggCount')
-                        row_dict['author_verified'] = data_slot.get('author').get('verified')
-
-
-                        trasncription_list = data_slot.get("video").get("subtitleInfos")
-                        if len(trasncription_list) > 0:
-                            print(f"Mining transcription from video: {url}")
-                            # Filter transcription by english language
-                            eng_transcription = [d for d in trasncription_list if "eng-" in d.get("LanguageCodeName", "")]
-                            if len(eng_transcription) > 0:
-                                language = eng_transcription[0].get("LanguageCodeName")
-                                trasncription_url = eng_transcription[0].get("Url")
-                            else:
-                                language = trasncription_list[0].get("LanguageCodeName")
-                                trasncription_url = trasncription_list[0].get("Url")
-                            response = requests.get(trasncription_url, timeout=15)
-                            result_array = response.text.split('\n')
-                            result_array = [item for item in result_array if item and "-->" not in item and "WEBVTT" not in item]
-                            final_trasncription =' '.join(result_array)
-
-                            row_dict['trasncription_lang'] = language
-                            row_dict['video_trasncription'] = final_trasncription
-                        else:
-                            print(f"Error empty trasncription data from video: {url}")
-                        
-                        row_dict['mining_date'] = formatted_datetime
-
-                        # data_list.append(row_dict)
-                        data_list = [row_dict]
-                        data_df = pd.DataFrame(data_list)
-                        self.save_to_excel(data_df, output_path, 'videos_data')
-                            
-                        # Get comments for each video
-                        print(f"Mining comments from video: {video_id}")
-                        # comment_list += asyncio.run(self.get_comments(video_id, comment_amount))
-                        comment_list = asyncio.run(self.get_comments(video_id, comment_amount))
-                        comment_df = pd.DataFrame(comment_list)
-                        self.save_to_excel(comment_df, output_path, 'comments_data')
-                    except Exception as e:
-                        print(f"Error saving video data from url {url}: {str(e)} \n\n")
-                        time.sleep(random.randint(1, 2))
-                        continue
+    async def _mine_videos(self,
+                           url_arr:list[str],
+                           hashtag:str,
+                           comment_amount:int,
+                           mining_date:str,
+                           sink:OutputSink,
+                           concurrency:int,
+                           stage_limits:dict,
+                           journal:CrawlJournal,
+                           run_id:str,
+                           dedup:bool=True
+                           ) -> None:
+        """
+        Mine a list of video urls concurrently and save every video as soon as it is ready.
+        Videos are marked as done in the journal after their rows are flushed to the sink,
+        then their ids and the ids of their comments are added to the dedup index.
+
+        args:
+        - url_arr: list of video urls
+        - hashtag: hashtag the urls were discovered from
+        - comment_amount: amount of comments to extract per video
+        - mining_date: formatted date of the run
+        - sink: output sink the rows are appended to
+        - concurrency: amount of videos mined at the same time
+        - stage_limits: concurrency limit per stage ("json", "transcription", "comments")
+        - journal: crawl journal of the run
+        - run_id: id of the run
+        - dedup: skip the comments of the dedup index and add the stored ids to it
+
+        return:
+        - None
+        """
+        if concurrency < 1:
+            raise ValueError('`concurrency` must be greater than 0.')
+        limits = {stage: asyncio.Semaphore(stage_limits.get(stage, concurrency))
+                  for stage in ('json', 'transcription', 'comments')}
+        video_limit = asyncio.Semaphore(concurrency)
+
+        done_urls = journal.done_urls(run_id)
+        pending = [url for url in url_arr if url not in done_urls]
+        if len(pending) < len(url_arr):
+            print(f"Skipping {len(url_arr) - len(pending)} video(s) already mined for hashtag: {hashtag}")
+
+        async def mine(url):
+            async with video_limit:
+                return url, await self._mine_video(url, hashtag, comment_amount, mining_date, limits, journal, run_id)
+
+        def commit(done, failed, video_ids, comment_ids):
+            with self.metrics.timer('sink_flush'):
+                sink.flush()
+                journal.commit_videos(run_id, done, failed, sink.offsets)
+                if dedup:
+                    self.dedup.add('video', video_ids)
+                    self.dedup.add('comment', comment_ids)
+            self.metrics.inc('videos_total', len(done), status='done')
+            self.metrics.inc('videos_total', len(failed), status='failed')
+
+        done, failed, video_ids, comment_ids = [], [], [], set()
+        tasks = [asyncio.create_task(mine(url)) for url in pending]
+        try:
+            for task in asyncio.as_completed(tasks):
+                url, (record, comment_list) = await task
+                if record is None:
+                    failed.append(url)
                 else:
+                    if dedup:
+                        comment_list = self._unseen_comments(comment_list, comment_ids)
+                        comment_ids.update(comment['comment_id'] for comment in comment_list
+                                           if comment.get('comment_id') is not None)
+                    sink.write('videos_data', [record])
+                    sink.write('comments_data', comment_list)
+                    done.append(url)
+                    video_ids.append(record.video_id)
+                if len(done) + len(failed) >= sink.batch_size:
+                    commit(done, failed, video_ids, comment_ids)
+                    done, failed, video_ids, comment_ids = [], [], [], set()
+            commit(done, failed, video_ids, comment_ids)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _video_record(self, tiktok_json:dict, hashtag:str, mining_date:str) -> tuple[VideoRecord, str]:
+        """
+        Build the video record from the page json of a video
+
+        args:
+        - tiktok_json: page json returned by get_tiktok_json
+        - hashtag: hashtag the video was discovered from
+        - mining_date: formatted date of the run
+
+        return:
+        - Tuple with the record and the url of the transcription to download (None if the video has no subtitles)
+        """
+        item = video_item(tiktok_json)
+        if item is None:
+            raise PermanentError(f"video without itemStruct (status {video_detail(tiktok_json).get('statusCode')})")
+        return VideoRecord.from_item(item, hashtag, mining_date)
+
+    async def _mine_video(self,
+                          url:str,
+                          hashtag:str,
+                          comment_amount:int,
+                          mining_date:str,
+                          limits:dict,
+                          journal:CrawlJournal,
+                          run_id:str
+                          ) -> tuple[dict, list[dict]]:
+        """
+        Mine page json, transcription and comments of one video, skipping the stages
+        already recorded in the journal.
+        Blocking downloads run in worker threads so the event loop keeps serving other videos.
+        Requests are paced by the endpoint limiters, deleted or private videos fail fast.
+
+        args:
+        - url: video url
+        - hashtag: hashtag the url was discovered from
+        - comment_amount: amount of comments to extract
+        - mining_date: formatted date of the run
+        - limits: semaphores per stage ("json", "transcription", "comments")
+        - journal: crawl journal of the run
+        - run_id: id of the run
+
+        return:
+        - Tuple with the video record and its list of comments, record is None if the video could not be mined
+        """
+        state = journal.video_state(run_id, url) or {}
+        record = None
+        try:
+            if state.get("json"):
+                print(f"\nResuming video: {url}")
+                row_dict = dict(state["row"])
+                trasncription_url = row_dict.pop('_trasncription_url', None)
+                record = VideoRecord(**row_dict)
+            else:
+                print(f"\nMining data from video: {url}")
+                async with limits['json']:
+                    tiktok_json = await self._page_json(url)
+                if tiktok_json is None:
                     print(f"Error empty json data from video: {url}")
-        
-            # comment_df = pd.DataFrame(comment_list)
-            # self.save_to_excel(comment_df, output_path, 'comments_data')
+                    return None, []
+                record, trasncription_url = self._video_record(tiktok_json, hashtag, mining_date)
+                journal.mark_stage(run_id, url, hashtag, 'json', {**record.as_dict(), '_trasncription_url': trasncription_url})
 
-            # data_df = pd.DataFrame(data_list)
-            # self.save_to_excel(data_df, output_path, 'videos_data')
+            if trasncription_url is not None and not state.get("transcription"):
+                print(f"Mining transcription from video: {url}")
+                async with limits['transcription']:
+                    record.video_trasncription = await self.pacer.call('vtt', asyncio.to_thread,
+                                                                       self._fetch_transcription, trasncription_url)
+                journal.mark_stage(run_id, url, hashtag, 'transcription', record.as_dict())
+            elif record.trasncription_lang is None:
+                print(f"Error empty trasncription data from video: {url}")
 
-            del data_df
-            del comment_df
+            # Get comments for each video
+            video_id = record.video_id
+            print(f"Mining comments from video: {video_id}")
+            async with limits['comments']:
+                comment_list = await self.get_comments(video_id, comment_amount)
+        except PermanentError as e:
+            print(f"Skipping video {url}: {str(e)}")
+            self.metrics.inc('videos_skipped_total', reason='permanent')
+            return None, []
+        except Exception as e:
+            print(f"Error saving video data from url {url}: {str(e)} \n\n")
+            self.metrics.error('video', e)
+            return None, []
 
-        return {"video_data_path": output_path}
-    
-    def get_video_transcription(self, videos_id:list[str]):
+        return record, comment_list
+
+    async def stream_videos(self,
+                            hashtag_list:list[str],
+                            video_amount:int,
+                            comment_amount:int=0,
+                            concurrency:int=1,
+                            stage_limits:dict=None,
+                            queue_size:int=None,
+                            incremental:bool=False,
+                            dedup:bool=True
+                            ) -> AsyncIterator[tuple[VideoRecord, list[CommentRecord]]]:
+        """
+        Mine the videos of a list of hashtags and yield every video with its comments as soon as it is ready.
+        Discovery, mining and the consumer run at the same time, connected by bounded queues: a slow
+        consumer (db writer, llm stage, ...) pauses the crawler and memory stays flat for any run size.
+        Consume it on one event loop (e.g. inside `asyncio.run`), leaving the loop early stops the crawl.
+
+        args:
+        - hashtag_list: list of hashtags to extract videos
+        - video_amount: amount of videos to extract per hashtag
+        - comment_amount: amount of comments to extract per video
+        - concurrency: amount of videos mined at the same time
+        - stage_limits: optional concurrency limit per stage ("json", "transcription", "comments")
+        - queue_size: amount of discovered urls and of mined videos buffered ahead of the consumer,
+          2 * concurrency by default
+        - incremental: only mine videos newer than the watermark of each hashtag (see get_video_urls_v2)
+        - dedup: skip the videos and comments of the dedup index, the ids of every video the consumer
+          asked past are added to it
+
+        return:
+        - Async iterator of tuples with the video record and its list of comment records
+        """
+        if concurrency < 1:
+            raise ValueError('`concurrency` must be greater than 0.')
+        queue_size = queue_size or 2 * concurrency
+        mining_date = datetime.now().strftime("%m-%d-%Y_%H%M")
+        run_id = new_run_id('stream')
+        os.makedirs(self.temp_path, exist_ok=True)
+        journal = CrawlJournal(f'{self.temp_path}/crawl_journal.sqlite')
+        journal.start_run(run_id, {"hashtag_list": hashtag_list,
+                                   "video_amount": video_amount,
+                                   "comment_amount": comment_amount,
+                                   "incremental": incremental,
+                                   "mining_date": mining_date})
+        limits = {stage: asyncio.Semaphore((stage_limits or {}).get(stage, concurrency))
+                  for stage in ('json', 'transcription', 'comments')}
+        url_queue = asyncio.Queue(maxsize=queue_size)
+        video_queue = asyncio.Queue(maxsize=queue_size)
+
+        watermarks = {}
+        # Video ids discovered per hashtag and ids of the videos that could not be mined
+        discovered = {hashtag: set() for hashtag in hashtag_list}
+        failed_ids = set()
+
+        async def discover():
+            run_ids = set()
+            error = None
+            try:
+                for hashtag in hashtag_list:
+                    print(f"\n\n\nStreaming {video_amount} video(s) for keyword: {hashtag}")
+                    async for url in self.iter_video_urls(hashtag, video_amount, 'hashtag', incremental=incremental,
+                                                          watermarks=watermarks):
+                        discovered[hashtag].add(url_video_id(url))
+                        for new_url in self._new_video_urls([url], run_ids, dedup):
+                            await url_queue.put((new_url, hashtag))
+            except Exception as e:
+                # The urls already queued are still mined, the error is raised at the end
+                error = e
+            for _ in range(concurrency):
+                await url_queue.put(None)
+            if error is not None:
+                raise error
+
+        async def mine():
+            error = None
+            try:
+                while (job := await url_queue.get()) is not None:
+                    url, hashtag = job
+                    record, comment_list = await self._mine_video(url, hashtag, comment_amount, mining_date,
+                                                                  limits, journal, run_id)
+                    if record is None:
+                        failed_ids.add(url_video_id(url))
+                        journal.commit_videos(run_id, [], [url], {})
+                        self.metrics.inc('videos_total', status='failed')
+                        continue
+                    if dedup:
+                        comment_list = self._unseen_comments(comment_list)
+                    await video_queue.put((url, record, [CommentRecord(**comment) for comment in comment_list]))
+            except Exception as e:
+                error = e
+            await video_queue.put(None)
+            if error is not None:
+                raise error
+
+        tasks = [asyncio.create_task(discover())] + [asyncio.create_task(mine()) for _ in range(concurrency)]
+        running = concurrency
+        try:
+            while running:
+                item = await video_queue.get()
+                if item is None:
+                    running -= 1
+                    continue
+                url, record, comments = item
+                yield record, comments
+                # The consumer asked for the next video, this one is handled
+                journal.commit_videos(run_id, [url], [], {})
+                self.metrics.inc('videos_total', status='done')
+                if dedup:
+                    self.dedup.add('video', [record.video_id])
+                    self.dedup.add('comment', [comment.comment_id for comment in comments if comment.comment_id is not None])
+            # Raise the error of a discovery or mining task
+            await asyncio.gather(*tasks)
+            # The consumer handled every video, the next incremental run can skip them. The feed of a
+            # hashtag with failed videos keeps its watermark, they are discovered again by the next run
+            self.commit_watermarks({(ent_type, hashtag): watermark for (ent_type, hashtag), watermark in watermarks.items()
+                                    if failed_ids.isdisjoint(discovered[hashtag])})
+            journal.set_status(run_id, 'finished')
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            journal.close()
+
+    async def stream_comments(self,
+                              video_ids:list[str],
+                              comment_amount:int,
+                              concurrency:int=1,
+                              queue_size:int=None,
+                              dedup:bool=True
+                              ) -> AsyncIterator[CommentRecord]:
+        """
+        Yield the comments of a list of videos as soon as TikTok pages them, up to `concurrency`
+        videos at the same time. Comments are buffered in a bounded queue, a slow consumer
+        pauses the paging. Consume it on one event loop (e.g. inside `asyncio.run`).
+
+        args:
+        - video_ids: list of video ids
+        - comment_amount: amount of comments to extract per video
+        - concurrency: amount of videos whose comments are paged at the same time
+        - queue_size: amount of comments buffered ahead of the consumer, 100 by default
+        - dedup: skip the comments of the dedup index, the ids of the comments the consumer
+          asked past are added to it
+
+        return:
+        - Async iterator of comment records
         """
-        Get video transcription from a list of video ids and save it in a txt file
+        if concurrency < 1:
+            raise ValueError('`concurrency` must be greater than 0.')
+        comment_queue = asyncio.Queue(maxsize=queue_size or 100)
+        pending = iter(video_ids)
+        streamed_ids = set()
+        seen_ids = []
+
+        async def page():
+            error = None
+            try:
+                for video_id in pending:
+                    async for record in self.iter_comments(video_id, comment_amount):
+                        if record.comment_id is not None:
+                            if record.comment_id in streamed_ids or (dedup and self.dedup.contains('comment', record.comment_id)):
+                                self.metrics.inc('duplicates_skipped_total', kind='comment')
+                                continue
+                            streamed_ids.add(record.comment_id)
+                        await comment_queue.put(record)
+            except Exception as e:
+                error = e
+            await comment_queue.put(None)
+            if error is not None:
+                raise error
+
+        tasks = [asyncio.create_task(page()) for _ in range(concurrency)]
+        running = concurrency
+        try:
+            while running:
+                record = await comment_queue.get()
+                if record is None:
+                    running -= 1
+                    continue
+                yield record
+                if dedup and record.comment_id is not None:
+                    seen_ids.append(record.comment_id)
+                    if len(seen_ids) >= 100:
+                        self.dedup.add('comment', seen_ids)
+                        seen_ids.clear()
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if dedup:
+                self.dedup.add('comment', seen_ids)
+
+    def get_video_transcription(self, videos_id:list[str], json_concurrency:int=8):
+        """
+        Get video transcription from a list of video ids and save it in a txt file.
+        Page jsons and transcriptions are downloaded concurrently, paced by the "page_json"
+        and "vtt" limiters; a video that fails is reported and does not fail the batch.
 
         args:
         - videos_id: list of video ids
+        - json_concurrency: amount of videos whose page json and transcription are downloaded at the same time
 
         return:
         - temp_data_path: path to the txt file with the transcriptions
         """
-        tiktok_url = 'https://www.tiktok.com/@tiktok/video/'
+        os.makedirs(self.temp_path, exist_ok=True)
         temp_data_path = f'{self.temp_path}/transcriptions.txt'
-        res_list = []
-        for id_v in videos_id:
-            # Get transcription of video
-            aux_url = tiktok_url+id_v
-            tiktok_json = pyk.alt_get_tiktok_json(aux_url)
-            if tiktok_json is not None:
-                trasncription_list = tiktok_json.get("__DEFAULT_SCOPE__").get("webapp.video-detail").get("itemInfo").get("itemStruct").get("video").get("subtitleInfos")
-                if len(trasncription_list) > 0:
-                    # language = trasncription_list[0].get("LanguageCodeName")
-                    trasncription_url = trasncription_list[0].get("Url")
-                    response = requests.get(trasncription_url, timeout=6)
-                    result_array = response.text.split('\n')
-                    result_array = [item for item in result_array if item and "-->" not in item and "WEBVTT" not in item]
-                    final_trasncription =' '.join(result_array)
-                    res_list.append(id_v+":\n"+final_trasncription+"\n\n")
+        with self.metrics.timer('transcription_batch'):
+            transcriptions = self._run(self._video_transcriptions(videos_id, json_concurrency))
+        res_list = [id_v+":\n"+final_trasncription+"\n\n"
+                    for id_v, final_trasncription in zip(videos_id, transcriptions)
+                    if final_trasncription is not None]
         with open(temp_data_path, "w", encoding="utf-8") as file:
             # Write each string in the list to the file
             for item in res_list:
                 file.write(item + "\n")
 
         return temp_data_path
-        
+
+    async def _video_transcriptions(self, videos_id:list[str], json_concurrency:int) -> list[str]:
+        """
+        Transcriptions of a list of video ids, up to `json_concurrency` videos at the same time
+
+        return:
+        - List of transcriptions in the same order, None for the videos without one or that failed
+        """
+        tiktok_url = f'{self.base_url}/@tiktok/video/'
+        limit = asyncio.Semaphore(json_concurrency)
+
+        async def transcription(video_id):
+            async with limit:
+                tiktok_json = await self._page_json(tiktok_url+video_id)
+                if tiktok_json is None:
+                    raise ThrottledError("TikTok did not deliver the page json")
+                item = video_item(tiktok_json)
+                _, trasncription_url = select_transcription((item.get("video") or {}).get("subtitleInfos"))
+                if trasncription_url is None:
+                    return None
+                return await self.pacer.call('vtt', asyncio.to_thread, self._fetch_transcription, trasncription_url)
+
+        results = await asyncio.gather(*(transcription(id_v) for id_v in videos_id), return_exceptions=True)
+        transcriptions = []
+        for id_v, result in zip(videos_id, results):
+            if isinstance(result, Exception):
+                print(f"No transcription for video {id_v}: {str(result)}")
+                # Download errors are also counted by the "transcription" timer, videos are counted once here
+                self.metrics.error('transcription_batch', result)
+                result = None
+            transcriptions.append(result)
+        return transcriptions
+
+    def enqueue_hashtags(self,
+                         queue_path:str,
+                         hashtag_list:list[str],
+                         video_amount:int,
+                         comment_amount:int,
+                         incremental:bool=False
+                         ) -> dict:
+        """
+        Add one discovery job per hashtag to a work queue, workers started with `run_worker`
+        then discover the urls, enqueue one mining job per video and mine them.
+
+        args:
+        - queue_path: path to the sqlite file of the queue
+        - hashtag_list: list of hashtags to extract videos
+        - video_amount: amount of videos to extract per hashtag
+        - comment_amount: amount of comments to extract per video
+        - incremental: only mine videos newer than the watermark of each hashtag
+
+        return:
+        - Dictionary with the amount of jobs per kind and status
+        """
+        queue = WorkQueue(queue_path)
+        try:
+            for hashtag in hashtag_list:
+                queue.enqueue('discover', {"hashtag": hashtag,
+                                           "video_amount": video_amount,
+                                           "comment_amount": comment_amount,
+                                           "incremental": incremental})
+            return queue.stats()
+        finally:
+            queue.close()
+
+    def run_worker(self,
+                   queue_path:str,
+                   worker_id:str=None,
+                   concurrency:int=1,
+                   stage_limits:dict=None,
+                   output_format:str='parquet',
+                   batch_size:int=100,
+                   visibility_timeout:int=900,
+                   exit_when_empty:bool=True,
+                   poll_interval:int=5,
+                   dedup:bool=True
+                   ) -> dict:
+        """
+        Claim and run jobs from a work queue until it is empty. Any number of workers
+        (processes or machines sharing the queue file) can run at the same time; each one
+        writes its rows to its own sink and completes its jobs after the rows are flushed,
+        so the jobs of a dead worker go back to the queue when their leases expire.
+
+        args:
+        - queue_path: path to the sqlite file of the queue
+        - worker_id: id of the worker, host name and process id by default
+        - concurrency: amount of jobs run at the same time
+        - stage_limits: optional concurrency limit per stage ("json", "transcription", "comments")
+        - output_format: append-only sink the rows are written to: "parquet", "sqlite" or "jsonl"
+        - batch_size: amount of finished jobs flushed and completed at once
+        - visibility_timeout: seconds a leased job stays invisible to other workers
+        - exit_when_empty: stop when no job is queued or leased, otherwise keep polling
+        - poll_interval: seconds between polls of an empty queue
+        - dedup: skip the videos and comments stored by any run or worker, the ids of the
+          stored rows are added to the dedup index of the output folder
+
+        return:
+        - Dictionary with the worker id, the path to its sink and the amount of processed jobs
+        """
+        worker_id = worker_id or WorkQueue.default_worker_id()
+        mining_date = datetime.now().strftime("%m-%d-%Y_%H%M")
+        os.makedirs(self.temp_path, exist_ok=True)
+        queue = WorkQueue(queue_path, visibility_timeout=visibility_timeout)
+        journal = CrawlJournal(f'{self.temp_path}/crawl_journal.sqlite')
+        sink = open_sink(output_format, f'{self.output_path}/{new_run_id(f"worker_{worker_id}")}', batch_size)
+        if dedup and (self._dedup is None or self._dedup.filters):
+            # Other workers add ids to the same index, the Bloom filter of this process would miss them
+            if self._dedup is not None:
+                self._dedup.close()
+            self._dedup = DedupIndex(f'{self.output_path}/dedup_index.sqlite', bloom=False)
+        print(f"Starting worker {worker_id}")
+        try:
+            processed = self._run(self._worker_loop(queue,
+                                                    worker_id,
+                                                    sink,
+                                                    journal,
+                                                    mining_date,
+                                                    concurrency,
+                                                    stage_limits or {},
+                                                    exit_when_empty,
+                                                    poll_interval,
+                                                    dedup))
+        finally:
+            sink.close()
+            journal.close()
+            queue.close()
+        report_paths = self.write_report(f'worker_{worker_id}')
+        return {"worker_id": worker_id, "sink_path": sink.path, "processed": processed, **report_paths}
+
+    async def _worker_loop(self,
+                           queue:WorkQueue,
+                           worker_id:str,
+                           sink:OutputSink,
+                           journal:CrawlJournal,
+                           mining_date:str,
+                           concurrency:int,
+                           stage_limits:dict,
+                           exit_when_empty:bool,
+                           poll_interval:int,
+                           dedup:bool
+                           ) -> int:
+        """
+        Claim, run and complete queue jobs with up to `concurrency` jobs in flight.
+        The ids of the rows written by completed jobs are added to the dedup index and the
+        journal rows of their videos are deleted, the queue keeps the outcome of every job.
+        The watermark of a discovered hashtag is committed once every mining job it queued is done,
+        and dropped if one of them failed for good.
+
+        return:
+        - Amount of jobs processed
+        """
+        limits = {stage: asyncio.Semaphore(stage_limits.get(stage, concurrency))
+                  for stage in ('json', 'transcription', 'comments')}
+        in_flight = {}
+        journal_run = f'worker_{worker_id}'
+        done_ids, done_results, done_urls = [], [], []
+        stored = {"video": [], "comment": set()} if dedup else None
+        # (watermarks, dedup keys of the mining jobs) of the discovery jobs run by this worker
+        pending_watermarks = []
+        processed = 0
+        last_extend = time.monotonic()
+
+        def commit():
+            sink.flush()
+            queue.complete(done_ids, worker_id, done_results)
+            journal.forget_videos(journal_run, done_urls)
+            done_ids.clear()
+            done_results.clear()
+            done_urls.clear()
+            if stored is not None:
+                for kind, ids in stored.items():
+                    self.dedup.add(kind, ids)
+                    ids.clear()
+            for entry in list(pending_watermarks):
+                watermarks, dedup_keys = entry
+                statuses = set(queue.statuses(dedup_keys).values())
+                if statuses & {'queued', 'leased'}:
+                    continue
+                pending_watermarks.remove(entry)
+                if 'failed' in statuses:
+                    print(f"Keeping the watermarks of {', '.join(name for _, name in watermarks)}: some videos failed")
+                else:
+                    self.commit_watermarks(watermarks)
+
+        try:
+            while True:
+                while len(in_flight) < concurrency:
+                    job = queue.claim(worker_id)
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run_job(job, queue, sink, journal, worker_id, mining_date, limits, stored,
+                                                             pending_watermarks))
+                    in_flight[task] = job
+
+                if not in_flight:
+                    commit()
+                    if exit_when_empty and queue.pending() == 0:
+                        break
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                finished, _ = await asyncio.wait(in_flight, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    job = in_flight.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        print(f"Error running job {job['id']} ({job['kind']}): {str(e)}")
+                        queue.fail(job['id'], worker_id, str(e))
+                        if job['kind'] == 'mine':
+                            journal.forget_videos(journal_run, [job['payload']['url']])
+                        continue
+                    done_ids.append(job['id'])
+                    done_results.append(result)
+                    if job['kind'] == 'mine':
+                        done_urls.append(job['payload']['url'])
+                    processed += 1
+
+                if len(done_ids) >= sink.batch_size:
+                    commit()
+                if time.monotonic() - last_extend > queue.visibility_timeout / 4:
+                    queue.extend([job['id'] for job in in_flight.values()] + done_ids, worker_id)
+                    last_extend = time.monotonic()
+            commit()
+        finally:
+            for task in in_flight:
+                task.cancel()
+        return processed
+
+    async def _run_job(self,
+                       job:dict,
+                       queue:WorkQueue,
+                       sink:OutputSink,
+                       journal:CrawlJournal,
+                       worker_id:str,
+                       mining_date:str,
+                       limits:dict,
+                       stored:dict=None,
+                       watermarks:list=None
+                       ) -> dict:
+        """
+        Run one queue job: "discover" enqueues a "mine" job per video url of a hashtag,
+        "mine" mines one video and writes its rows to the sink.
+        With `stored` (ids written per kind, added to the dedup index on commit) the videos
+        and comments of the dedup index are skipped. A discovery appends its watermarks and the
+        dedup keys of its mining jobs to `watermarks`, to commit once those jobs are done.
+
+        return:
+        - Result of the job
+        """
+        payload = job['payload']
+        if job['kind'] == 'discover':
+            discovered = {}
+            url_list = await self.get_video_urls_v2(tt_ent=payload['hashtag'],
+                                                    ent_type="hashtag",
+                                                    video_ct=payload['video_amount'],
+                                                    incremental=payload.get('incremental', False),
+                                                    watermarks=discovered)
+            new_urls = self._new_video_urls(url_list, set(), dedup=stored is not None)
+            queued = 0
+            dedup_keys = [f"video:{url_video_id(url)}" for url in new_urls]
+            for url, dedup_key in zip(new_urls, dedup_keys):
+                queued += queue.enqueue('mine',
+                                        {"url": url,
+                                         "hashtag": payload['hashtag'],
+                                         "comment_amount": payload['comment_amount']},
+                                        dedup_key=dedup_key)
+            # The mine jobs are retried until mined or failed for good, only then the watermark can move
+            if discovered and watermarks is not None:
+                watermarks.append((discovered, dedup_keys))
+            print(f"Queued {queued} video(s) for hashtag: {payload['hashtag']}")
+            return {"urls": len(url_list), "queued": queued}
+        if job['kind'] == 'mine':
+            video_id = url_video_id(payload['url'])
+            if stored is not None and self.dedup.contains('video', video_id):
+                # Stored by another worker after this job was queued
+                return {"video_id": video_id, "skipped": True}
+            record, comment_list = await self._mine_video(payload['url'],
+                                                          payload['hashtag'],
+                                                          payload['comment_amount'],
+                                                          mining_date,
+                                                          limits,
+                                                          journal,
+                                                          f'worker_{worker_id}')
+            if record is None:
+                raise RuntimeError(f"Video {payload['url']} could not be mined")
+            if stored is not None:
+                comment_list = self._unseen_comments(comment_list, stored['comment'])
+                stored['video'].append(record.video_id)
+                stored['comment'].update(comment['comment_id'] for comment in comment_list
+                                         if comment.get('comment_id') is not None)
+            sink.write('videos_data', [record])
+            sink.write('comments_data', comment_list)
+            return {"video_id": record.video_id, "comments": len(comment_list)}
+        raise ValueError(f"Unknown job kind {job['kind']}")
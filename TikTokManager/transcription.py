@@ -0,0 +1,90 @@
+"""
+Transcription (subtitle) download shared by every TikTokManager path.
+- one pooled requests.Session, so connections to the subtitle CDN are kept alive
+- response bodies are streamed through the incremental VTT parser
+- thread safe: callers download from worker threads (paced by the "vtt" limiter of the
+  manager), with a limit of simultaneous requests per host
+- language rule: first "eng-" subtitle, otherwise the first subtitle
+"""
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from TikTokManager.vtt import iter_cues
+
+
+def select_transcription(subtitle_infos:list[dict]) -> tuple[str, str]:
+    """
+    Pick the subtitle to download from the `subtitleInfos` of a video
+
+    args:
+    - subtitle_infos: list of subtitle dictionaries of the video item
+
+    return:
+    - Tuple (language, url), (None, None) if the video has no subtitles
+    """
+    if not subtitle_infos:
+        return None, None
+    # Filter transcription by english language
+    eng_transcription = [d for d in subtitle_infos if "eng-" in d.get("LanguageCodeName", "")]
+    selected = eng_transcription[0] if len(eng_transcription) > 0 else subtitle_infos[0]
+    return selected.get("LanguageCodeName"), selected.get("Url")
+
+
+class TranscriptionFetcher():
+    """Pooled, thread safe transcription downloader"""
+    def __init__(self, per_host:int = 8, timeout:int = 15) -> None:
+        """
+        args:
+        - per_host: maximum simultaneous requests to the same host
+        - timeout: request timeout in seconds
+        """
+        self.per_host = per_host
+        self.timeout = timeout
+        self.session = requests.Session()
+        # One kept-alive connection per request a host can have in flight
+        adapter = HTTPAdapter(pool_maxsize=per_host)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url:str) -> threading.BoundedSemaphore:
+        with self._lock:
+            return self._host_limits[urlparse(url).netloc]
+
+    def fetch_cues(self, url:str) -> list[tuple[float, float, str]]:
+        """
+        Download one transcription as cues, parsing the body while it streams (thread safe)
+
+        args:
+        - url: subtitle url
+
+        return:
+        - List of (start, end, text) cues without consecutive duplicate captions
+        """
+        with self._host_limit(url):
+            with self.session.get(url, timeout=self.timeout, stream=True) as response:
+                response.raise_for_status()
+                # WebVTT is always utf-8
+                response.encoding = 'utf-8'
+                return list(iter_cues(response.iter_content(chunk_size=16384, decode_unicode=True)))
+
+    def fetch(self, url:str) -> str:
+        """
+        Download one transcription as flat text (thread safe)
+
+        args:
+        - url: subtitle url
+
+        return:
+        - Transcription text
+        """
+        return ' '.join(cue[2].replace('\n', ' ') for cue in self.fetch_cues(url))
+
+    def close(self) -> None:
+        """Close the pooled connections"""
+        self.session.close()
@@ -0,0 +1,178 @@
+"""
+Incremental WebVTT parser for TikTok transcriptions.
+- consumes the response body chunk by chunk, only the current cue is kept in memory
+- skips the header, cue ids and NOTE / STYLE / REGION blocks
+- strips inline tags, unescapes entities and merges consecutive duplicate
+  (rolling) captions
+- produces (start, end, text) cues or flat text
+"""
+import html
+import re
+
+TAG_RE = re.compile(r'<[^>]*>')
+SKIPPED_BLOCKS = ('NOTE', 'STYLE', 'REGION')
+
+
+def parse_timestamp(value:str) -> float:
+    """
+    Convert a WebVTT timestamp ("hh:mm:ss.ttt" or "mm:ss.ttt") to seconds
+
+    args:
+    - value: timestamp
+
+    return:
+    - Seconds as float
+    """
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class VttParser():
+    """Incremental WebVTT parser, feed it text chunks and collect the finished cues"""
+    def __init__(self, dedup:bool = True) -> None:
+        """
+        args:
+        - dedup: merge consecutive cues with repeated caption lines
+        """
+        self.dedup = dedup
+        self._pending = ''
+        self._in_header = True
+        self._skip_block = False
+        self._block_started = False
+        self._timing = None
+        self._lines = []
+        self._last = None
+
+    def feed(self, chunk:str) -> list[tuple[float, float, str]]:
+        """
+        Parse a chunk of the document
+
+        args:
+        - chunk: decoded text chunk, it can end in the middle of a line
+
+        return:
+        - List of the cues finished by this chunk
+        """
+        data = self._pending + chunk
+        # Keep a trailing "\r" until the next chunk tells whether it is part of "\r\n"
+        if data.endswith('\r'):
+            data, self._pending = data[:-1], '\r'
+        else:
+            self._pending = ''
+        if '\r' in data:
+            data = data.replace('\r\n', '\n').replace('\r', '\n')
+        lines = data.split('\n')
+        self._pending = lines.pop() + self._pending
+        cues = []
+        for line in lines:
+            self._line(line, cues)
+        return cues
+
+    def close(self) -> list[tuple[float, float, str]]:
+        """
+        Finish the document
+
+        return:
+        - List of the remaining cues
+        """
+        cues = []
+        pending, self._pending = self._pending.rstrip('\r'), ''
+        if pending:
+            self._line(pending, cues)
+        self._line('', cues)
+        if self._last is not None:
+            cues.append(self._last)
+            self._last = None
+        return cues
+
+    def _line(self, line:str, cues:list) -> None:
+        if self._in_header:
+            line = line.lstrip('\ufeff')
+            if '-->' not in line:
+                if line == '':
+                    self._in_header = False
+                return
+            # Documents without a blank line after the header go straight to the first cue
+            self._in_header = False
+        if not line or line.isspace():
+            self._end_block(cues)
+            return
+        if self._skip_block:
+            return
+        if not self._block_started:
+            self._block_started = True
+            if line.split(' ', 1)[0].split('\t', 1)[0] in SKIPPED_BLOCKS:
+                self._skip_block = True
+                return
+        if self._timing is None:
+            if '-->' in line:
+                start, end = line.split('-->', 1)
+                try:
+                    self._timing = (parse_timestamp(start.strip()), parse_timestamp(end.strip().split()[0]))
+                except (ValueError, IndexError):
+                    self._skip_block = True
+            # Any other line before the timing is a cue id
+            return
+        if '<' in line:
+            line = TAG_RE.sub('', line)
+        if '&' in line:
+            line = html.unescape(line)
+        text = line.strip()
+        if text:
+            self._lines.append(text)
+
+    def _end_block(self, cues:list) -> None:
+        if self._timing is not None and self._lines:
+            self._add_cue(self._timing[0], self._timing[1], self._lines, cues)
+        self._skip_block = False
+        self._block_started = False
+        self._timing = None
+        self._lines = []
+
+    def _add_cue(self, start:float, end:float, lines:list[str], cues:list) -> None:
+        if self.dedup and self._last is not None:
+            last_lines = self._last[2].split('\n')
+            # Rolling captions repeat the previous cue before adding new lines
+            while lines and lines[0] in last_lines:
+                lines = lines[1:]
+            if not lines:
+                self._last = (self._last[0], max(self._last[1], end), self._last[2])
+                return
+        if self._last is not None:
+            cues.append(self._last)
+        self._last = (start, end, '\n'.join(lines))
+
+
+def iter_cues(chunks, dedup:bool = True):
+    """
+    Parse WebVTT text chunks into cues
+
+    args:
+    - chunks: iterable of decoded text chunks (e.g. `response.iter_content(decode_unicode=True)`)
+    - dedup: merge consecutive cues with repeated caption lines
+
+    return:
+    - Generator of (start, end, text) tuples, multi-line captions are joined with "\\n"
+    """
+    parser = VttParser(dedup=dedup)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def parse_text(chunks, dedup:bool = True) -> str:
+    """
+    Parse WebVTT text chunks into flat text
+
+    args:
+    - chunks: iterable of decoded text chunks, or a whole document as one string
+    - dedup: merge consecutive cues with repeated caption lines
+
+    return:
+    - Caption text joined with spaces
+    """
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+    return ' '.join(cue[2].replace('\n', ' ') for cue in iter_cues(chunks, dedup=dedup))
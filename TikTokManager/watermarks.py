@@ -0,0 +1,68 @@
+"""
+High-water marks of the hashtag and user feeds, used by incremental discovery.
+- one mark per (entity type, entity name): newest createTime and video id seen
+- stored in sqlite next to the outputs, so it survives between runs
+"""
+import sqlite3
+from datetime import datetime
+
+
+class WatermarkStore():
+    """Per hashtag / user createTime watermarks"""
+    def __init__(self, path:str) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the watermarks
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                ent_type TEXT,
+                ent_name TEXT,
+                create_time INTEGER,
+                video_id TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (ent_type, ent_name)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, ent_type:str, ent_name:str) -> tuple[int, str]:
+        """
+        Get the watermark of an entity
+
+        args:
+        - ent_type: "hashtag" or "user"
+        - ent_name: hashtag or username
+
+        return:
+        - Tuple (create_time, video_id) of the newest video seen, None if the entity was never crawled
+        """
+        row = self.conn.execute('SELECT create_time, video_id FROM watermarks WHERE ent_type = ? AND ent_name = ?',
+                                (ent_type, ent_name.lower())).fetchone()
+        return tuple(row) if row is not None else None
+
+    def update(self, ent_type:str, ent_name:str, create_time:int, video_id:str) -> None:
+        """
+        Move the watermark of an entity forward (older values are ignored)
+
+        args:
+        - ent_type: "hashtag" or "user"
+        - ent_name: hashtag or username
+        - create_time: createTime of the newest video seen
+        - video_id: id of that video
+
+        return:
+        - None
+        """
+        current = self.get(ent_type, ent_name)
+        if current is not None and current[0] >= create_time:
+            return
+        self.conn.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)',
+                          (ent_type, ent_name.lower(), create_time, video_id, datetime.now().isoformat()))
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Close the watermarks database"""
+        self.conn.close()
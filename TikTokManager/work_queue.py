@@ -0,0 +1,182 @@
+"""
+Shared work queue for running TikTokManager workers in several processes or machines.
+- jobs are stored in sqlite (a local file or a file on a share every worker can lock)
+- a worker leases a job for `visibility_timeout` seconds; leases of dead workers
+  expire and the job goes back to the queue automatically
+- failed jobs are retried up to `max_attempts` times
+"""
+import json
+import os
+import socket
+import sqlite3
+import time
+
+
+class WorkQueue():
+    """SQLite backed job queue with leases and visibility timeouts"""
+    def __init__(self, path:str, visibility_timeout:int = 900, max_attempts:int = 3) -> None:
+        """
+        args:
+        - path: path to the sqlite file of the queue
+        - visibility_timeout: seconds a leased job stays invisible to other workers
+        - max_attempts: times a job is tried before it is marked as failed
+        """
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        # isolation_level=None: transactions are handled explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                payload TEXT,
+                dedup_key TEXT UNIQUE,
+                status TEXT DEFAULT 'queued',
+                attempts INTEGER DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                result TEXT,
+                error TEXT,
+                created_at REAL,
+                updated_at REAL
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)')
+
+    @staticmethod
+    def default_worker_id() -> str:
+        """Worker id made of host name and process id"""
+        return f'{socket.gethostname()}-{os.getpid()}'
+
+    def enqueue(self, kind:str, payload:dict, dedup_key:str = None) -> bool:
+        """
+        Add a job to the queue
+
+        args:
+        - kind: job type ("discover" or "mine")
+        - payload: job parameters
+        - dedup_key: optional unique key, a job with an existing key is not added again
+
+        return:
+        - True if the job was added
+        """
+        now = time.time()
+        cursor = self.conn.execute('INSERT OR IGNORE INTO jobs (kind, payload, dedup_key, created_at, updated_at) '
+                                   'VALUES (?, ?, ?, ?, ?)', (kind, json.dumps(payload), dedup_key, now, now))
+        return cursor.rowcount > 0
+
+    def claim(self, worker_id:str, kinds:list[str] = None) -> dict:
+        """
+        Lease the oldest available job (queued, or leased by a worker whose lease expired)
+
+        args:
+        - worker_id: id of the worker
+        - kinds: job types the worker accepts, all if None
+
+        return:
+        - Dictionary with "id", "kind", "payload" and "attempts", None if there is nothing to do
+        """
+        now = time.time()
+        kind_filter = ''
+        params = [now]
+        if kinds:
+            kind_filter = f' AND kind IN ({", ".join("?" for _ in kinds)})'
+            params += list(kinds)
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose last lease expired too many times are poison, stop handing them out
+            self.conn.execute("UPDATE jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                              "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                              (now, now, self.max_attempts))
+            row = self.conn.execute("SELECT id, kind, payload, attempts FROM jobs "
+                                    "WHERE (status = 'queued' OR (status = 'leased' AND lease_expires < ?))"
+                                    f"{kind_filter} ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                self.conn.execute('COMMIT')
+                return None
+            self.conn.execute("UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                              "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                              (worker_id, now + self.visibility_timeout, now, row[0]))
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def extend(self, job_ids:list[int], worker_id:str) -> None:
+        """Extend the leases a worker still holds"""
+        expires = time.time() + self.visibility_timeout
+        self.conn.executemany("UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+                              [(expires, job_id, worker_id) for job_id in job_ids])
+
+    def complete(self, job_ids:list[int], worker_id:str, results:list[dict] = None) -> None:
+        """
+        Mark jobs as done
+
+        args:
+        - job_ids: ids of the finished jobs
+        - worker_id: id of the worker holding the leases
+        - results: optional result per job
+
+        return:
+        - None
+        """
+        results = results or [None] * len(job_ids)
+        now = time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany("UPDATE jobs SET status = 'done', result = ?, lease_expires = NULL, updated_at = ? "
+                              "WHERE id = ? AND lease_owner = ?",
+                              [(json.dumps(result), now, job_id, worker_id) for job_id, result in zip(job_ids, results)])
+        self.conn.execute('COMMIT')
+
+    def fail(self, job_id:int, worker_id:str, error:str) -> None:
+        """
+        Release a failed job: back to the queue, or failed after `max_attempts`
+
+        args:
+        - job_id: id of the job
+        - worker_id: id of the worker holding the lease
+        - error: error message
+
+        return:
+        - None
+        """
+        self.conn.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                          "error = ?, lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+                          (self.max_attempts, error, time.time(), job_id, worker_id))
+
+    def statuses(self, dedup_keys:list[str]) -> dict:
+        """
+        Status of the jobs with the given dedup keys
+
+        args:
+        - dedup_keys: dedup keys of the jobs
+
+        return:
+        - Dictionary dedup key -> status ("queued", "leased", "done" or "failed"), keys without job are left out
+        """
+        statuses = {}
+        keys = list(dict.fromkeys(dedup_keys))
+        # Chunks under the sqlite limit of bound parameters
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            statuses.update(self.conn.execute(f'SELECT dedup_key, status FROM jobs WHERE dedup_key IN ({",".join("?" * len(chunk))})',
+                                              chunk).fetchall())
+        return statuses
+
+    def pending(self) -> int:
+        """Amount of jobs queued or leased"""
+        return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Amount of jobs per kind and status"""
+        rows = self.conn.execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status').fetchall()
+        stats = {}
+        for kind, status, count in rows:
+            stats.setdefault(kind, {})[status] = count
+        return stats
+
+    def close(self) -> None:
+        """Close the queue database"""
+        self.conn.close()
@@ -0,0 +1,134 @@
+"""
+Benchmark of the monthly analytics of the notebooks.
+Compares the notebook approach (read the excel export as strings, parse dates row by row,
+recompute every rollup) with the analytics module on the parquet output, and with the
+incremental RollupStore refreshed after a new batch of comments.
+
+usage:
+    python -m benchmarks.bench_analytics [--videos 5000] [--comments 100000] [--batch 2000]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from TikTokManager.analytics import (COMMENT_DATE_FORMAT, RollupStore, approval_by_month, monthly_engagement,
+                                     monthly_scores, read_table)
+from TikTokManager.records import TABLE_SCHEMAS, CommentRecord, VideoRecord
+from TikTokManager.sinks import ParquetSink
+
+
+def make_dataset(videos:int, comments:int) -> tuple[list[VideoRecord], list[dict]]:
+    """Synthetic videos and scored comments spread over two years"""
+    start = datetime(2023, 1, 1)
+    video_rows = [VideoRecord(video_id=str(7_300_000_000_000_000_000 + i),
+                              hashtag='petro',
+                              video_timestamp=(start + timedelta(minutes=random.randint(0, 730 * 24 * 60))).isoformat(),
+                              video_diggcount=random.randint(0, 50_000),
+                              video_commentcount=random.randint(0, 2_000))
+                  for i in range(videos)]
+    comment_rows = [{**CommentRecord(video_id=video_rows[i % videos].video_id,
+                                     text='comentario',
+                                     date=(start + timedelta(minutes=random.randint(0, 730 * 24 * 60))).strftime(COMMENT_DATE_FORMAT),
+                                     comment_id=str(7_400_000_000_000_000_000 + i)).as_dict(),
+                     "score": random.choice([1, 1, 2, 3, 4, 5, 5])}
+                    for i in range(comments)]
+    return video_rows, comment_rows
+
+
+def notebook(excel_path:str) -> tuple:
+    """Notebook approach: string workbook, row by row dates, full recompute"""
+    df_videos = pd.read_excel(excel_path, sheet_name='videos_data', dtype=str)
+    df_videos['video_diggcount'] = pd.to_numeric(df_videos['video_diggcount'])
+    df_videos['video_commentcount'] = pd.to_numeric(df_videos['video_commentcount'])
+    df_videos['video_timestamp'] = df_videos['video_timestamp'].apply(lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%S"))
+    engagement = df_videos.set_index('video_timestamp').groupby(pd.Grouper(freq='ME')).agg(
+        total_likes=('video_diggcount', 'sum'),
+        total_comments=('video_commentcount', 'sum'),
+        avg_likes_per_video=('video_diggcount', 'mean'),
+        avg_comments_per_video=('video_commentcount', 'mean'),
+        total_videos=('video_id', 'nunique'))
+
+    df = pd.read_excel(excel_path, sheet_name='comments_sentiment', dtype=str)
+    df['date'] = df['date'].apply(lambda x: datetime.strptime(x, COMMENT_DATE_FORMAT))
+    df['score'] = df['score'].astype(int)
+    df['month'] = df['date'].dt.to_period('M')
+    ratings = df.groupby(['month', 'score']).size().unstack(fill_value=0)
+    ratings['total'] = ratings.sum(axis=1)
+    ratings['average_rating'] = df.groupby('month')['score'].mean().round(2)
+    df['Approval'] = df['score'].apply(lambda x: 'Approved' if x >= 4 else 'Disapproved' if x <= 2 else 'Neutral')
+    approval = df.groupby(['month', 'Approval']).size().unstack(fill_value=0)
+    approval['total'] = approval.sum(axis=1)
+    for rating in ['Approved', 'Disapproved', 'Neutral']:
+        approval[f"{rating}_percent"] = (approval[rating] / approval['total'] * 100).round(2)
+    approval['rolling_avg_aproval'] = approval['Approved_percent'].rolling(window=3, center=True).mean()
+    return ratings, approval, engagement
+
+
+def columnar(path:str) -> tuple:
+    """Analytics module on the parquet output"""
+    comments = read_table(path, 'comments_sentiment')
+    return (monthly_scores(comments, date_format=COMMENT_DATE_FORMAT),
+            approval_by_month(comments, date_format=COMMENT_DATE_FORMAT),
+            monthly_engagement(read_table(path, 'videos_data')))
+
+
+def timed(function, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=100_000)
+    parser.add_argument('--batch', type=int, default=2000, help='comments of the incremental batch')
+    args = parser.parse_args()
+
+    random.seed(0)
+    videos, comments = make_dataset(args.videos, args.comments + args.batch)
+    comments, batch = comments[:args.comments], pd.DataFrame(comments[args.comments:])
+    with tempfile.TemporaryDirectory() as folder:
+        sink_path = os.path.join(folder, 'sink')
+        schemas = {**TABLE_SCHEMAS, 'comments_sentiment': {**TABLE_SCHEMAS['comments_data'], 'score': 'int'}}
+        with ParquetSink(sink_path, batch_size=50_000, schemas=schemas) as sink:
+            sink.write('videos_data', videos)
+            sink.write('comments_sentiment', comments)
+        excel_path = os.path.join(folder, 'export.xlsx')
+        start = time.perf_counter()
+        with pd.ExcelWriter(excel_path, engine="openpyxl") as writer:
+            read_table(sink_path, 'videos_data').to_excel(writer, sheet_name='videos_data', index=False)
+            read_table(sink_path, 'comments_sentiment').to_excel(writer, sheet_name='comments_sentiment', index=False)
+        print(f"excel export written in {time.perf_counter() - start:.1f} s")
+
+        notebook_seconds, (ratings, approval, engagement) = timed(notebook, excel_path)
+        print(f"notebook   {notebook_seconds * 1000:10.1f} ms  (read_excel as strings + strptime + group-bys)")
+        columnar_seconds, (scores, approvals, engagements) = timed(columnar, sink_path)
+        print(f"columnar   {columnar_seconds * 1000:10.1f} ms  (typed parquet + vectorized group-bys)")
+        assert np.array_equal(scores['total'].to_numpy(), ratings['total'].to_numpy())
+        assert np.allclose(scores['average_rating'].to_numpy(), ratings['average_rating'].to_numpy())
+        assert np.allclose(approvals['Approved_percent'].to_numpy(), approval['Approved_percent'].to_numpy())
+        assert np.array_equal(engagements['total_likes'].to_numpy(), engagement['total_likes'].to_numpy())
+
+        rollups = RollupStore(os.path.join(folder, 'rollups.sqlite'))
+        rollups.add_videos(read_table(sink_path, 'videos_data'))
+        rollups.add_scores(read_table(sink_path, 'comments_sentiment'), id_column='comment_id', date_format=COMMENT_DATE_FORMAT)
+
+        def refresh():
+            rollups.add_scores(batch, id_column='comment_id', date_format=COMMENT_DATE_FORMAT)
+            return rollups.scores(), rollups.approval(), rollups.engagement()
+
+        refresh_seconds, (scores, approvals, _) = timed(refresh)
+        print(f"rollups    {refresh_seconds * 1000:10.1f} ms  (new batch of {len(batch)} comments + dashboard read)")
+        assert scores['total'].sum() == args.comments + len(batch)
+        rollups.close()
+
+
+if __name__ == '__main__':
+    main()
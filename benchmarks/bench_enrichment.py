@@ -0,0 +1,93 @@
+"""
+Throughput benchmark of the LLM comment scoring against the offline chat completions stand-in.
+Compares the notebook approach (one blocking `parse` call per row with a fixed sleep) with
+LLMEnricher (concurrent requests under the rate limits, short comments packed per request).
+
+usage:
+    python -m benchmarks.bench_enrichment [--comments 5000] [--baseline-comments 50] [--latency 0.5]
+                                          [--rpm 600] [--concurrency 32] [--pack-size 20]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from openai import OpenAI
+
+from benchmarks.llm_server import LLMServer
+from TikTokManager.enrichment import CommentResponseFormat, LLMEnricher, load_results
+
+SYSTEM_PROMPT = ("I'm analyzing videos related to Bogotá's mayor and the video is about {topic}, based in the comment "
+                 "give me the sentiment in a scale of 1-5.")
+WORDS = "alcalde bogota metro seguridad bien mal gracias nunca siempre ciudad gobierno 👏 🙏 jaja".split()
+
+
+def make_comments(amount:int, videos:int = 50) -> list[dict]:
+    """Synthetic comment rows, mostly short like the real ones"""
+    rows = []
+    for i in range(amount):
+        length = random.choice([3, 5, 8, 12, 20, 60])
+        video = i % videos
+        rows.append({"comment_id": str(7_400_000_000_000_000_000 + i),
+                     "video_id": str(7_300_000_000_000_000_000 + video),
+                     "topic": random.choice(["['Mobility']", "['Security']", "['Economy']"]),
+                     "text": ' '.join(random.choices(WORDS, k=length))})
+    return rows
+
+
+def baseline(base_url:str, rows:list[dict], sleep:float) -> float:
+    """Notebook approach: one blocking structured output call per comment, returns seconds per comment"""
+    client = OpenAI(api_key='bench', base_url=base_url)
+    start = time.perf_counter()
+    for row in rows:
+        time.sleep(sleep)
+        client.beta.chat.completions.parse(model="stand-in",
+                                           messages=[{"role": "system", "content": SYSTEM_PROMPT.format_map(row)},
+                                                     {"role": "user", "content": f"comment:{row['text']}"}],
+                                           response_format=CommentResponseFormat,
+                                           temperature=0.5)
+    return (time.perf_counter() - start) / len(rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--baseline-comments', type=int, default=50, help='comments run with the notebook approach')
+    parser.add_argument('--sleep', type=float, default=0.2, help='fixed sleep of the notebook approach')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per completion of the stand-in')
+    parser.add_argument('--rpm', type=int, default=600, help='requests/min of the stand-in and of the enricher')
+    parser.add_argument('--tpm', type=int, default=1_000_000, help='tokens/min of the enricher')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--pack-size', type=int, default=20)
+    args = parser.parse_args()
+
+    server = LLMServer(latency=args.latency, rpm=args.rpm).start()
+    rows = make_comments(args.comments)
+
+    per_comment = baseline(server.url, rows[:args.baseline_comments], args.sleep)
+    print(f"notebook   {1 / per_comment:9.2f} comments/s  "
+          f"({args.comments * per_comment / 60:.1f} min for {args.comments} comments, extrapolated)")
+
+    enricher = LLMEnricher(model='stand-in',
+                           api_key='bench',
+                           base_url=server.url,
+                           concurrency=args.concurrency,
+                           requests_per_minute=args.rpm,
+                           tokens_per_minute=args.tpm,
+                           reasoning_effort=None)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'comments.jsonl')
+        start = time.perf_counter()
+        asyncio.run(enricher.analyze_comments(rows, SYSTEM_PROMPT, path, pack_size=args.pack_size))
+        elapsed = time.perf_counter() - start
+        results = load_results(path)
+    print(f"enricher   {len(results) / elapsed:9.2f} comments/s  ({elapsed / 60:.1f} min for {len(results)} comments, "
+          f"{enricher.counters['requests']} requests, {enricher.counters['retries']} retries)")
+    print(f"server     {server.stats()}")
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
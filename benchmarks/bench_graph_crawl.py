@@ -0,0 +1,104 @@
+"""
+Benchmark of the related-video graph crawl on a synthetic graph, no network involved.
+Videos belong to communities, one of them is the topic of the crawl (its videos carry the
+seed hashtags) and the related list of a video mostly points inside its community, towards
+popular videos. With the same request budget it compares:
+- repeated one-hop: every related video is queued again, as chaining get_video_urls_v2
+  (`ent_type='video_related'`) does, so popular videos are requested many times
+- breadth-first and best-first GraphFrontier crawls (visited index, depth limit)
+and reports the repeated requests, the distinct videos and the topic videos found per request.
+
+usage:
+    python -m benchmarks.bench_graph_crawl [--videos 200000] [--communities 20] [--requests 1000]
+"""
+import argparse
+import random
+from collections import deque
+
+import numpy as np
+
+from TikTokManager.graph_crawl import GraphFrontier
+
+TOPIC_HASHTAGS = ['gustavopetro', 'petropresidente']
+OTHER_HASHTAGS = ['futbol', 'cocina', 'baile', 'humor', 'musica', 'viajes']
+RELATED_PER_REQUEST = 16
+
+
+class SyntheticGraph():
+    """Videos in communities, related lists sampled towards popular videos of the same community"""
+    def __init__(self, videos:int, communities:int, stay:float = 0.8, seed:int = 0) -> None:
+        self.rng = np.random.default_rng(seed)
+        self.community = self.rng.integers(0, communities, videos)
+        self.plays = self.rng.lognormal(9, 2, videos).astype(np.int64)
+        self.stay = stay
+        self.members = [np.flatnonzero(self.community == community) for community in range(communities)]
+        # Popular videos are related more often
+        self.weights = [self.plays[members] / self.plays[members].sum() for members in self.members]
+        self.requests = 0
+        self.expanded = set()
+
+    def item(self, video:int) -> dict:
+        hashtags = TOPIC_HASHTAGS if self.community[video] == 0 else random.sample(OTHER_HASHTAGS, 2)
+        return {'id': str(video),
+                'author': {'uniqueId': f'user{video % 1000}'},
+                'stats': {'playCount': int(self.plays[video])},
+                'challenges': [{'title': hashtag} for hashtag in hashtags]}
+
+    def related(self, video:int) -> list[dict]:
+        """One related-video request"""
+        self.requests += 1
+        community = self.community[video]
+        if self.rng.random() > self.stay:
+            community = self.rng.integers(0, len(self.members))
+        picks = self.rng.choice(self.members[community], RELATED_PER_REQUEST, p=self.weights[community])
+        return [self.item(int(pick)) for pick in picks]
+
+
+def repeated_one_hop(graph:SyntheticGraph, seeds:list[int], budget:int) -> set[int]:
+    queue = deque(seeds)
+    found = set(seeds)
+    while queue and graph.requests < budget:
+        video = queue.popleft()
+        graph.expanded.add(video)
+        for item in graph.related(video):
+            found.add(int(item['id']))
+            queue.append(int(item['id']))
+    return found
+
+
+def frontier_crawl(graph:SyntheticGraph, seeds:list[int], budget:int, order:str, max_depth:int) -> set[int]:
+    frontier = GraphFrontier(order, max_depth, TOPIC_HASHTAGS)
+    for seed in seeds:
+        frontier.add(str(seed), None, 0, 0.0)
+    while len(frontier) and graph.requests < budget:
+        video_id, _, depth = frontier.pop()
+        graph.expanded.add(int(video_id))
+        for item in graph.related(int(video_id)):
+            frontier.add(item['id'], None, depth + 1, frontier.priority(item, depth + 1))
+    # Numeric ids are their own visited keys
+    return set(frontier.visited)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=200_000)
+    parser.add_argument('--communities', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=1000, help='related-video requests of every crawl')
+    parser.add_argument('--max-depth', type=int, default=4)
+    args = parser.parse_args()
+
+    crawls = {'repeated one-hop': lambda graph, seeds: repeated_one_hop(graph, seeds, args.requests),
+              'breadth-first': lambda graph, seeds: frontier_crawl(graph, seeds, args.requests, 'breadth', args.max_depth),
+              'best-first': lambda graph, seeds: frontier_crawl(graph, seeds, args.requests, 'best', args.max_depth)}
+    for name, crawl in crawls.items():
+        random.seed(0)
+        graph = SyntheticGraph(args.videos, args.communities)
+        seeds = [int(video) for video in graph.members[0][:10]]
+        found = crawl(graph, seeds)
+        topic = sum(1 for video in found if graph.community[video] == 0)
+        print(f"{name:18s} {graph.requests:5d} requests ({graph.requests - len(graph.expanded):4d} repeated)  "
+              f"{len(found):6d} videos  {topic:5d} topic videos ({topic / graph.requests:.2f} per request)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark of the adaptive pacing against the fixed random sleeps it replaces, without TikTok.
+A simulated endpoint serves a limited amount of requests per second, throttles the extra
+ones (429) and answers a share of the requests with a permanent error (deleted videos).
+Workers either sleep a fixed random pause after every request and a longer one after
+errors (previous behaviour) or go through a Pacer.
+
+usage:
+    python -m benchmarks.bench_pacing [--capacity 8] [--workers 8] [--duration 60] [--deleted 0.05]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from TikTokManager.metrics import Metrics
+from TikTokManager.pacing import Pacer, PermanentError, ThrottledError
+
+
+class SimulatedEndpoint():
+    """Endpoint answering `capacity` requests per second, throttling the rest"""
+    def __init__(self, capacity:float, latency:float, deleted:float) -> None:
+        self.capacity = capacity
+        self.latency = latency
+        self.deleted = deleted
+        self.window = []
+        self.counts = {"ok": 0, "throttled": 0, "deleted": 0}
+
+    async def request(self) -> None:
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        self.window = [moment for moment in self.window if now - moment < 1]
+        if len(self.window) >= self.capacity:
+            self.counts['throttled'] += 1
+            raise ThrottledError('429 too many requests', retry_after=None)
+        self.window.append(now)
+        if random.random() < self.deleted:
+            self.counts['deleted'] += 1
+            raise PermanentError('video without itemStruct')
+        self.counts['ok'] += 1
+
+
+async def fixed_sleeps(endpoint:SimulatedEndpoint, deadline:float, pause:tuple, error_pause:tuple) -> None:
+    """Previous behaviour: random pause after every request, longer random pause and retry after errors"""
+    while time.monotonic() < deadline:
+        for _ in range(5):
+            try:
+                await endpoint.request()
+                break
+            except ThrottledError:
+                await asyncio.sleep(random.uniform(*error_pause))
+            except PermanentError:
+                await asyncio.sleep(random.uniform(*error_pause))
+        await asyncio.sleep(random.uniform(*pause))
+
+
+async def adaptive(endpoint:SimulatedEndpoint, deadline:float, pacer:Pacer) -> None:
+    """Pacer: adaptive rate, backoff with jitter, permanent errors fail fast"""
+    while time.monotonic() < deadline:
+        try:
+            await pacer.call('page_json', endpoint.request)
+        except (ThrottledError, PermanentError):
+            pass
+
+
+async def run(mode:str, args) -> dict:
+    endpoint = SimulatedEndpoint(args.capacity, args.latency, args.deleted)
+    deadline = time.monotonic() + args.duration
+    pacer = Pacer(Metrics(), {'page_json': {"rate": 1.0, "max_rate": args.capacity * 4}}, max_backoff=8)
+    if mode == 'fixed':
+        workers = [fixed_sleeps(endpoint, deadline, (1, 2), (1, 8)) for _ in range(args.workers)]
+    else:
+        workers = [adaptive(endpoint, deadline, pacer) for _ in range(args.workers)]
+    start = time.monotonic()
+    await asyncio.gather(*workers)
+    elapsed = time.monotonic() - start
+    return {**endpoint.counts, "rps": endpoint.counts['ok'] / elapsed, "limiter": pacer.stats()['page_json']}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--capacity', type=float, default=8, help='requests/s served by the endpoint')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per run')
+    parser.add_argument('--deleted', type=float, default=0.05, help='share of permanent errors')
+    args = parser.parse_args()
+
+    random.seed(0)
+    for mode in ('fixed', 'adaptive'):
+        result = asyncio.run(run(mode, args))
+        print(f"{mode:9s} {result['rps']:6.2f} ok requests/s  throttled {result['throttled']:5d}  "
+              f"deleted {result['deleted']:4d}  (capacity {args.capacity:g}/s)")
+        if mode == 'adaptive':
+            print(f"          limiter {result['limiter']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+End-to-end throughput benchmark of TikTokManager against the offline fixture server.
+- the fixture server runs in its own process, TikTok api calls made by the playwright
+  sessions are routed to it, page jsons and transcriptions are requested from it directly
+- reports videos/s, comments/s, p50/p99 latency per stage and peak RSS
+- page cache and outputs go to a temporary folder, so every run starts cold
+
+Needs the same environment as the scraper (TikTokApi with playwright browsers, pyktok).
+
+usage:
+    python -m benchmarks.bench_pipeline [--scenario pipeline|discovery|comments|transcription]
+                                        [--hashtags 2] [--videos 50] [--comments 40] [--concurrency 8]
+                                        [--latency 0.05] [--error-rate 0.01] [--throttle-rate 0.02]
+                                        [--report bench.json]
+"""
+import argparse
+import asyncio
+import functools
+import json
+import multiprocessing
+import resource
+import socket
+import tempfile
+import time
+
+import requests
+
+from benchmarks.fixture_server import FixtureServer, FixtureStore, load_templates
+from TikTokManager.sinks import open_sink
+from TikTokManager.tiktokmanager import TikTokManager
+
+TIKTOK_URL = 'https://www.tiktok.com'
+
+
+def serve(port:int, store_options:dict, server_options:dict) -> None:
+    """Entry point of the fixture server process"""
+    fixtures = store_options.pop('fixtures', None)
+    templates = load_templates(fixtures) if fixtures else None
+    server = FixtureServer(port=port, store=FixtureStore(templates=templates, **store_options), **server_options)
+    server.serve_forever()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values:list[float], q:float) -> float:
+    """Nearest-rank percentile, None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def route_to(server_url:str):
+    """
+    Build a SessionPool `on_open` hook that answers the TikTok requests of the
+    playwright sessions from the fixture server
+
+    args:
+    - server_url: url of the fixture server
+
+    return:
+    - Coroutine function receiving a TikTokApi instance
+    """
+    http = requests.Session()
+
+    async def handle(route):
+        request = route.request
+        if request.method == 'OPTIONS':
+            await route.fulfill(status=204, headers={'Access-Control-Allow-Origin': '*',
+                                                     'Access-Control-Allow-Headers': '*',
+                                                     'Access-Control-Allow-Methods': 'GET'})
+            return
+        response = await asyncio.to_thread(http.get, request.url.replace(TIKTOK_URL, server_url, 1), timeout=30)
+        await route.fulfill(status=response.status_code,
+                            headers={'Access-Control-Allow-Origin': '*',
+                                     'Content-Type': response.headers.get('Content-Type', 'application/json')},
+                            body=response.content)
+
+    async def on_open(api) -> None:
+        for session in api.sessions:
+            await session.context.route(f'{TIKTOK_URL}/**', handle)
+
+    return on_open
+
+
+class StageTimer():
+    """Wall time of every call of the instrumented stages"""
+    def __init__(self) -> None:
+        self.samples = {}
+
+    def wrap(self, stage:str, func):
+        samples = self.samples.setdefault(stage, [])
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    samples.append(time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return timed
+
+    def report(self) -> dict:
+        return {stage: {"calls": len(values),
+                        "p50_ms": round(percentile(values, 50) * 1000, 2) if values else None,
+                        "p99_ms": round(percentile(values, 99) * 1000, 2) if values else None}
+                for stage, values in self.samples.items()}
+
+
+def run_scenario(tkm:TikTokManager, args:argparse.Namespace, store:FixtureStore) -> dict:
+    """Run one scenario and return the amount of videos and comments produced"""
+    hashtags = [f'bench{i}' for i in range(args.hashtags)]
+    if args.scenario == 'pipeline':
+        result = tkm.extract_videos_data_v2(hashtags,
+                                            args.videos,
+                                            args.comments,
+                                            concurrency=args.concurrency,
+                                            output_format=args.output_format,
+                                            export_excel=False)
+        sink = open_sink(args.output_format, result["sink_path"])
+        counts = {"videos": sink.offsets.get('videos_data', 0), "comments": sink.offsets.get('comments_data', 0)}
+        sink.close()
+        return counts
+    if args.scenario == 'discovery':
+        urls = []
+        for hashtag in hashtags:
+            urls += tkm._run(tkm.get_video_urls_v2(tt_ent=hashtag, ent_type="hashtag", video_ct=args.videos))
+        return {"videos": len(urls), "comments": 0}
+
+    video_ids = [store.video_id(hashtag, i) for hashtag in hashtags for i in range(args.videos)]
+    if args.scenario == 'comments':
+        async def comments():
+            limit = asyncio.Semaphore(args.concurrency)
+
+            async def one(video_id):
+                async with limit:
+                    return await tkm.get_comments(video_id, args.comments)
+            return await asyncio.gather(*(one(video_id) for video_id in video_ids))
+        return {"videos": len(video_ids), "comments": sum(len(c) for c in tkm._run(comments()))}
+    if args.scenario == 'transcription':
+        tkm.get_video_transcription(video_ids, json_concurrency=args.concurrency)
+        return {"videos": len(video_ids), "comments": 0}
+    raise ValueError('Only allowed `scenario` values are "pipeline", "discovery", "comments" or "transcription".')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', default='pipeline', choices=['pipeline', 'discovery', 'comments', 'transcription'])
+    parser.add_argument('--hashtags', type=int, default=2)
+    parser.add_argument('--videos', type=int, default=50, help='videos per hashtag')
+    parser.add_argument('--comments', type=int, default=40, help='comments per video')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--output-format', default='parquet', choices=['parquet', 'sqlite', 'jsonl'])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--cues', type=int, default=120)
+    parser.add_argument('--fixtures', default=None, help='folder of page jsons or page cache sqlite to replay')
+    parser.add_argument('--report', default=None, help='path of the json report')
+    args = parser.parse_args()
+
+    store_options = {"videos_per_hashtag": max(args.videos * 2, 100),
+                     "comments_per_video": max(args.comments * 2, 20),
+                     "cues": args.cues}
+    server_options = {"latency": args.latency,
+                      "jitter": args.jitter,
+                      "error_rate": args.error_rate,
+                      "throttle_rate": args.throttle_rate}
+    port = free_port()
+    server_url = f'http://127.0.0.1:{port}'
+    server = multiprocessing.Process(target=serve,
+                                     args=(port, {**store_options, "fixtures": args.fixtures}, server_options),
+                                     daemon=True)
+    server.start()
+    for _ in range(100):
+        try:
+            requests.get(f'{server_url}/__stats', timeout=1)
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as folder:
+        tkm = TikTokManager(f'{folder}/output',
+                            f'{folder}/temp',
+                            pool_size=args.pool_size,
+                            base_url=server_url,
+                            pool_options={"starting_url": f'{server_url}/',
+                                          "sleep_after": 0,
+                                          "on_open": route_to(server_url)})
+        tkm.get_tiktok_json = timer.wrap('json', tkm.get_tiktok_json)
+        tkm.transcription_fetcher.fetch = timer.wrap('transcription', tkm.transcription_fetcher.fetch)
+        tkm.get_comments = timer.wrap('comments', tkm.get_comments)
+        tkm.get_video_urls_v2 = timer.wrap('discovery', tkm.get_video_urls_v2)
+        start = time.perf_counter()
+        try:
+            counts = run_scenario(tkm, args, FixtureStore(**store_options))
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics = tkm.metrics.report()
+            tkm.close()
+
+    server_stats = requests.get(f'{server_url}/__stats', timeout=5).json()
+    server.terminate()
+    server.join()
+    report = {"scenario": args.scenario,
+              "elapsed_s": round(elapsed, 3),
+              "videos": counts["videos"],
+              "comments": counts["comments"],
+              "videos_per_s": round(counts["videos"] / elapsed, 3),
+              "comments_per_s": round(counts["comments"] / elapsed, 3),
+              "stages": timer.report(),
+              # ru_maxrss is in KiB on Linux; children covers the browsers and the fixture server
+              "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+              "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+              "server_responses": server_stats,
+              "metrics": metrics,
+              "options": vars(args)}
+
+    print(f"\n{args.scenario}: {counts['videos']} videos, {counts['comments']} comments in {elapsed:.2f} s "
+          f"({report['videos_per_s']} videos/s, {report['comments_per_s']} comments/s)")
+    for stage, values in report["stages"].items():
+        print(f"  {stage:<14} calls {values['calls']:>6}  p50 {values['p50_ms']} ms  p99 {values['p99_ms']} ms")
+    print(f"  peak RSS {report['peak_rss_mb']} MiB (children {report['children_peak_rss_mb']} MiB)")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
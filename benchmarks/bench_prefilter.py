@@ -0,0 +1,118 @@
+"""
+Benchmark of the analysis prefilter on synthetic comments.
+Compares the notebook filter (exact `drop_duplicates` on the text, row by row `is_emoji_only`
+with `emoji.replace_emoji`) with `prefilter` (vectorized normalization, MinHash / LSH
+clusters): seconds and amount of comments that would reach the LLM. Campaign comments are
+copies of a few templates with small edits (typos, emojis, mentions, punctuation, case),
+so the clusters found can be checked against the template of every comment.
+
+usage:
+    python -m benchmarks.bench_prefilter [--comments 300000] [--templates 500] [--campaign 0.4]
+                                         [--threshold 0.7] [--shingle-size 4]
+"""
+import argparse
+import random
+import string
+import time
+
+import emoji
+import pandas as pd
+
+from benchmarks.tiny_sentiment_model import WORDS
+from TikTokManager.prefilter import MinHashLSH, prefilter
+
+EMOJIS = ['😀', '😂', '❤️', '🇨🇴', '👏', '🔥', '😡', '🙏']
+
+
+def edit(text:str) -> str:
+    """Small edits of a copy-pasted comment"""
+    characters = list(text)
+    for _ in range(random.randint(0, 2)):
+        position = random.randrange(len(characters))
+        characters[position] = random.choice(string.ascii_lowercase)
+    text = ''.join(characters)
+    if random.random() < 0.5:
+        text = text.upper() if random.random() < 0.2 else text.capitalize()
+    if random.random() < 0.5:
+        text += ' ' + ''.join(random.choices(EMOJIS, k=random.randint(1, 3)))
+    if random.random() < 0.3:
+        text = f'@user{random.randint(1, 10_000)} ' + text
+    if random.random() < 0.3:
+        text += random.choice(['!!', '...', ' !!!', '?'])
+    return text
+
+
+def make_comments(amount:int, templates:int, campaign:float) -> pd.DataFrame:
+    """Synthetic comments: campaign copies, distinct comments, emoji-only and empty ones"""
+    template_texts = [' '.join(random.choices(WORDS, k=random.randint(6, 25))) for _ in range(templates)]
+    rows = []
+    for i in range(amount):
+        roll = random.random()
+        if roll < campaign:
+            template = random.randrange(templates)
+            rows.append((str(i), edit(template_texts[template]), template))
+        elif roll < campaign + 0.05:
+            rows.append((str(i), ''.join(random.choices(EMOJIS, k=random.randint(1, 4))), -1))
+        elif roll < campaign + 0.06:
+            rows.append((str(i), '', -1))
+        else:
+            words = random.choices(WORDS, k=random.randint(3, 30))
+            # A made up word keeps two distinct comments from being equal by chance
+            words.insert(random.randrange(len(words) + 1), ''.join(random.choices(string.ascii_lowercase, k=6)))
+            rows.append((str(i), ' '.join(words), -2 - i))
+    return pd.DataFrame(rows, columns=['comment_id', 'text', 'template'])
+
+
+def is_emoji_only(text:str) -> bool:
+    """Notebook helper"""
+    if not isinstance(text, str):
+        return False
+    text_no_emojis = emoji.replace_emoji(text, replace='')
+    return len(text_no_emojis.strip()) == 0 and len(text) > 0
+
+
+def notebook(df:pd.DataFrame) -> pd.DataFrame:
+    df_comments = df.drop_duplicates(subset=['text']).dropna()
+    df_comments = df_comments.dropna(subset=['text'], how='all')
+    mask = (df_comments['text'].apply(is_emoji_only)) | (df_comments['text'].isna() | df_comments['text'].eq(''))
+    return df_comments[~mask]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=300_000)
+    parser.add_argument('--templates', type=int, default=500, help='campaign comments copied with small edits')
+    parser.add_argument('--campaign', type=float, default=0.4, help='share of campaign comments')
+    parser.add_argument('--threshold', type=float, default=0.7)
+    parser.add_argument('--shingle-size', type=int, default=4)
+    args = parser.parse_args()
+
+    random.seed(0)
+    df = make_comments(args.comments, args.templates, args.campaign)
+
+    start = time.perf_counter()
+    kept = notebook(df)
+    notebook_seconds = time.perf_counter() - start
+    print(f"notebook   {notebook_seconds:7.2f} s  {len(kept):8d} comments to analyse")
+
+    start = time.perf_counter()
+    filtered = prefilter(df, threshold=args.threshold, lsh=MinHashLSH(args.threshold, args.shingle_size))
+    prefilter_seconds = time.perf_counter() - start
+    representatives = filtered[filtered['representative']]
+    print(f"prefilter  {prefilter_seconds:7.2f} s  {len(representatives):8d} comments to analyse "
+          f"({1 - len(representatives) / len(kept):.0%} fewer LLM items)")
+
+    clustered = filtered[filtered['cluster'] >= 0]
+    representative_template = df['template'].to_numpy()[clustered['cluster'].to_numpy()]
+    wrong = (representative_template != clustered['template'].to_numpy()).sum()
+    campaign = clustered[clustered['template'] >= 0]
+    # Copies of a template found in its largest cluster, the rest are analysed again
+    main_cluster = campaign.groupby(['template', 'cluster']).size().groupby(level='template').max().sum()
+    print(f"clusters   {wrong} comment(s) merged with a different comment, "
+          f"{main_cluster / len(campaign):.1%} of the campaign copies in the main cluster of their template")
+    dropped = filtered['cluster'] < 0
+    print(f"dropped    {dropped.sum()} empty / emoji-only comment(s), expected {(df['template'] == -1).sum()}")
+
+
+if __name__ == '__main__':
+    main()
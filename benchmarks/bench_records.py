@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the video row extraction.
+Compares the legacy path (decode the whole rehydration json, build a dict with
+repeated lookups, one DataFrame per video) with the targeted extraction
+(decode only `webapp.video-detail`, slotted records, one column batch).
+
+usage:
+    python -m benchmarks.bench_records [--videos 200] [--extra-kib 300]
+"""
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.fixture_server import FixtureStore
+from TikTokManager.records import TABLE_SCHEMAS, VideoRecord, extract_video_detail, to_columns
+
+SCRIPT_RE = re.compile(r'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">(.*?)</script>', re.S)
+
+
+def make_page(store:FixtureStore, video_id:str, extra_kib:int) -> str:
+    """Video page with other rehydration scopes around the video detail, like the real ones"""
+    page = store.page(video_id, 'http://127.0.0.1')
+    payload = json.loads(SCRIPT_RE.search(page).group(1))
+    filler = [{"key": f"abtest_{i}", "value": "x" * 80} for i in range(extra_kib * 1024 // 100)]
+    scope = {"webapp.app-context": {"user": {}, "abTestVersion": filler[:len(filler) // 2]},
+             **payload["__DEFAULT_SCOPE__"],
+             "seo.abtest": {"vidList": filler[len(filler) // 2:]}}
+    return SCRIPT_RE.sub(lambda _: '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+                                   f'{json.dumps({"__DEFAULT_SCOPE__": scope})}</script>', page)
+
+
+def legacy_rows(pages:list[str]) -> pd.DataFrame:
+    """Row building used before the record types"""
+    frames = []
+    for page in pages:
+        tiktok_json = json.loads(SCRIPT_RE.search(page).group(1))
+        data_slot = tiktok_json["__DEFAULT_SCOPE__"]['webapp.video-detail']['itemInfo']['itemStruct']
+        row_dict = {'video_id': data_slot['id'],
+                    'hashtag': 'bench',
+                    'video_timestamp': datetime.fromtimestamp(int(data_slot.get('createTime'))).isoformat(),
+                    'video_locationcreated': data_slot.get('locationCreated'),
+                    'video_diggcount': data_slot.get('stats').get('diggCount'),
+                    'video_sharecount': data_slot.get('stats').get('shareCount'),
+                    'video_commentcount': data_slot.get('stats').get('commentCount'),
+                    'video_playcount': data_slot.get('stats').get('playCount'),
+                    'video_description': data_slot.get('desc'),
+                    'video_is_ad': data_slot.get('isAd'),
+                    'author_username': data_slot.get('author').get('uniqueId'),
+                    'author_name': data_slot.get('author').get('nickname'),
+                    'author_followercount': data_slot.get('authorStats').get('followerCount'),
+                    'author_heartcount': data_slot.get('authorStats').get('heartCount'),
+                    'author_videocount': data_slot.get('authorStats').get('videoCount'),
+                    'author_diggcount': data_slot.get('authorStats').get('diggCount'),
+                    'author_verified': data_slot.get('author').get('verified'),
+                    'mining_date': 'bench'}
+        frames.append(pd.DataFrame([row_dict]))
+    return pd.concat(frames, ignore_index=True)
+
+
+def record_rows(pages:list[str]) -> pd.DataFrame:
+    """Targeted extraction into records, converted once per batch"""
+    records = []
+    for page in pages:
+        item = extract_video_detail(page)["__DEFAULT_SCOPE__"]['webapp.video-detail']['itemInfo']['itemStruct']
+        records.append(VideoRecord.from_item(item, 'bench', 'bench')[0])
+    return pd.DataFrame(to_columns(records, TABLE_SCHEMAS['videos_data']))
+
+
+def measure(name:str, func, videos:int) -> None:
+    start = time.perf_counter()
+    output = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed / videos * 1000:9.3f} ms/video   peak {peak / 1024:9.1f} KiB   rows {len(output)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=200)
+    parser.add_argument('--extra-kib', type=int, default=300, help='size of the other rehydration scopes per page')
+    args = parser.parse_args()
+
+    store = FixtureStore()
+    pages = [make_page(store, store.video_id('bench', i), args.extra_kib) for i in range(args.videos)]
+    print(f"pages: {args.videos}, {sum(len(p) for p in pages) / args.videos / 1024:.1f} KiB each")
+    measure('legacy', lambda: legacy_rows(pages), args.videos)
+    measure('records', lambda: record_rows(pages), args.videos)
+
+
+if __name__ == "__main__":
+    main()
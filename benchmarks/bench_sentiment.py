@@ -0,0 +1,93 @@
+"""
+Throughput benchmark of the comment sentiment classification on the tiny offline model.
+Compares the notebook approach (one pipeline call per row, DataFrame partitions on a
+ThreadPoolExecutor) with SentimentEngine (distinct texts, length bucketed batched forward passes).
+
+usage:
+    python -m benchmarks.bench_sentiment [--comments 5000] [--baseline-comments 1000] [--partitions 4]
+                                         [--batch-size 32] [--threads 4] [--model temp/model]
+"""
+import argparse
+import math
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+import torch
+from transformers import pipeline
+
+from benchmarks.tiny_sentiment_model import WORDS, build_tiny_model
+from TikTokManager.sentiment import SentimentEngine
+
+
+def make_comments(amount:int, videos:int = 50, repeated:float = 0.2) -> pd.DataFrame:
+    """Synthetic comments sheet, mostly short comments and a share of repeated ones like the real ones"""
+    rows = []
+    for i in range(amount):
+        if rows and random.random() < repeated:
+            text = random.choice(rows)['text']
+        else:
+            text = ' '.join(random.choices(WORDS, k=random.choice([2, 4, 6, 10, 20, 40, 120])))
+        rows.append({"text": text,
+                     "date": f"{random.randint(1, 28):02d}-{random.randint(1, 12):02d}-2024 12:00",
+                     "video_id": str(7_300_000_000_000_000_000 + i % videos)})
+    return pd.DataFrame(rows)
+
+
+def baseline(model:str, df:pd.DataFrame, partitions:int) -> float:
+    """Notebook approach, returns seconds per comment"""
+    sentiment_analyzer = pipeline("sentiment-analysis", model=model)
+
+    def classify_feeling_comments(row) -> dict:
+        try:
+            result = sentiment_analyzer(row['text'])
+        except Exception:
+            return {'score': None, 'clasification': '#ERROR', 'percentage': None, 'date': None, 'video_id': row['video_id']}
+        label = result[0]['label']
+        return {'score': int(label[0]), 'clasification': label, 'percentage': result[0]['score'],
+                'date': datetime.strptime(row['date'], "%d-%m-%Y %H:%M"), 'video_id': row['video_id']}
+
+    partition_size = math.ceil(len(df) / partitions)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=partitions) as executor:
+        futures = [executor.submit(lambda part: part.apply(classify_feeling_comments, axis=1),
+                                   df.iloc[i:i + partition_size]) for i in range(0, len(df), partition_size)]
+        pd.json_normalize(pd.concat([future.result() for future in futures]))
+    return (time.perf_counter() - start) / len(df)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--baseline-comments', type=int, default=1000, help='comments run with the notebook approach')
+    parser.add_argument('--partitions', type=int, default=4, help='threads of the notebook approach')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=None, help='torch threads of the engine')
+    parser.add_argument('--model', default=None, help='model to use instead of the tiny random one')
+    args = parser.parse_args()
+
+    random.seed(0)
+    df = make_comments(args.comments)
+    # The notebook drops exact duplicates before classifying
+    df = df.drop_duplicates(subset=['text']).dropna()
+    with tempfile.TemporaryDirectory() as folder:
+        model = args.model or build_tiny_model(folder)
+
+        per_comment = baseline(model, df.iloc[:args.baseline_comments], args.partitions)
+        print(f"notebook   {1 / per_comment:9.2f} comments/s  "
+              f"({len(df) * per_comment / 60:.1f} min for {len(df)} comments, extrapolated)")
+
+        engine = SentimentEngine(model, batch_size=args.batch_size, threads=args.threads)
+        start = time.perf_counter()
+        result = engine.classify_comments(df)
+        elapsed = time.perf_counter() - start
+    print(f"engine     {len(result) / elapsed:9.2f} comments/s  ({elapsed / 60:.1f} min for {len(result)} comments, "
+          f"{engine.counters['batches']} batches, {torch.get_num_threads()} threads)")
+    print(result['clasification'].value_counts().to_dict())
+
+
+if __name__ == '__main__':
+    main()
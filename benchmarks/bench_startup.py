@@ -0,0 +1,55 @@
+"""
+Startup benchmark of the command line jobs.
+Every case runs in a fresh interpreter, so it measures what a cron job pays before its
+first request: the interpreter itself, the imports and the TikTokManager setup. The
+"eager" case imports the dependencies the manager used to load up front (pandas,
+openpyxl, pyktok and TikTokApi / playwright) and reads the firefox cookies.
+
+usage:
+    python -m benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = {'interpreter': 'pass',
+         'cli --help': 'import sys; sys.argv = ["TikTokManager", "--help"]\n'
+                       'from TikTokManager.cli import main\n'
+                       'try:\n    main()\nexcept SystemExit:\n    pass',
+         'transcribe / comments setup': 'from TikTokManager.tiktokmanager import TikTokManager\n'
+                                        'TikTokManager("{folder}/output", "{folder}/temp").close()',
+         'export setup': 'from TikTokManager.sinks import SINKS\nimport pandas',
+         'eager': 'import pandas, openpyxl, pyktok, TikTokApi\npyktok.specify_browser("firefox")\n'
+                  'from TikTokManager.tiktokmanager import TikTokManager\n'
+                  'TikTokManager("{folder}/output", "{folder}/temp").close()'}
+
+
+def measure(code:str, runs:int) -> float:
+    """Median seconds of a fresh interpreter running `code`, None if it fails"""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr.strip().splitlines()[-1])
+            return None
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for case, code in CASES.items():
+            seconds = measure(code.replace('{folder}', folder), args.runs)
+            print(f"{case:28s} " + (f"{seconds * 1000:8.1f} ms" if seconds is not None else "     failed"))
+
+
+if __name__ == '__main__':
+    main()
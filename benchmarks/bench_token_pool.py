@@ -0,0 +1,104 @@
+"""
+Scaling benchmark of the SessionPool with several ms_tokens, without browsers.
+Every simulated token serves a limited amount of requests per second and answers the
+extra ones with an empty response (the way TikTok throttles a token), optionally one
+token is always throttled. Throughput should grow with the amount of healthy tokens.
+
+usage:
+    python -m benchmarks.bench_token_pool [--tokens 1 2 4 8] [--token-rps 10] [--latency 0.02]
+                                          [--duration 10] [--bad-tokens 1] [--strategy least_loaded]
+"""
+import argparse
+import asyncio
+import time
+
+from TikTokApi.exceptions import EmptyResponseException
+
+from TikTokManager.session_pool import SessionPool
+
+
+class SimulatedApi():
+    """Stand-in of a TikTokApi session of one ms_token with a requests/second limit"""
+    def __init__(self, ms_token:str, rps:float, latency:float, bad:bool) -> None:
+        self.ms_token = ms_token
+        self.rps = rps
+        self.latency = latency
+        self.bad = bad
+        self.window = []
+
+    async def request(self) -> None:
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        self.window = [moment for moment in self.window if now - moment < 1]
+        if self.bad or len(self.window) >= self.rps:
+            raise EmptyResponseException(None, 'TikTok returned an empty response')
+        self.window.append(now)
+
+
+class SimulatedPool(SessionPool):
+    """SessionPool opening SimulatedApi instances instead of browsers"""
+    def __init__(self, ms_tokens:list[str], rps:float, latency:float, bad_tokens:int, **options) -> None:
+        super().__init__(ms_tokens, size=len(ms_tokens), **options)
+        self.rps = rps
+        self.latency = latency
+        self.bad_tokens = set(ms_tokens[:bad_tokens])
+        # The limits belong to the token, they survive session recycles
+        self.apis = {}
+
+    async def _open(self, slot) -> None:
+        if slot.ms_token not in self.apis:
+            self.apis[slot.ms_token] = SimulatedApi(slot.ms_token, self.rps, self.latency, slot.ms_token in self.bad_tokens)
+        slot.api = self.apis[slot.ms_token]
+        slot.failures = 0
+
+    async def _shutdown(self, api) -> None:
+        pass
+
+    async def is_healthy(self, slot) -> bool:
+        return slot.api is not None
+
+
+async def run(tokens:int, args) -> dict:
+    """Requests served per second by `tokens` tokens with two workers per token"""
+    pool = SimulatedPool([f'token-{i}' for i in range(tokens)], args.token_rps, args.latency,
+                         min(args.bad_tokens, tokens - 1), strategy=args.strategy,
+                         throttle_cooldown=args.cooldown, max_cooldown=args.cooldown * 8)
+    counts = {"ok": 0, "throttled": 0}
+    deadline = time.monotonic() + args.duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            try:
+                async with pool.lease() as api:
+                    await api.request()
+                counts['ok'] += 1
+            except EmptyResponseException:
+                counts['throttled'] += 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(tokens * 2)))
+    elapsed = time.monotonic() - start
+    return {"tokens": tokens, "rps": counts['ok'] / elapsed, "throttled": counts['throttled'],
+            "per_token": pool.token_stats()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--token-rps', type=float, default=10, help='requests/s served by each token')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per request')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--bad-tokens', type=int, default=1, help='tokens that are always throttled')
+    parser.add_argument('--cooldown', type=float, default=1, help='base cooldown of a throttled token')
+    parser.add_argument('--strategy', default='least_loaded')
+    args = parser.parse_args()
+
+    for tokens in args.tokens:
+        result = asyncio.run(run(tokens, args))
+        healthy = tokens - min(args.bad_tokens, tokens - 1)
+        print(f"{tokens:3d} tokens ({healthy} healthy)  {result['rps']:8.1f} requests/s  "
+              f"({result['rps'] / healthy:5.1f} per healthy token, {result['throttled']} throttled)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark of the transcription parsing.
+Compares the legacy split/filter/join approach with the streaming VTT parser
+on synthetic TikTok-like documents (cue ids, rolling captions).
+
+usage:
+    python -m benchmarks.bench_vtt [--cues 2000] [--repeat 20]
+"""
+import argparse
+import time
+import tracemalloc
+
+from TikTokManager.vtt import parse_text
+
+
+def legacy_parse(text:str) -> str:
+    """Parsing used before the VTT parser (response.text.split + list comprehension + join)"""
+    result_array = text.split('\n')
+    result_array = [item for item in result_array if item and "-->" not in item and "WEBVTT" not in item]
+    return ' '.join(result_array)
+
+
+def make_document(cues:int) -> str:
+    """Build a WebVTT document with cue ids and a rolling duplicate every third cue"""
+    lines = ["WEBVTT", "", "NOTE generated for the benchmark", ""]
+    for i in range(cues):
+        start = i * 2.0
+        caption = f"caption number {i // 3 * 3} with some spoken words from the video"
+        lines += [str(i + 1),
+                  f"{int(start // 60):02d}:{start % 60:06.3f} --> {int((start + 2) // 60):02d}:{(start + 2) % 60:06.3f}",
+                  caption,
+                  ""]
+    return '\n'.join(lines)
+
+
+def chunked(text:str, size:int = 16384):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def measure(name:str, func, repeat:int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<10} {elapsed * 1000:9.2f} ms/doc   peak {peak / 1024:9.1f} KiB   output {len(output):8d} chars")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cues', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    document = make_document(args.cues)
+    print(f"document: {args.cues} cues, {len(document) / 1024:.1f} KiB")
+    # The legacy path needs the whole body (response.text), the parser consumes chunks
+    measure('legacy', lambda: legacy_parse(''.join(chunked(document))), args.repeat)
+    measure('streaming', lambda: parse_text(chunked(document)), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
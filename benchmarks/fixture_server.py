@@ -0,0 +1,338 @@
+"""
+Offline stand-in for the TikTok endpoints used by TikTokManager.
+- video pages with the `__UNIVERSAL_DATA_FOR_REHYDRATION__` json (`webapp.video-detail` scope)
+- hashtag detail, hashtag item list and comment list api endpoints, paged with cursors
+- WebVTT transcriptions with rolling captions
+- configurable latency, error rate (500) and throttling rate (429)
+- video items are synthetic, or replayed from recorded page jsons (a folder of .json
+  files or the page cache sqlite of a previous run)
+
+usage:
+    python -m benchmarks.fixture_server [--port 8765] [--latency 0.05] [--error-rate 0.01]
+                                        [--throttle-rate 0.02] [--fixtures temp/page_cache.sqlite]
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_TIME = 1_700_000_000
+ITEM_TEMPLATE = {
+    "id": "",
+    "desc": "synthetic video description #petro #colombia #benchmark",
+    "createTime": 0,
+    "locationCreated": "CO",
+    "isAd": False,
+    "author": {"id": "", "uniqueId": "", "secUid": "", "nickname": "", "verified": False},
+    "authorStats": {"followerCount": 12000, "heartCount": 340000, "videoCount": 210, "diggCount": 1500},
+    "stats": {"diggCount": 2300, "shareCount": 120, "commentCount": 410, "playCount": 98000},
+    "music": {"id": "1", "title": "original sound", "original": True},
+    "challenges": [],
+    "video": {"subtitleInfos": []},
+}
+
+
+def load_templates(fixtures:str) -> list[dict]:
+    """
+    Load recorded itemStruct dictionaries
+
+    args:
+    - fixtures: folder with page json files or path to a page cache sqlite file
+
+    return:
+    - List of itemStruct dictionaries
+    """
+    if os.path.isdir(fixtures):
+        payloads = []
+        for file_path in sorted(glob.glob(os.path.join(fixtures, '*.json'))):
+            with open(file_path, encoding='utf-8') as file:
+                payloads.append(json.load(file))
+    else:
+        conn = sqlite3.connect(fixtures)
+        payloads = [json.loads(zlib.decompress(row[0])) for row in conn.execute('SELECT data FROM entries')]
+        conn.close()
+    templates = []
+    for payload in payloads:
+        item = (payload.get("__DEFAULT_SCOPE__", {}).get("webapp.video-detail", {})
+                .get("itemInfo", {}).get("itemStruct"))
+        if item is not None:
+            templates.append(item)
+    if not templates:
+        raise ValueError(f'No itemStruct found in {fixtures}')
+    return templates
+
+
+class FixtureStore():
+    """Deterministic hashtag feeds, video items, comments and transcriptions"""
+    def __init__(self,
+                 videos_per_hashtag:int = 1000,
+                 comments_per_video:int = 200,
+                 cues:int = 120,
+                 subtitle_rate:float = 0.8,
+                 templates:list[dict] = None
+                 ) -> None:
+        """
+        args:
+        - videos_per_hashtag: length of every hashtag feed
+        - comments_per_video: amount of comments of every video
+        - cues: amount of cues of every transcription
+        - subtitle_rate: share of videos with a transcription
+        - templates: recorded itemStruct dictionaries, a synthetic one is used if None
+        """
+        self.videos_per_hashtag = videos_per_hashtag
+        self.comments_per_video = comments_per_video
+        self.cues = cues
+        self.subtitle_rate = subtitle_rate
+        self.templates = templates or [ITEM_TEMPLATE]
+
+    @staticmethod
+    def hashtag_id(name:str) -> int:
+        return zlib.crc32(name.lower().encode('utf-8')) % 1_000_000
+
+    def video_id(self, name:str, index:int) -> str:
+        return str(7_300_000_000_000_000_000 + self.hashtag_id(name) * 1_000_000 + index)
+
+    def item(self, video_id:str, base_url:str) -> dict:
+        """itemStruct of a video, newer videos come first in the feeds"""
+        index = int(video_id) % 1_000_000
+        item = copy.deepcopy(self.templates[index % len(self.templates)])
+        author = f'user{index % 500}'
+        item["id"] = video_id
+        item["createTime"] = BASE_TIME - index * 60
+        item.setdefault("author", {}).update({"id": str(index % 500), "uniqueId": author, "secUid": f'sec{author}'})
+        item["author"].setdefault("nickname", author)
+        item.setdefault("music", ITEM_TEMPLATE["music"])
+        subtitles = []
+        if random.Random(index).random() < self.subtitle_rate:
+            subtitles = [{"LanguageCodeName": "spa-ES", "Url": f'{base_url}/vtt/{video_id}.vtt?lang=spa'},
+                         {"LanguageCodeName": "eng-US", "Url": f'{base_url}/vtt/{video_id}.vtt'}]
+        item.setdefault("video", {})["subtitleInfos"] = subtitles
+        return item
+
+    def page(self, video_id:str, base_url:str) -> str:
+        """Video page html as served by TikTok (only the rehydration script)"""
+        payload = {"__DEFAULT_SCOPE__": {"webapp.video-detail": {"itemInfo": {"itemStruct": self.item(video_id, base_url)},
+                                                                 "statusCode": 0}}}
+        return ('<!DOCTYPE html><html><head></head><body>'
+                '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+                f'{json.dumps(payload)}</script></body></html>')
+
+    def hashtag_detail(self, name:str) -> dict:
+        return {"challengeInfo": {"challenge": {"id": str(self.hashtag_id(name)), "title": name}}, "statusCode": 0}
+
+    def item_list(self, challenge_id:str, cursor:int, count:int, base_url:str) -> dict:
+        """One page of a hashtag feed"""
+        end = min(cursor + count, self.videos_per_hashtag)
+        base = 7_300_000_000_000_000_000 + int(challenge_id) * 1_000_000
+        items = [self.item(str(base + i), base_url) for i in range(cursor, end)]
+        return {"itemList": items, "cursor": end, "hasMore": end < self.videos_per_hashtag, "statusCode": 0}
+
+    def comment_list(self, video_id:str, cursor:int, count:int) -> dict:
+        """One page of the comments of a video"""
+        end = min(cursor + count, self.comments_per_video)
+        comments = [{"cid": f'{video_id}{i:05d}',
+                     "text": f'comment {i} about the video, some opinion with words',
+                     "user": {"uid": str(i), "unique_id": f'commenter{i}', "sec_uid": f'sec{i}'},
+                     "digg_count": i % 50,
+                     "create_time": BASE_TIME + i * 30,
+                     "comment_language": "es"}
+                    for i in range(cursor, end)]
+        return {"comments": comments, "cursor": end, "has_more": int(end < self.comments_per_video),
+                "total": self.comments_per_video, "status_code": 0}
+
+    def vtt(self, video_id:str) -> str:
+        """Transcription with cue ids and rolling captions"""
+        lines = ["WEBVTT", ""]
+        for i in range(self.cues):
+            start = i * 2.0
+            lines += [str(i + 1),
+                      f'{int(start // 60):02d}:{start % 60:06.3f} --> {int((start + 2) // 60):02d}:{(start + 2) % 60:06.3f}',
+                      f'spoken words of video {video_id[-4:]} caption {i // 2}',
+                      ""]
+        return '\n'.join(lines)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Request handler, configured through the attributes of the server"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status:int, body:str = '', content_type:str = 'application/json', headers:dict = None) -> None:
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(self._endpoint, status)
+
+    def do_OPTIONS(self) -> None:
+        self._endpoint = 'options'
+        self._send(204, headers={'Access-Control-Allow-Methods': 'GET', 'Access-Control-Allow-Headers': '*'})
+
+    @staticmethod
+    def endpoint(path:str) -> str:
+        """Name of the endpoint of a path"""
+        if path.startswith('/@') and '/video/' in path:
+            return 'page'
+        if path.startswith('/vtt/'):
+            return 'vtt'
+        return {'/': 'home',
+                '/__stats': 'stats',
+                '/api/challenge/detail/': 'challenge_detail',
+                '/api/challenge/item_list/': 'challenge_item_list',
+                '/api/comment/list/': 'comment_list'}.get(path, 'not_found')
+
+    def do_GET(self) -> None:
+        server = self.server
+        parsed = urlparse(self.path)
+        path = parsed.path
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        base_url = f'http://{self.headers.get("Host", "%s:%s" % server.server_address)}'
+        self._endpoint = self.endpoint(path)
+
+        if self._endpoint == 'stats':
+            self._send(200, json.dumps(server.stats()))
+            return
+        if self._endpoint == 'home':
+            # Stand-in for the request signer loaded by the TikTok home page
+            self._send(200,
+                       '<html><head><script>window.byted_acrawler = {frontierSign: function (url) '
+                       '{ return {"X-Bogus": "offline"}; }};</script></head><body></body></html>',
+                       content_type='text/html',
+                       headers={'Set-Cookie': 'msToken=offline; Path=/'})
+            return
+        if self._endpoint == 'not_found':
+            self._send(404, '{"statusCode": 10202}')
+            return
+
+        if server.latency:
+            time.sleep(max(0.0, random.gauss(server.latency, server.latency * server.jitter)))
+        roll = random.random()
+        if roll < server.throttle_rate:
+            self._send(429, '', headers={'Retry-After': '1'})
+            return
+        if roll < server.throttle_rate + server.error_rate:
+            self._send(500, '{"statusCode": 10000}')
+            return
+
+        store = server.store
+        if self._endpoint == 'page':
+            self._send(200, store.page(path.rstrip('/').rsplit('/', 1)[-1], base_url), content_type='text/html')
+        elif self._endpoint == 'vtt':
+            self._send(200, store.vtt(path[len('/vtt/'):].split('.')[0]), content_type='text/vtt')
+        elif self._endpoint == 'challenge_detail':
+            self._send(200, json.dumps(store.hashtag_detail(query.get('challengeName', ''))))
+        elif self._endpoint == 'challenge_item_list':
+            self._send(200, json.dumps(store.item_list(query.get('challengeID', '0'),
+                                                       int(query.get('cursor', 0)),
+                                                       int(query.get('count', 35)),
+                                                       base_url)))
+        else:
+            self._send(200, json.dumps(store.comment_list(query.get('aweme_id', '0'),
+                                                          int(query.get('cursor', 0)),
+                                                          int(query.get('count', 20)))))
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Threaded http server replaying the TikTok fixtures"""
+    daemon_threads = True
+
+    def __init__(self,
+                 host:str = '127.0.0.1',
+                 port:int = 0,
+                 store:FixtureStore = None,
+                 latency:float = 0.05,
+                 jitter:float = 0.5,
+                 error_rate:float = 0.0,
+                 throttle_rate:float = 0.0
+                 ) -> None:
+        """
+        args:
+        - host: interface to listen on
+        - port: port to listen on, 0 for a free one
+        - store: fixtures to serve
+        - latency: mean seconds added to every page, api and transcription response
+        - jitter: standard deviation of the latency as a share of the mean
+        - error_rate: share of responses answered with a 500
+        - throttle_rate: share of responses answered with a 429
+        """
+        if error_rate + throttle_rate > 1:
+            raise ValueError('`error_rate` + `throttle_rate` must not be greater than 1.')
+        super().__init__((host, port), FixtureHandler)
+        self.store = store or FixtureStore()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, endpoint:str, status:int) -> None:
+        with self._counts_lock:
+            key = f'{endpoint} {status}'
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        """Amount of responses per endpoint and status"""
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def start(self) -> 'FixtureServer':
+        """Serve in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--videos', type=int, default=1000, help='videos per hashtag feed')
+    parser.add_argument('--comments', type=int, default=200, help='comments per video')
+    parser.add_argument('--cues', type=int, default=120, help='cues per transcription')
+    parser.add_argument('--fixtures', default=None, help='folder of page jsons or page cache sqlite to replay')
+    args = parser.parse_args()
+
+    store = FixtureStore(videos_per_hashtag=args.videos,
+                         comments_per_video=args.comments,
+                         cues=args.cues,
+                         templates=load_templates(args.fixtures) if args.fixtures else None)
+    server = FixtureServer(args.host, args.port, store, args.latency, args.jitter, args.error_rate, args.throttle_rate)
+    print(f"Serving TikTok fixtures on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
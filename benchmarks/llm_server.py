@@ -0,0 +1,217 @@
+"""
+Offline stand-in for an OpenAI compatible chat completions api (Grok, OpenAI, ...).
+- answers `POST /v1/chat/completions` with a json matching the `json_schema` response format
+  of the request (scores, topic lists, one result per numbered comment of a packed request)
+- configurable latency per request and per output token
+- optional requests/min limit enforced with 429 + retry-after, plus a random throttling rate
+- `GET /__stats` returns the amount of responses per status and the tokens served
+
+usage:
+    python -m benchmarks.llm_server [--port 8766] [--latency 0.5] [--rpm 600] [--throttle-rate 0.01]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NUMBERED_RE = re.compile(r'^\[(\d+)\]', re.M)
+TOPICS = ["Security", "Mobility", "Public Services", "Education", "Healthcare", "Corruption", "Economy"]
+
+
+def fake_value(schema:dict, defs:dict, numbers:list[int], name:str = '') -> object:
+    """
+    Build a value matching a json schema
+
+    args:
+    - schema: json schema of the value
+    - defs: `$defs` of the root schema
+    - numbers: numbers of the comments of a packed request (one array item per number)
+    - name: property name of the value
+
+    return:
+    - Value
+    """
+    if '$ref' in schema:
+        return fake_value(defs[schema['$ref'].split('/')[-1]], defs, numbers, name)
+    kind = schema.get('type')
+    if kind == 'object':
+        return {key: fake_value(value, defs, numbers, key) for key, value in schema.get('properties', {}).items()}
+    if kind == 'array':
+        if schema.get('items', {}).get('type') == 'string':
+            return random.sample(TOPICS, random.randint(1, 3))
+        items = []
+        for number in numbers or [1]:
+            item = fake_value(schema.get('items', {}), defs, numbers, name)
+            if isinstance(item, dict) and 'number' in item:
+                item['number'] = number
+            items.append(item)
+        return items
+    if kind == 'integer':
+        return random.randint(1, 5)
+    if kind == 'number':
+        return random.random()
+    if kind == 'boolean':
+        return random.random() < 0.5
+    if name == 'score':
+        return str(random.randint(1, 5))
+    return random.choice(TOPICS)
+
+
+class LLMHandler(BaseHTTPRequestHandler):
+    """Request handler of the LLMServer"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _send(self, status:int, body:dict, headers:dict = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(status)
+
+    def do_GET(self) -> None:
+        if self.path.startswith('/__stats'):
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        retry_after = self.server.admit()
+        if retry_after is not None:
+            self._send(429, {"error": {"message": "rate limit exceeded", "type": "rate_limit_error"}},
+                       {'retry-after': f'{retry_after:.3f}'})
+            return
+
+        messages = request.get('messages', [])
+        prompt = '\n'.join(str(message.get('content', '')) for message in messages)
+        user = str(messages[-1].get('content', '')) if messages else ''
+        numbers = [int(number) for number in NUMBERED_RE.findall(user)]
+        response_format = request.get('response_format') or {}
+        schema = response_format.get('json_schema', {}).get('schema')
+        content = json.dumps(fake_value(schema, schema.get('$defs', {}), numbers) if schema else {"score": "3"})
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        time.sleep(max(0.0, self.server.latency + completion_tokens * self.server.token_latency))
+        self.server.count_tokens(prompt_tokens + completion_tokens)
+        self._send(200, {"id": f"chatcmpl-{random.getrandbits(48):x}",
+                         "object": "chat.completion",
+                         "created": int(time.time()),
+                         "model": request.get('model', 'stand-in'),
+                         "choices": [{"index": 0,
+                                      "message": {"role": "assistant", "content": content},
+                                      "finish_reason": "stop"}],
+                         "usage": {"prompt_tokens": prompt_tokens,
+                                   "completion_tokens": completion_tokens,
+                                   "total_tokens": prompt_tokens + completion_tokens}})
+
+
+class LLMServer(ThreadingHTTPServer):
+    """Threaded OpenAI compatible stand-in server"""
+    daemon_threads = True
+
+    def __init__(self,
+                 host:str = '127.0.0.1',
+                 port:int = 0,
+                 latency:float = 0.5,
+                 token_latency:float = 0.0,
+                 rpm:int = None,
+                 throttle_rate:float = 0.0
+                 ) -> None:
+        """
+        args:
+        - host: interface to listen on
+        - port: port to listen on, 0 for a free one
+        - latency: seconds added to every completion
+        - token_latency: seconds added per output token
+        - rpm: requests per minute answered before 429s, None for no limit
+        - throttle_rate: share of requests answered with a 429 regardless of the limit
+        """
+        super().__init__((host, port), LLMHandler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.rpm = rpm
+        self.throttle_rate = throttle_rate
+        self._window = deque()
+        self._counts = {}
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def admit(self) -> float:
+        """Seconds to wait when the request is throttled, None when it is served"""
+        if random.random() < self.throttle_rate:
+            return 1.0
+        if self.rpm is None:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0] >= 60:
+                self._window.popleft()
+            if len(self._window) >= self.rpm:
+                return 60 - (now - self._window[0])
+            self._window.append(now)
+        return None
+
+    def count(self, status:int) -> None:
+        with self._lock:
+            self._counts[str(status)] = self._counts.get(str(status), 0) + 1
+
+    def count_tokens(self, tokens:int) -> None:
+        with self._lock:
+            self._tokens += tokens
+
+    def stats(self) -> dict:
+        """Amount of responses per status and tokens served"""
+        with self._lock:
+            return {"responses": dict(self._counts), "tokens": self._tokens}
+
+    def start(self) -> 'LLMServer':
+        """Serve in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--rpm', type=int, default=None)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = LLMServer(args.host, args.port, args.latency, args.token_latency, args.rpm, args.throttle_rate)
+    print(f"Serving the chat completions stand-in on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
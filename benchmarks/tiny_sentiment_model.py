@@ -0,0 +1,71 @@
+"""
+Offline stand-in for the star rating sentiment model (nlptown/bert-base-multilingual-uncased-sentiment).
+- randomly initialized BERT sequence classifier with the same five star labels
+- small WordPiece vocabulary built from the benchmark words, so it loads without the hub
+- saved with `save_pretrained`, loadable by `pipeline(...)` and SentimentEngine
+
+usage:
+    python -m benchmarks.tiny_sentiment_model [--path temp/tiny_sentiment_model] [--hidden 256] [--layers 4]
+"""
+import argparse
+import os
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+WORDS = ("alcalde bogota metro seguridad bien mal gracias nunca siempre ciudad gobierno presidente colombia "
+         "trabajo calle barrio policia transmilenio impuestos votar pueblo mentira verdad corrupcion salud "
+         "educacion empleo paz guerra que el la de en y no si es por un una los las muy mas").split()
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+STAR_LABELS = ['1 star', '2 stars', '3 stars', '4 stars', '5 stars']
+
+
+def build_tiny_model(path:str, hidden:int = 256, layers:int = 4, heads:int = 4, seed:int = 0) -> str:
+    """
+    Save a small random sentiment model and its tokenizer
+
+    args:
+    - path: folder where the model is saved
+    - hidden: hidden size of the encoder
+    - layers: amount of encoder layers
+    - heads: attention heads per layer
+    - seed: torch seed of the weights
+
+    return:
+    - Path of the saved model
+    """
+    os.makedirs(path, exist_ok=True)
+    characters = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    vocab = list(dict.fromkeys(SPECIAL_TOKENS + WORDS + list(characters) + [f'##{char}' for char in characters]))
+    vocab_file = os.path.join(path, 'vocab.txt')
+    with open(vocab_file, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(vocab))
+    tokenizer = BertTokenizerFast(vocab_file=vocab_file, do_lower_case=True, model_max_length=512)
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=len(vocab),
+                        hidden_size=hidden,
+                        num_hidden_layers=layers,
+                        num_attention_heads=heads,
+                        intermediate_size=hidden * 4,
+                        max_position_embeddings=512,
+                        num_labels=len(STAR_LABELS),
+                        id2label=dict(enumerate(STAR_LABELS)),
+                        label2id={label: i for i, label in enumerate(STAR_LABELS)})
+    BertForSequenceClassification(config).save_pretrained(path)
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default=os.path.join('temp', 'tiny_sentiment_model'))
+    parser.add_argument('--hidden', type=int, default=256)
+    parser.add_argument('--layers', type=int, default=4)
+    parser.add_argument('--heads', type=int, default=4)
+    args = parser.parse_args()
+    print(f"Tiny sentiment model saved in {build_tiny_model(args.path, args.hidden, args.layers, args.heads)}")
+
+
+if __name__ == '__main__':
+    main()
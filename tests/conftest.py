@@ -0,0 +1,106 @@
+"""Offline stand-ins of the TikTokApi sessions, feeds and pages used by the manager tests"""
+import pytest
+
+from TikTokManager.session_pool import SessionPool
+from TikTokManager.tiktokmanager import TikTokManager
+
+FAST_PACING = {endpoint: {"rate": 1000.0, "max_rate": 1000.0} for endpoint in ('feed', 'page_json', 'comments', 'vtt')}
+
+
+def feed_item(video_id:int, create_time:int = None) -> dict:
+    return {"id": str(video_id),
+            "createTime": create_time if create_time is not None else 1700000000 + video_id,
+            "author": {"uniqueId": f'user{video_id % 7}'},
+            "stats": {"playCount": video_id}}
+
+
+class FakeComment():
+    def __init__(self, video_id:str, index:int) -> None:
+        self.as_dict = {"cid": f'{video_id}-{index}', "text": f'comentario {index}', "digg_count": index,
+                        "create_time": 1700000000 + index, "comment_language": 'es'}
+
+
+class FakeVideo():
+    def __init__(self, video_id:str) -> None:
+        self.id = video_id
+
+    async def comments(self, count:int = 20):
+        for index in range(count):
+            yield FakeComment(self.id, index)
+
+
+class FakeHashtag():
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.id = None
+
+    async def info(self) -> None:
+        self.id = f'challenge-{self.name}'
+
+
+class FakeApi():
+    """
+    TikTokApi instance serving `feeds` (challenge id -> items) one page per request,
+    related videos from `related` (video id -> items), requests of the cursors in
+    `fail_cursors` raise a ConnectionError that many times
+    """
+    def __init__(self, feeds:dict, fail_cursors:dict = None, related:dict = None) -> None:
+        self.feeds = feeds
+        self.related = related or {}
+        self.fail_cursors = dict(fail_cursors or {})
+        self.sessions = []
+
+    def hashtag(self, name:str = None) -> FakeHashtag:
+        return FakeHashtag(name)
+
+    def video(self, id:str = None, url:str = None) -> FakeVideo:
+        return FakeVideo(id)
+
+    async def make_request(self, url:str, params:dict) -> dict:
+        if 'itemID' in params:
+            return {"itemList": self.related.get(params['itemID'], [])}
+        items = self.feeds.get(params.get('challengeID'), [])
+        cursor = params.get('cursor', 0)
+        if self.fail_cursors.get(cursor):
+            self.fail_cursors[cursor] -= 1
+            raise ConnectionError('connection reset')
+        page = items[cursor:cursor + params['count']]
+        return {"itemList": page, "cursor": cursor + len(page), "hasMore": cursor + len(page) < len(items)}
+
+
+def page_json(item:dict) -> dict:
+    return {"__DEFAULT_SCOPE__": {"webapp.video-detail": {"itemInfo": {"itemStruct": item}}}}
+
+
+@pytest.fixture
+def offline_manager(tmp_path, monkeypatch):
+    """
+    Factory of TikTokManager instances whose sessions, feeds and video pages are served
+    from memory: feeds map hashtag -> feed items, pages of the ids in `broken` have no itemStruct
+    feed requests of the cursors in `fail_cursors` fail and `related` maps video id -> related items (see FakeApi)
+    """
+    managers = []
+
+    def factory(feeds:dict, pool_size:int = 1, broken:set = (), fail_cursors:dict = None, related:dict = None) -> TikTokManager:
+        items = {item['id']: item for feed in feeds.values() for item in feed}
+        api = FakeApi({f'challenge-{hashtag}': feed for hashtag, feed in feeds.items()}, fail_cursors, related)
+
+        async def open_slot(pool, slot):
+            slot.api = api
+
+        monkeypatch.setattr(SessionPool, '_open', open_slot)
+        manager = TikTokManager(str(tmp_path / 'output'), str(tmp_path / 'temp'), pool_size=pool_size,
+                                ms_tokens=['token'], pacing=FAST_PACING)
+        manager.pacer.base_backoff = 0.0
+
+        def get_tiktok_json(url):
+            video_id = url.rsplit('/', 1)[-1]
+            return page_json(items[video_id]) if video_id not in broken else page_json(None)
+
+        manager.get_tiktok_json = get_tiktok_json
+        managers.append(manager)
+        return manager
+
+    yield factory
+    for manager in managers:
+        manager.close()
@@ -0,0 +1,99 @@
+"""Command line: spec loading, overrides, validation and the jobs that need no network"""
+import json
+import os
+
+import pytest
+
+from TikTokManager import cli
+from TikTokManager.records import CommentRecord
+from TikTokManager.sinks import open_sink
+
+JOBS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jobs')
+SPEC_COMMANDS = {'mine_petro.yaml': 'mine', 'crawl_petro.yaml': 'crawl', 'enqueue_petro.yaml': 'enqueue',
+                 'transcribe.json': 'transcribe', 'worker.yaml': 'worker'}
+
+
+def write_spec(tmp_path, spec:dict) -> str:
+    path = str(tmp_path / 'spec.json')
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(spec, file)
+    return path
+
+
+@pytest.mark.parametrize('name', sorted(SPEC_COMMANDS))
+def test_shipped_specs_are_valid(name):
+    spec = cli.load_spec(os.path.join(JOBS_PATH, name))
+    assert cli.check_spec(SPEC_COMMANDS[name], spec)
+
+
+def test_load_spec_must_be_a_mapping(tmp_path):
+    path = str(tmp_path / 'spec.yaml')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('- petro\n')
+    with pytest.raises(ValueError, match='must be a mapping'):
+        cli.load_spec(path)
+
+
+def test_apply_overrides():
+    spec = cli.apply_overrides({"manager": {"headless": True}},
+                               ['video_amount=50', 'hashtag_list=["petro", "galan"]', 'manager.pool_size=2',
+                                'output_format=jsonl', 'pacing.feed.rate=0.5'])
+    assert spec == {"manager": {"headless": True, "pool_size": 2},
+                    "video_amount": 50,
+                    "hashtag_list": ['petro', 'galan'],
+                    "output_format": 'jsonl',
+                    "pacing": {"feed": {"rate": 0.5}}}
+    with pytest.raises(ValueError, match='key=value'):
+        cli.apply_overrides({}, ['video_amount'])
+
+
+def test_check_spec():
+    spec = {"output_path": './output', "manager": {}, "hashtag_list": ['petro'], "video_amount": 5, "comment_amount": 0}
+    assert cli.check_spec('mine', spec) == {"hashtag_list": ['petro'], "video_amount": 5, "comment_amount": 0}
+    with pytest.raises(ValueError, match='Unknown keys videos'):
+        cli.check_spec('mine', {**spec, "videos": 5})
+    with pytest.raises(ValueError, match='Missing `mine` keys video_amount, comment_amount'):
+        cli.check_spec('mine', {"hashtag_list": ['petro']})
+    # A resumed run takes its parameters from the journal
+    assert cli.check_spec('mine', {"resume": 'run'}) == {"resume": 'run'}
+
+
+@pytest.mark.parametrize('argv', [[], ['scrape', 'spec.json'], ['mine'], ['mine', 'missing.json']])
+def test_main_rejects_bad_arguments(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main(argv)
+    assert exit_info.value.code == 2
+    assert 'usage: python -m TikTokManager' in capsys.readouterr().err
+
+
+def test_main_rejects_invalid_specs(tmp_path, capsys):
+    path = write_spec(tmp_path, {"video_ids": ['1']})
+    with pytest.raises(SystemExit):
+        cli.main(['comments', path])
+    assert 'Missing `comments` keys comment_amount' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        cli.main(['transcribe', path, '--set', 'video_amount=5'])
+    assert 'Unknown keys video_amount' in capsys.readouterr().err
+
+
+def test_export(tmp_path, capsys):
+    sink_path = str(tmp_path / 'comments')
+    with open_sink('jsonl', sink_path, 10) as sink:
+        sink.write('comments_data', [CommentRecord('1', text='hola', comment_id='c1')])
+    path = write_spec(tmp_path, {"sink_path": sink_path})
+    assert cli.main(['export', path]) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result["excel_path"] == f'{sink_path}.xlsx'
+    assert os.path.exists(result["excel_path"])
+    assert result["startup_seconds"] >= 0
+
+
+def test_enqueue(tmp_path, capsys):
+    queue_path = str(tmp_path / 'queue.sqlite')
+    path = write_spec(tmp_path, {"output_path": str(tmp_path / 'output'), "temp_path": str(tmp_path / 'temp'),
+                                 "queue_path": queue_path, "hashtag_list": ['petro', 'galan'],
+                                 "video_amount": 10, "comment_amount": 5})
+    assert cli.main(['enqueue', path, '--set', 'manager.ms_tokens=["token"]']) == 0
+    result = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert result["jobs"] == {"discover": {"queued": 2}}
+    assert result["queue_path"] == queue_path
@@ -0,0 +1,69 @@
+"""Dedup index: id keys, Bloom filter and persistence of the stored ids"""
+import random
+
+import pytest
+
+from TikTokManager.dedup import BloomFilter, DedupIndex, id_key
+
+
+@pytest.fixture(params=[True, False], ids=['bloom', 'sqlite'])
+def index(request, tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite'), bloom=request.param, bloom_capacity=100)
+    yield index
+    index.close()
+
+
+def test_id_key():
+    assert id_key('7312345678901234567') == 7312345678901234567
+    assert id_key(42) == 42
+    assert id_key('abc') == id_key('abc')
+    assert 0 <= id_key('abc') < 2 ** 63
+    assert 0 <= id_key(str(2 ** 64)) < 2 ** 63
+
+
+def test_bloom_filter_has_no_false_negatives():
+    rng = random.Random(0)
+    keys = [rng.getrandbits(63) for _ in range(5000)]
+    bloom = BloomFilter(5000, 0.01)
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    # False positives stay near the configured rate at capacity
+    others = [rng.getrandbits(63) for _ in range(5000)]
+    assert sum(key in bloom for key in others) < 5000 * 0.03
+
+
+def test_filter_new_keeps_order_and_drops_repetitions(index):
+    index.add('video', ['1', '3'])
+    assert index.filter_new('video', ['4', '1', '2', '4', '3', '2']) == ['4', '2']
+    assert index.contains('video', '1')
+    assert not index.contains('comment', '1')
+
+
+def test_unknown_kind(index):
+    with pytest.raises(ValueError, match='Only allowed `kind` values'):
+        index.add('user', ['1'])
+    with pytest.raises(ValueError, match='Only allowed `kind` values'):
+        index.filter_new('user', ['1'])
+
+
+def test_filter_grows_past_its_capacity(index):
+    ids = [str(7_000_000_000_000_000_000 + i) for i in range(1000)]
+    for start in range(0, len(ids), 100):
+        index.add('video', ids[start:start + 100])
+    assert index.filter_new('video', ids) == []
+    assert index.stats()['video_ids'] == 1000
+
+
+def test_ids_survive_reopening(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite')
+    index = DedupIndex(path)
+    index.add('comment', ['a', 'b'])
+    index.add('comment', ['b'])
+    index.close()
+
+    index = DedupIndex(path)
+    assert index.stats()['comment_ids'] == 2
+    assert index.filter_new('comment', ['a', 'b', 'c']) == ['c']
+    assert index.stats()['bloom_skips'] == 1
+    index.close()
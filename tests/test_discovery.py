@@ -0,0 +1,59 @@
+"""Feed discovery: cursor paging, resume after errors and incremental watermarks"""
+import asyncio
+
+import pytest
+
+from tests.conftest import feed_item
+
+FEED = [feed_item(i) for i in range(100)]
+
+
+def video_ids(urls:list[str]) -> list[int]:
+    return [int(url.rsplit('/', 1)[-1]) for url in urls]
+
+
+def pages(manager) -> int:
+    return manager.metrics.counters.get(('discovery_pages_total', (('ent_type', 'hashtag'),)), 0)
+
+
+def discover(manager, video_ct:int, **options) -> list[str]:
+    return manager._run(manager.get_video_urls_v2('petro', video_ct, 'hashtag', **options))
+
+
+def test_pages_until_the_amount_is_reached(offline_manager):
+    manager = offline_manager({'petro': FEED})
+    urls = discover(manager, 50)
+    assert video_ids(urls) == list(range(50))
+    assert urls[0] == f"{manager.base_url}/@user0/video/0"
+    assert pages(manager) == 2
+
+
+def test_error_resumes_from_the_last_page(offline_manager):
+    # The third page fails twice, discovery resumes at its cursor instead of the first page
+    manager = offline_manager({'petro': FEED}, fail_cursors={70: 2})
+    assert video_ids(discover(manager, 100)) == list(range(100))
+    assert pages(manager) == 3
+    assert manager.metrics.counters[('retries_total', (('stage', 'discovery'),))] == 2
+
+
+def test_gives_up_after_five_errors_in_a_row(offline_manager):
+    manager = offline_manager({'petro': FEED}, fail_cursors={35: 5})
+    assert video_ids(discover(manager, 100)) == list(range(35))
+
+
+def test_incremental_stops_at_the_watermark(offline_manager):
+    # Newest videos first, as the feed of a hashtag
+    manager = offline_manager({'petro': sorted(FEED, key=lambda item: -item['createTime'])})
+    manager.watermarks.update('hashtag', 'petro', FEED[59]['createTime'], FEED[59]['id'])
+    watermarks = {}
+    urls = discover(manager, 100, incremental=True, stop_after=5, watermarks=watermarks)
+    assert video_ids(urls) == list(range(99, 59, -1))
+    assert watermarks == {('hashtag', 'petro'): (FEED[99]['createTime'], '99')}
+    # Nothing is committed until the caller stored the videos
+    assert manager.watermarks.get('hashtag', 'petro') == (FEED[59]['createTime'], '59')
+
+
+def test_unknown_entity_type(offline_manager):
+    manager = offline_manager({})
+    with pytest.raises(ValueError, match='Only allowed `ent_type` values'):
+        asyncio.run(manager.get_video_urls_v2('petro', 10, 'music'))
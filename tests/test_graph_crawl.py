@@ -0,0 +1,83 @@
+"""Related-video graph crawl: frontier order, visited index and budgets"""
+import json
+
+import pytest
+
+from tests.conftest import feed_item
+from TikTokManager.graph_crawl import GraphFrontier, item_hashtags
+
+# 0 -> 1, 2, 3 / 1 -> 2, 4 / 2 -> 0, 5
+RELATED = {'0': [feed_item(1), feed_item(2), feed_item(3)],
+           '1': [feed_item(2), feed_item(4)],
+           '2': [feed_item(0), feed_item(5)]}
+
+
+def tagged(video_id:int, plays:int, *hashtags:str) -> dict:
+    return {"id": str(video_id), "stats": {"playCount": plays}, "challenges": [{"title": hashtag} for hashtag in hashtags]}
+
+
+def test_item_hashtags():
+    item = {"challenges": [{"title": 'Petro'}, {"title": None}], "textExtra": [{"hashtagName": 'colombia'}, {}]}
+    assert item_hashtags(item) == {'petro', 'colombia'}
+    assert item_hashtags({}) == set()
+
+
+def test_priority_rewards_plays_and_seed_hashtags():
+    frontier = GraphFrontier(seed_hashtags=['#Petro'])
+    on_topic = frontier.priority(tagged(1, 999, 'petro'), 1)
+    off_topic = frontier.priority(tagged(2, 999, 'futbol'), 1)
+    assert on_topic == pytest.approx(off_topic + 2.0)
+    assert frontier.priority(tagged(3, 999), 2) == pytest.approx(frontier.priority(tagged(3, 999), 1) - 1.0)
+
+
+def test_best_first_and_breadth_first_order():
+    best = GraphFrontier('best', max_depth=3)
+    breadth = GraphFrontier('breadth', max_depth=3)
+    for frontier in (best, breadth):
+        frontier.add('deep', None, 2, 10.0)
+        frontier.add('low', None, 1, 1.0)
+        frontier.add('high', None, 1, 5.0)
+    assert [best.pop()[0] for _ in range(3)] == ['deep', 'high', 'low']
+    assert [breadth.pop()[0] for _ in range(3)] == ['high', 'low', 'deep']
+    assert best.pop() is None
+
+
+def test_videos_are_visited_once_and_past_max_depth_not_queued():
+    frontier = GraphFrontier(max_depth=1)
+    assert frontier.add('7312345678901234567', 'user', 0, 0.0)
+    assert not frontier.add('7312345678901234567', 'other', 1, 3.0)
+    assert frontier.add('7312345678901234568', 'user', 2, 9.0)
+    assert len(frontier) == 1
+    assert frontier.stats() == {"visited": 2, "queued": 1, "pushed": 1, "revisits": 1}
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError, match='Only allowed `order` values'):
+        GraphFrontier('depth')
+
+
+def test_crawl_writes_every_edge_and_each_video_once(offline_manager):
+    manager = offline_manager({}, related=RELATED)
+    result = manager.crawl_related_graph(['0'], order='breadth', output_format='jsonl')
+    assert (result["nodes"], result["edges"], result["expanded"], result["requests"]) == (6, 7, 6, 6)
+    with open(f"{result['sink_path']}/graph_nodes.jsonl", encoding='utf-8') as file:
+        nodes = [json.loads(line) for line in file]
+    assert sorted(node['video_id'] for node in nodes) == [str(i) for i in range(6)]
+    assert {node['video_id']: node['depth'] for node in nodes}['4'] == 2
+    with open(f"{result['sink_path']}/graph_edges.jsonl", encoding='utf-8') as file:
+        edges = {(edge['source_id'], edge['target_id']) for edge in map(json.loads, file)}
+    assert ('2', '0') in edges and ('1', '2') in edges
+
+
+def test_crawl_stops_at_the_request_budget(offline_manager):
+    manager = offline_manager({}, related=RELATED)
+    result = manager.crawl_related_graph(['0'], max_requests=1, output_format='jsonl')
+    assert (result["nodes"], result["expanded"], result["requests"]) == (4, 1, 1)
+
+
+def test_crawl_from_hashtag_seeds(offline_manager):
+    manager = offline_manager({'petro': [feed_item(0), feed_item(1)]}, related=RELATED)
+    result = manager.crawl_related_graph(['petro'], seed_type='hashtag', seed_videos=2, max_depth=0,
+                                         output_format='jsonl')
+    # Depth 0 only expands the seeds
+    assert (result["nodes"], result["expanded"]) == (5, 2)
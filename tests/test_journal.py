@@ -0,0 +1,95 @@
+"""Crawl journal: run ids, resume state, commits and pending watermarks"""
+import pytest
+
+from TikTokManager.journal import CrawlJournal, new_run_id
+
+URLS = [f'https://www.tiktok.com/@user/video/{i}' for i in range(4)]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = CrawlJournal(str(tmp_path / 'crawl_journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def test_run_ids_are_unique_within_a_second():
+    run_ids = {new_run_id() for _ in range(200)}
+    assert len(run_ids) == 200
+    assert new_run_id('stream').startswith('stream_')
+
+
+def test_duplicate_run_id_is_rejected(journal):
+    journal.start_run('run', {"hashtag_list": ['petro']})
+    with pytest.raises(ValueError, match='already exists'):
+        journal.start_run('run', {"hashtag_list": ['galan']})
+    assert journal.get_run('run') == {"params": {"hashtag_list": ['petro']}, "status": 'running'}
+
+
+def test_unknown_run(journal):
+    assert journal.get_run('missing') is None
+    assert journal.get_discovery('missing') == {}
+    assert journal.done_urls('missing') == set()
+    assert journal.offsets('missing') == {}
+
+
+def test_resume_state_survives_reopening(tmp_path):
+    path = str(tmp_path / 'crawl_journal.sqlite')
+    journal = CrawlJournal(path)
+    journal.start_run('run', {"video_amount": 4})
+    journal.save_discovery('run', 'petro', URLS)
+    journal.mark_stage('run', URLS[0], 'petro', 'json', {"video_id": '0'})
+    journal.mark_stage('run', URLS[0], 'petro', 'transcription', {"video_id": '0', "video_trasncription": 'hola'})
+    journal.mark_stage('run', URLS[1], 'petro', 'json', {"video_id": '1'})
+    journal.commit_videos('run', [URLS[1]], [URLS[2]], {"videos_data": 1, "comments_data": 7})
+    journal.close()
+
+    journal = CrawlJournal(path)
+    assert journal.get_discovery('run') == {'petro': URLS}
+    assert journal.video_state('run', URLS[0]) == {"row": {"video_id": '0', "video_trasncription": 'hola'},
+                                                   "json": True,
+                                                   "transcription": True,
+                                                   "comments": False,
+                                                   "status": 'pending'}
+    # Committed videos drop their partial row, failed ones are mined again on resume
+    assert journal.video_state('run', URLS[1])['status'] == 'done'
+    assert journal.video_state('run', URLS[1])['row'] is None
+    assert journal.video_state('run', URLS[2])['status'] == 'failed'
+    assert journal.video_state('run', URLS[3]) is None
+    assert journal.done_urls('run') == {URLS[1]}
+    assert journal.offsets('run') == {"videos_data": 1, "comments_data": 7}
+    journal.close()
+
+
+def test_offsets_follow_the_last_commit(journal):
+    journal.commit_videos('run', [URLS[0]], [], {"videos_data": 1})
+    journal.commit_videos('run', [URLS[1]], [], {"videos_data": 2, "comments_data": 3})
+    assert journal.offsets('run') == {"videos_data": 2, "comments_data": 3}
+    assert journal.done_urls('run') == {URLS[0], URLS[1]}
+
+
+def test_unknown_stage_is_rejected(journal):
+    with pytest.raises(ValueError):
+        journal.mark_stage('run', URLS[0], 'petro', 'upload', {})
+
+
+def test_runs_are_isolated(journal):
+    journal.commit_videos('a', [URLS[0]], [], {"videos_data": 1})
+    journal.commit_videos('b', [URLS[1]], [], {})
+    assert journal.done_urls('a') == {URLS[0]}
+    assert journal.offsets('b') == {}
+
+
+def test_forget_videos(journal):
+    journal.mark_stage('worker_1', URLS[0], 'petro', 'json', {})
+    journal.commit_videos('worker_1', [URLS[1]], [], {})
+    journal.forget_videos('worker_1', [URLS[0], URLS[1]])
+    assert journal.video_state('worker_1', URLS[0]) is None
+    assert journal.done_urls('worker_1') == set()
+
+
+def test_pending_watermarks(journal):
+    journal.save_watermarks('run', {('hashtag', 'petro'): (1700000000, '7')})
+    journal.save_watermarks('run', {('hashtag', 'petro'): (1700000100, '8'), ('hashtag', 'galan'): (5, '1')})
+    assert journal.get_watermarks('run') == {('hashtag', 'petro'): (1700000100, '8'), ('hashtag', 'galan'): (5, '1')}
+    assert journal.get_watermarks('other') == {}
@@ -0,0 +1,190 @@
+"""Pacing: error classification, retry-after, backoff and the retry loop"""
+import asyncio
+import email.utils
+import time
+
+import pytest
+import requests
+
+from TikTokManager.pacing import (AdaptiveLimiter, Pacer, PermanentError, ThrottledError, classify_error,
+                                  error_retry_after, retry_after_seconds)
+
+
+def http_error(status:int, headers:dict = None) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(f'{status} error', response=response)
+
+
+@pytest.mark.parametrize('error, kind', [
+    (PermanentError('no itemStruct'), 'fatal'),
+    (http_error(404), 'fatal'),
+    (http_error(410), 'fatal'),
+    (ThrottledError('empty page'), 'throttle'),
+    (http_error(429), 'throttle'),
+    (http_error(403), 'throttle'),
+    (Exception('Captcha required'), 'throttle'),
+    (http_error(503), 'retry'),
+    (requests.ConnectionError('reset'), 'retry'),
+    (TimeoutError(), 'retry'),
+    (KeyError('itemInfo'), 'bug'),
+    (TypeError('NoneType'), 'bug'),
+    (AttributeError('get'), 'bug'),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error) == kind
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds('7') == 7.0
+    assert retry_after_seconds(2.5) == 2.5
+    assert retry_after_seconds('-3') == 0.0
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('soon') is None
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= retry_after_seconds(date) <= 30
+    past = email.utils.formatdate(time.time() - 30, usegmt=True)
+    assert retry_after_seconds(past) == 0.0
+
+
+def test_error_retry_after():
+    assert error_retry_after(ThrottledError('429', retry_after=12)) == 12
+    assert error_retry_after(http_error(429, {'Retry-After': '5'})) == 5.0
+    assert error_retry_after(http_error(429)) is None
+    assert error_retry_after(ValueError()) is None
+
+
+def test_backoff_seconds():
+    pacer = Pacer(base_backoff=1.0, max_backoff=10.0)
+    for attempt in range(8):
+        assert all(0 <= pacer.backoff_seconds(attempt) <= min(10.0, 2 ** attempt) for _ in range(50))
+    assert pacer.backoff_seconds(0, ThrottledError('429', retry_after=4)) == 4
+    assert pacer.backoff_seconds(0, http_error(429, {'Retry-After': '600'})) == 10.0
+
+
+def test_call_retries_transient_errors():
+    pacer = Pacer(base_backoff=0.0)
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise requests.ConnectionError('reset')
+        return 'ok'
+
+    assert asyncio.run(pacer.call('page_json', flaky)) == 'ok'
+    assert len(attempts) == 3
+    assert pacer.stats()['page_json']['failures'] == 2
+    assert pacer.stats()['page_json']['successes'] == 1
+
+
+@pytest.mark.parametrize('error', [KeyError('itemInfo'), PermanentError('deleted')])
+def test_call_raises_bugs_and_permanent_errors_at_once(error):
+    pacer = Pacer(base_backoff=0.0)
+    attempts = []
+
+    async def broken():
+        attempts.append(1)
+        raise error
+
+    with pytest.raises(type(error)):
+        asyncio.run(pacer.call('comments', broken))
+    assert len(attempts) == 1
+    # Programming errors are not answers of TikTok, the limiter is left as is
+    expected = 0 if isinstance(error, KeyError) else 1
+    assert pacer.stats()['comments']['successes'] == expected
+    assert pacer.stats()['comments']['failures'] == 0
+
+
+def test_call_gives_up_after_retries():
+    pacer = Pacer(base_backoff=0.0)
+
+    async def down():
+        raise requests.ConnectionError('reset')
+
+    with pytest.raises(requests.ConnectionError):
+        asyncio.run(pacer.call('vtt', down, retries=2))
+    assert pacer.stats()['vtt']['failures'] == 2
+
+
+def test_unknown_endpoint():
+    with pytest.raises(ValueError, match='Only allowed `endpoint` values'):
+        Pacer().limiter('user')
+
+
+def test_limiter_cuts_rate_and_opens_circuit():
+    limiter = AdaptiveLimiter('feed', rate=4.0, breaker_threshold=2, breaker_cooldown=30)
+    limiter.throttled()
+    assert limiter.rate == 2.0
+    assert limiter.state == 'closed'
+    limiter.throttled()
+    assert limiter.state == 'open'
+    # Below the throttled rate the rate only grows additively
+    limiter.success()
+    assert limiter.rate == pytest.approx(2.05)
+
+
+def open_circuit(pacer:Pacer, endpoint:str) -> None:
+    """Open the circuit of an endpoint and wait for its cooldown, the next request is the probe"""
+    pacer.record(endpoint, ThrottledError('429'))
+    assert pacer.limiter(endpoint).state == 'open'
+    time.sleep(0.06)
+
+
+def probe_pacer(**options) -> Pacer:
+    return Pacer(limits={'comments': {"rate": 100.0, "max_rate": 100.0, "breaker_threshold": 1,
+                                      "breaker_cooldown": 0.05, **options}}, base_backoff=0.0)
+
+
+async def acquire_soon(pacer:Pacer, endpoint:str) -> None:
+    await asyncio.wait_for(pacer.acquire(endpoint), 2)
+
+
+def test_probe_ending_in_a_bug_is_released():
+    pacer = probe_pacer()
+    open_circuit(pacer, 'comments')
+
+    async def run():
+        await pacer.acquire('comments')
+        assert pacer.limiter('comments').probing
+        assert pacer.record('comments', KeyError('x')) == 'bug'
+        await acquire_soon(pacer, 'comments')
+
+    asyncio.run(run())
+    assert pacer.limiter('comments').state == 'half_open'
+
+
+def test_cancelled_probe_is_released():
+    pacer = probe_pacer()
+    open_circuit(pacer, 'comments')
+
+    async def run():
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.Event().wait()
+
+        task = asyncio.create_task(pacer.call('comments', hang))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await acquire_soon(pacer, 'comments')
+
+    asyncio.run(run())
+
+
+def test_unrecorded_probe_expires():
+    pacer = probe_pacer(probe_timeout=0.2)
+    open_circuit(pacer, 'comments')
+
+    async def run():
+        # The caller of the probe never records its outcome
+        await pacer.acquire('comments')
+        start = time.monotonic()
+        await acquire_soon(pacer, 'comments')
+        assert time.monotonic() - start >= 0.15
+
+    asyncio.run(run())
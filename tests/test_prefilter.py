@@ -0,0 +1,68 @@
+"""Prefilter: text normalization, MinHash / LSH clusters and propagation of the results"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from TikTokManager.prefilter import MinHashLSH, normalize_texts, prefilter, propagate
+
+CAMPAIGN = 'el cambio va porque el pueblo lo decidio en las urnas, petro presidente hasta el final'
+OTHER = 'que buena receta de arepas con queso, la voy a preparar este domingo para toda la familia'
+
+
+def test_normalize_texts():
+    texts = ['¡Qué BIEN! https://t.co/x @usuario', '🔥🔥🔥', None, '', 'Ｐｅｔｒｏ  2026']
+    assert list(normalize_texts(texts)) == ['que bien', '', '', '', 'petro 2026']
+
+
+def test_near_copies_are_clustered():
+    lsh = MinHashLSH(threshold=0.7)
+    texts = [CAMPAIGN, CAMPAIGN.replace('final', 'finall'), CAMPAIGN + ' ya', OTHER]
+    labels = lsh.clusters([normalize_texts([text])[0] for text in texts])
+    assert list(labels) == [0, 0, 0, 3]
+
+
+def test_distinct_texts_stay_apart():
+    lsh = MinHashLSH(threshold=0.7)
+    texts = [normalize_texts([CAMPAIGN])[0], normalize_texts([OTHER])[0],
+             'petro', 'galan', 'gol de colombia', 'que viva la musica',
+             'no estoy de acuerdo con la reforma tributaria', 'mañana llueve en bogota segun el pronostico']
+    assert len(np.unique(lsh.clusters(texts))) == len(texts)
+
+
+def test_threshold_bounds_the_clusters():
+    # Every fourth word reversed: Jaccard similarity of the shingles around 0.54
+    normalized = normalize_texts([CAMPAIGN])[0]
+    edited = ' '.join(word[::-1] if i % 4 == 0 else word for i, word in enumerate(normalized.split()))
+    assert list(MinHashLSH(threshold=0.9).clusters([normalized, edited])) == [0, 1]
+    assert list(MinHashLSH(threshold=0.4, bands=32).clusters([normalized, edited])) == [0, 0]
+
+
+def test_num_perm_must_be_a_multiple_of_bands():
+    with pytest.raises(ValueError, match='multiple of `bands`'):
+        MinHashLSH(num_perm=64, bands=10)
+
+
+def test_prefilter_drops_empty_rows_and_marks_representatives():
+    df = pd.DataFrame({"comment_id": ['a', 'b', 'c', 'd', 'e', 'f'],
+                       "text": [CAMPAIGN, '😂😂', CAMPAIGN.upper() + '!!', OTHER, '@usuario', None]})
+    result = prefilter(df)
+    assert list(result['cluster']) == [0, -1, 0, 3, -1, -1]
+    assert list(result['representative']) == [True, False, False, True, False, False]
+    assert list(df.columns) == ['comment_id', 'text']
+
+    kept = prefilter(df, drop_empty=False)
+    assert list(kept['cluster']) == [0, 1, 0, 3, 4, 5]
+    assert kept['representative'].sum() == 5
+
+
+def test_prefilter_clusters_inside_groups():
+    df = pd.DataFrame({"text": [CAMPAIGN, CAMPAIGN, CAMPAIGN], "prompt": ['p1', 'p2', 'p1']})
+    assert list(prefilter(df, group_column='prompt')['cluster']) == [0, 1, 0]
+
+
+def test_propagate_copies_representative_results():
+    df = prefilter(pd.DataFrame({"comment_id": ['a', 'b', 'c', 'd'], "text": [CAMPAIGN, '🔥', CAMPAIGN, OTHER]}))
+    results = pd.DataFrame({"comment_id": ['a', 'd'], "sentiment": ['positive', 'neutral']})
+    propagated = propagate(df, results, 'comment_id')
+    assert list(propagated['comment_id']) == ['a', 'c', 'd']
+    assert list(propagated['sentiment']) == ['positive', 'positive', 'neutral']
@@ -0,0 +1,92 @@
+"""Append, resume and truncate of the output sinks, for every backend"""
+import pytest
+
+from TikTokManager.records import CommentRecord, VideoRecord
+from TikTokManager.sinks import SINKS, OutputSink, guess_format, open_sink
+
+
+def comments(start:int, stop:int) -> list[CommentRecord]:
+    return [CommentRecord(video_id='1', text=f'comment {i}', likes=i, comment_id=str(i)) for i in range(start, stop)]
+
+
+@pytest.fixture(params=list(SINKS))
+def sink_args(request, tmp_path):
+    return request.param, str(tmp_path / 'video_info_run')
+
+
+def test_rows_are_flushed_in_batches(sink_args):
+    output_format, path = sink_args
+    with open_sink(output_format, path, batch_size=3) as sink:
+        sink.write('comments_data', comments(0, 2))
+        assert sink.offsets.get('comments_data', 0) == 0
+        sink.write('comments_data', comments(2, 4))
+        assert sink.offsets['comments_data'] == 4
+        sink.write('comments_data', comments(4, 5))
+    with open_sink(output_format, path) as sink:
+        df = sink.read('comments_data')
+    assert df['comment_id'].tolist() == [str(i) for i in range(5)]
+    assert df['likes'].tolist() == list(range(5))
+
+
+def test_reopened_sink_appends_after_stored_rows(sink_args):
+    output_format, path = sink_args
+    with open_sink(output_format, path) as sink:
+        sink.write('comments_data', comments(0, 3))
+        sink.write('videos_data', [VideoRecord(video_id='1', video_playcount=10)])
+    with open_sink(output_format, path) as sink:
+        assert sink.offsets == {'comments_data': 3, 'videos_data': 1}
+        sink.write('comments_data', comments(3, 5))
+        sink.flush()
+        assert sink.offsets['comments_data'] == 5
+        assert sink.read('comments_data')['comment_id'].tolist() == [str(i) for i in range(5)]
+        assert sink.read('videos_data')['video_playcount'].tolist() == [10]
+
+
+def test_truncate_drops_rows_after_the_offsets(sink_args):
+    output_format, path = sink_args
+    with open_sink(output_format, path, batch_size=2) as sink:
+        sink.write('comments_data', comments(0, 5))
+        sink.write('videos_data', [VideoRecord(video_id='1')])
+        sink.flush()
+        committed = {'comments_data': 3}
+        sink.write('comments_data', comments(5, 6))
+    with open_sink(output_format, path, batch_size=2) as sink:
+        sink.truncate(committed)
+        # Tables missing from the offsets were never committed, they are emptied
+        assert sink.offsets == {'comments_data': 3, 'videos_data': 0}
+        assert sink.read('comments_data')['comment_id'].tolist() == ['0', '1', '2']
+        assert len(sink.read('videos_data')) == 0
+        sink.write('comments_data', comments(3, 4))
+    with open_sink(output_format, path) as sink:
+        assert sink.read('comments_data')['comment_id'].tolist() == ['0', '1', '2', '3']
+
+
+def test_truncate_keeps_rows_under_the_offsets(sink_args):
+    output_format, path = sink_args
+    with open_sink(output_format, path) as sink:
+        sink.write('comments_data', comments(0, 2))
+    with open_sink(output_format, path) as sink:
+        sink.truncate({'comments_data': 5})
+        assert sink.offsets['comments_data'] == 2
+        assert len(sink.read('comments_data')) == 2
+
+
+def test_guess_format(sink_args):
+    output_format, path = sink_args
+    with open_sink(output_format, path) as sink:
+        sink.write('comments_data', comments(0, 1))
+    assert guess_format(sink.path) == output_format
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        open_sink('csv', str(tmp_path / 'run'))
+
+
+def test_incomplete_backend_fails_on_creation(tmp_path):
+    class CsvSink(OutputSink):
+        def _append(self, table, schema, columns):
+            pass
+
+    with pytest.raises(TypeError, match='abstract'):
+        CsvSink(str(tmp_path / 'run.csv'))
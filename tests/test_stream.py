@@ -0,0 +1,46 @@
+"""Streaming api: stream_videos and stream_comments on an offline session pool"""
+import asyncio
+
+import pytest
+
+from tests.conftest import feed_item
+
+
+async def collect(stream, timeout:float = 20) -> list:
+    async def consume():
+        return [item async for item in stream]
+    return await asyncio.wait_for(consume(), timeout)
+
+
+@pytest.mark.parametrize('pool_size', [1, 2])
+def test_stream_videos_with_comments(offline_manager, pool_size):
+    manager = offline_manager({'petro': [feed_item(1000 + i) for i in range(50)]}, pool_size=pool_size)
+    # Discovery must not hold the only session while the miners page the comments
+    videos = asyncio.run(collect(manager.stream_videos(['petro'], 20, comment_amount=2, concurrency=1)))
+    assert [record.video_id for record, _ in videos] == [str(1000 + i) for i in range(20)]
+    assert all([comment.comment_id for comment in comments] == [f'{record.video_id}-0', f'{record.video_id}-1']
+               for record, comments in videos)
+
+
+def test_stream_videos_pages_the_feed(offline_manager):
+    manager = offline_manager({'petro': [feed_item(i) for i in range(80)], 'galan': [feed_item(i) for i in range(70, 90)]})
+    videos = asyncio.run(collect(manager.stream_videos(['petro', 'galan'], 80, concurrency=3)))
+    # Three feed pages of 35 items, videos already streamed for another hashtag are skipped
+    assert sorted(int(record.video_id) for record, _ in videos) == list(range(90))
+    assert manager.metrics.counters[('discovery_pages_total', (('ent_type', 'hashtag'),))] == 4
+
+
+def test_stream_videos_skips_videos_of_previous_runs(offline_manager):
+    manager = offline_manager({'petro': [feed_item(i) for i in range(10)]})
+    first = asyncio.run(collect(manager.stream_videos(['petro'], 5)))
+    second = asyncio.run(collect(manager.stream_videos(['petro'], 10)))
+    assert [record.video_id for record, _ in first] == [str(i) for i in range(5)]
+    assert [record.video_id for record, _ in second] == [str(i) for i in range(5, 10)]
+
+
+def test_stream_comments(offline_manager):
+    manager = offline_manager({})
+    comments = asyncio.run(collect(manager.stream_comments(['1', '2'], 30, concurrency=2)))
+    assert sorted(comment.comment_id for comment in comments) == sorted(f'{video}-{i}' for video in '12' for i in range(30))
+    # Comments already streamed are skipped by the next run
+    assert asyncio.run(collect(manager.stream_comments(['1'], 30))) == []
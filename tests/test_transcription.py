@@ -0,0 +1,76 @@
+"""Transcriptions: subtitle selection, pooled downloads and the batch of get_video_transcription"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from tests.conftest import feed_item
+from TikTokManager.transcription import TranscriptionFetcher, select_transcription
+
+SUBTITLES = {'/hola.vtt': 'WEBVTT\n\n00:00.000 --> 00:01.000\nhola\n\n00:01.000 --> 00:02.000\nhola\n\n'
+                          '00:02.000 --> 00:03.500\nqué tal\namigos\n',
+             '/hello.vtt': 'WEBVTT\n\n00:00.000 --> 00:01.000\nhello\n'}
+
+
+class SubtitleHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = SUBTITLES.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/vtt')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def subtitle_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SubtitleHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_select_transcription():
+    infos = [{"LanguageCodeName": 'spa-ES', "Url": 'es'}, {"LanguageCodeName": 'eng-US', "Url": 'en'}]
+    assert select_transcription(infos) == ('eng-US', 'en')
+    assert select_transcription(infos[:1]) == ('spa-ES', 'es')
+    assert select_transcription(None) == (None, None)
+    assert select_transcription([]) == (None, None)
+
+
+def test_fetch_streams_cues_and_flat_text(subtitle_server):
+    fetcher = TranscriptionFetcher(per_host=2)
+    try:
+        assert fetcher.fetch_cues(f'{subtitle_server}/hola.vtt') == [(0.0, 2.0, 'hola'), (2.0, 3.5, 'qué tal\namigos')]
+        assert fetcher.fetch(f'{subtitle_server}/hola.vtt') == 'hola qué tal amigos'
+        with pytest.raises(requests.HTTPError):
+            fetcher.fetch(f'{subtitle_server}/missing.vtt')
+    finally:
+        fetcher.close()
+
+
+def test_video_transcriptions_report_failures_per_video(offline_manager, subtitle_server, tmp_path):
+    def with_subtitle(video_id:int, path:str) -> dict:
+        item = feed_item(video_id)
+        item['video'] = {"subtitleInfos": [{"LanguageCodeName": 'spa-ES', "Url": f'{subtitle_server}{path}'}]}
+        return item
+
+    items = [with_subtitle(1, '/hola.vtt'), with_subtitle(2, '/hello.vtt'), with_subtitle(3, '/missing.vtt'),
+             feed_item(4), feed_item(5)]
+    manager = offline_manager({'petro': items}, broken={'5'})
+    path = manager.get_video_transcription(['1', '2', '3', '4', '5'], json_concurrency=2)
+    with open(path, encoding='utf-8') as file:
+        assert file.read() == '1:\nhola qué tal amigos\n\n\n2:\nhello\n\n\n'
+    errors = {dict(labels)['type']: value for (name, labels), value in manager.metrics.counters.items()
+              if name == 'errors_total' and ('stage', 'transcription_batch') in labels}
+    assert errors == {"HTTPError": 1, "PermanentError": 1}
@@ -0,0 +1,103 @@
+"""Incremental WebVTT parser: chunk boundaries, skipped blocks and rolling captions"""
+import pytest
+
+from TikTokManager.vtt import iter_cues, parse_text, parse_timestamp
+
+DOCUMENT = (
+    "\ufeffWEBVTT\n"
+    "Kind: captions\n"
+    "\n"
+    "NOTE this block is a comment\n"
+    "with two lines 00:00:01.000 --> 00:00:02.000\n"
+    "\n"
+    "STYLE\n"
+    "::cue { color: red }\n"
+    "\n"
+    "1\n"
+    "00:00:00.000 --> 00:00:01.500 align:start\n"
+    "<c.yellow>Hola</c> a todos\n"
+    "\n"
+    "2\n"
+    "00:01.500 --> 00:03.000\n"
+    "Tom &amp; Jerry\n"
+    "en Bogotá\n"
+    "\n"
+    "01:00:00.000 --> 01:00:01.000\n"
+    "fin\n"
+)
+CUES = [(0.0, 1.5, 'Hola a todos'), (1.5, 3.0, 'Tom & Jerry\nen Bogotá'), (3600.0, 3601.0, 'fin')]
+
+
+def chunked(text:str, size:int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_parse_timestamp():
+    assert parse_timestamp('00:00:01.250') == 1.25
+    assert parse_timestamp('01:02.5') == 62.5
+    assert parse_timestamp('1:00:00.000') == 3600.0
+
+
+def test_whole_document():
+    assert list(iter_cues([DOCUMENT])) == CUES
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+def test_any_chunk_boundary(size):
+    assert list(iter_cues(chunked(DOCUMENT, size))) == CUES
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 13])
+def test_crlf_split_between_chunks(size):
+    document = DOCUMENT.replace('\n', '\r\n')
+    assert list(iter_cues(chunked(document, size))) == CUES
+    # A lone "\r" at the end of a chunk is a line break too
+    assert list(iter_cues(chunked(DOCUMENT.replace('\n', '\r'), size))) == CUES
+
+
+def test_note_and_style_blocks_are_skipped():
+    text = parse_text(DOCUMENT)
+    assert 'comment' not in text
+    assert 'color' not in text
+    assert '00:00:01.000' not in text
+
+
+def test_header_without_blank_line_and_no_trailing_newline():
+    document = "WEBVTT\n00:00:00.000 --> 00:00:01.000\nsin salto"
+    assert list(iter_cues([document])) == [(0.0, 1.0, 'sin salto')]
+
+
+def test_malformed_timing_skips_the_block():
+    document = "WEBVTT\n\nxx:yy --> 00:00:01.000\nperdido\n\n00:00:01.000 --> 00:00:02.000\nbien\n"
+    assert list(iter_cues([document])) == [(1.0, 2.0, 'bien')]
+
+
+ROLLING = (
+    "WEBVTT\n\n"
+    "00:00:00.000 --> 00:00:02.000\n"
+    "el metro de\n\n"
+    "00:00:02.000 --> 00:00:04.000\n"
+    "el metro de\n"
+    "Bogotá va lento\n\n"
+    "00:00:04.000 --> 00:00:05.000\n"
+    "Bogotá va lento\n\n"
+    "00:00:05.000 --> 00:00:06.000\n"
+    "fin\n"
+)
+
+
+def test_rolling_captions_are_merged():
+    assert list(iter_cues([ROLLING])) == [(0.0, 2.0, 'el metro de'),
+                                          (2.0, 5.0, 'Bogotá va lento'),
+                                          (5.0, 6.0, 'fin')]
+    assert parse_text(ROLLING) == 'el metro de Bogotá va lento fin'
+
+
+def test_rolling_captions_without_dedup():
+    cues = list(iter_cues(chunked(ROLLING, 4), dedup=False))
+    assert [cue[2] for cue in cues] == ['el metro de', 'el metro de\nBogotá va lento', 'Bogotá va lento', 'fin']
+
+
+def test_empty_document():
+    assert list(iter_cues(['WEBVTT\n\n'])) == []
+    assert parse_text('') == ''
@@ -0,0 +1,60 @@
+"""Incremental discovery: watermarks only move past videos that were stored"""
+import asyncio
+
+from tests.conftest import feed_item
+from TikTokManager.work_queue import WorkQueue
+
+FEEDS = {'petro': [feed_item(i) for i in range(10)], 'galan': [feed_item(i) for i in range(20, 25)]}
+
+
+def newest(hashtag:str) -> tuple:
+    item = max(FEEDS[hashtag], key=lambda item: item['createTime'])
+    return item['createTime'], item['id']
+
+
+def test_extract_keeps_the_watermark_of_hashtags_with_failed_videos(offline_manager):
+    manager = offline_manager(FEEDS, broken={'3'})
+    manager.extract_videos_data_v2(['petro', 'galan'], 10, 1, output_format='jsonl', export_excel=False, incremental=True)
+    assert manager.watermarks.get('hashtag', 'petro') is None
+    assert manager.watermarks.get('hashtag', 'galan') == newest('galan')
+
+    # The failed video is discovered again, the stored ones are skipped by the dedup index
+    manager = offline_manager(FEEDS)
+    result = manager.extract_videos_data_v2(['petro'], 10, 1, output_format='jsonl', export_excel=False, incremental=True)
+    with open(f"{result['sink_path']}/videos_data.jsonl", encoding='utf-8') as file:
+        assert file.read().count('"video_id": "3"') == 1
+    assert manager.watermarks.get('hashtag', 'petro') == newest('petro')
+
+
+def test_resumed_run_commits_the_watermark_once_failed_videos_are_mined(offline_manager):
+    manager = offline_manager(FEEDS, broken={'3'})
+    run_id = manager.extract_videos_data_v2(['petro'], 10, 0, output_format='jsonl', export_excel=False,
+                                            incremental=True)['run_id']
+    assert manager.watermarks.get('hashtag', 'petro') is None
+    manager = offline_manager(FEEDS)
+    manager.extract_videos_data_v2(resume=run_id, export_excel=False)
+    assert manager.watermarks.get('hashtag', 'petro') == newest('petro')
+
+
+def test_stream_keeps_the_watermark_of_hashtags_with_failed_videos(offline_manager):
+    manager = offline_manager(FEEDS, broken={'3'})
+
+    async def consume():
+        return [record async for record, _ in manager.stream_videos(['petro', 'galan'], 10, incremental=True)]
+
+    assert len(asyncio.run(consume())) == 14
+    assert manager.watermarks.get('hashtag', 'petro') is None
+    assert manager.watermarks.get('hashtag', 'galan') == newest('galan')
+
+
+def test_worker_commits_the_watermark_once_every_video_is_mined(offline_manager, tmp_path):
+    queue_path = str(tmp_path / 'queue.sqlite')
+    manager = offline_manager(FEEDS, broken={'3'})
+    manager.enqueue_hashtags(queue_path, ['petro', 'galan'], 10, 1, incremental=True)
+    result = manager.run_worker(queue_path, worker_id='w1', output_format='jsonl', concurrency=2, poll_interval=0)
+    assert result['processed'] == 16
+    queue = WorkQueue(queue_path)
+    assert queue.stats() == {"discover": {"done": 2}, "mine": {"done": 14, "failed": 1}}
+    queue.close()
+    assert manager.watermarks.get('hashtag', 'petro') is None
+    assert manager.watermarks.get('hashtag', 'galan') == newest('galan')
@@ -0,0 +1,112 @@
+"""Work queue: dedup keys, leases, visibility timeout and max attempts"""
+import time
+
+import pytest
+
+from TikTokManager.work_queue import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), visibility_timeout=60, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_dedup_key_adds_a_job_once(queue):
+    assert queue.enqueue('discover', {"hashtag": 'petro'}, dedup_key='discover:petro')
+    assert not queue.enqueue('discover', {"hashtag": 'petro'}, dedup_key='discover:petro')
+    assert queue.enqueue('discover', {"hashtag": 'galan'})
+    assert queue.pending() == 2
+    assert queue.stats() == {"discover": {"queued": 2}}
+
+
+def test_leased_job_is_invisible_to_other_workers(queue):
+    queue.enqueue('discover', {"hashtag": 'petro'})
+    queue.enqueue('mine', {"url": 'https://www.tiktok.com/@user/video/1'})
+    job = queue.claim('worker-a', kinds=['mine'])
+    assert job['kind'] == 'mine'
+    assert job['payload'] == {"url": 'https://www.tiktok.com/@user/video/1'}
+    assert job['attempts'] == 1
+    assert queue.claim('worker-b', kinds=['mine']) is None
+    assert queue.claim('worker-b')['kind'] == 'discover'
+    assert queue.claim('worker-c') is None
+    assert queue.pending() == 2
+
+
+def test_expired_lease_goes_back_to_the_queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), visibility_timeout=0.2, max_attempts=3)
+    queue.enqueue('mine', {"url": 'a'})
+    job = queue.claim('worker-a')
+    assert queue.claim('worker-b') is None
+    time.sleep(0.3)
+    retaken = queue.claim('worker-b')
+    assert retaken['id'] == job['id']
+    assert retaken['attempts'] == 2
+    # The first worker lost its lease, its completion is ignored
+    queue.complete([job['id']], 'worker-a')
+    assert queue.stats() == {"mine": {"leased": 1}}
+    queue.complete([job['id']], 'worker-b', [{"videos": 1}])
+    assert queue.stats() == {"mine": {"done": 1}}
+    assert queue.pending() == 0
+    queue.close()
+
+
+def test_extend_keeps_the_lease(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), visibility_timeout=0.4, max_attempts=3)
+    queue.enqueue('mine', {"url": 'a'})
+    job = queue.claim('worker-a')
+    time.sleep(0.25)
+    queue.extend([job['id']], 'worker-a')
+    # Extending someone else's lease does nothing
+    queue.extend([job['id']], 'worker-b')
+    time.sleep(0.25)
+    assert queue.claim('worker-b') is None
+    queue.close()
+
+
+def test_failed_job_is_retried_until_max_attempts(queue):
+    queue.enqueue('mine', {"url": 'a'})
+    job = queue.claim('worker-a')
+    queue.fail(job['id'], 'worker-a', 'timeout')
+    assert queue.stats() == {"mine": {"queued": 1}}
+    job = queue.claim('worker-b')
+    assert job['attempts'] == 2
+    queue.fail(job['id'], 'worker-b', 'timeout')
+    assert queue.stats() == {"mine": {"failed": 1}}
+    assert queue.claim('worker-c') is None
+    assert queue.pending() == 0
+
+
+def test_expired_lease_counts_as_an_attempt(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), visibility_timeout=0.1, max_attempts=2)
+    queue.enqueue('mine', {"url": 'a'})
+    queue.claim('worker-a')
+    time.sleep(0.15)
+    assert queue.claim('worker-b')['attempts'] == 2
+    time.sleep(0.15)
+    # Poison job: its worker died on every attempt
+    assert queue.claim('worker-c') is None
+    assert queue.stats() == {"mine": {"failed": 1}}
+    queue.close()
+
+
+def test_queue_is_shared_between_connections(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    producer = WorkQueue(path)
+    consumer = WorkQueue(path)
+    producer.enqueue('discover', {"hashtag": 'petro'}, dedup_key='petro')
+    assert not consumer.enqueue('discover', {"hashtag": 'petro'}, dedup_key='petro')
+    job = consumer.claim(WorkQueue.default_worker_id())
+    assert job['payload'] == {"hashtag": 'petro'}
+    assert producer.claim('other') is None
+    producer.close()
+    consumer.close()
+
+
+def test_statuses_by_dedup_key(queue):
+    queue.enqueue('mine', {"url": 'a'}, dedup_key='video:1')
+    queue.enqueue('mine', {"url": 'b'}, dedup_key='video:2')
+    job = queue.claim('worker-a')
+    queue.complete([job['id']], 'worker-a')
+    assert queue.statuses(['video:1', 'video:2', 'video:3']) == {'video:1': 'done', 'video:2': 'queued'}